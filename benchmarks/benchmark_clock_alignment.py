@@ -0,0 +1,81 @@
+"""Authors: Cody Baker."""
+from time import perf_counter
+
+import numpy as np
+import spikeextractors as se
+
+from brody_lab_to_nwb.interfaces.clockalignment import ClockAlignedRecordingExtractor, align_sorting, fit_clock_mapping
+from brody_lab_to_nwb.interfaces.customsortingextractor import CustomSortingExtractor
+from fixtures import make_spike_trains
+
+# Scale of the synthetic session, with one pause of the recording clock
+duration = 600.
+sampling_frequency = 30000.
+n_pulses = 500
+pause_pulse = 250
+pause = 0.5
+n_units = 1000
+spikes_per_unit = 5000.
+seed = 0
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(seed=seed)
+    fsm_pulse_times = np.linspace(5., duration - 5., n_pulses)
+    recording_pulse_times = (fsm_pulse_times - 12.5) / 1.0001 + rng.normal(scale=1e-5, size=n_pulses)
+    recording_pulse_times[pause_pulse:] -= pause
+    t0 = perf_counter()
+    clock_mapping = fit_clock_mapping(source_times=recording_pulse_times, target_times=fsm_pulse_times)
+    fit_time = perf_counter() - t0
+    fit_error = np.max(np.abs(clock_mapping(recording_pulse_times) - fsm_pulse_times))
+
+    recording = se.NumpyRecordingExtractor(
+        timeseries=np.zeros((1, int(duration * sampling_frequency)), dtype="int16"),
+        sampling_frequency=sampling_frequency
+    )
+    aligned_recording = ClockAlignedRecordingExtractor(recording=recording, clock_mapping=clock_mapping)
+    t0 = perf_counter()
+    timestamps = aligned_recording.frame_to_time(np.arange(aligned_recording.get_num_frames()))
+    timestamps_time = perf_counter() - t0
+    t0 = perf_counter()
+    clock_segments = aligned_recording.get_clock_segments()
+    segments_time = perf_counter() - t0
+    first_frames, starting_times, rates = clock_segments
+    frames = np.arange(len(timestamps))
+    segment_indices = np.searchsorted(first_frames, frames, side="right") - 1
+    segment_timestamps = (
+        starting_times[segment_indices] + (frames - first_frames[segment_indices]) / rates[segment_indices]
+    )
+    max_timestamp_difference = np.max(np.abs(segment_timestamps - timestamps))
+
+    sorting = CustomSortingExtractor()
+    sorting.set_sampling_frequency(sampling_frequency=sampling_frequency)
+    spike_trains = make_spike_trains(n_units=n_units, spikes_per_unit=spikes_per_unit, duration=duration, rng=rng)
+    offsets = np.zeros(n_units + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in spike_trains], out=offsets[1:])
+    sorting.add_units(
+        unit_ids=list(range(n_units)),
+        spike_times=np.round(np.concatenate(spike_trains) * sampling_frequency),
+        offsets=offsets
+    )
+    t0 = perf_counter()
+    per_unit = [timestamps[sorting.get_unit_spike_train(unit_id=x).astype("int64")] for x in range(n_units)]
+    per_unit_time = perf_counter() - t0 + timestamps_time
+    t0 = perf_counter()
+    aligned_sorting = align_sorting(sorting=sorting, clock_mapping=clock_mapping)
+    bulk_time = perf_counter() - t0
+    max_spike_time_difference = np.max(np.abs(aligned_sorting.get_spike_trains()[0] - np.concatenate(per_unit)))
+
+    print(
+        f"Fit {len(clock_mapping)} segments from {n_pulses} pulses in {fit_time * 1e3:.1f} ms, error {fit_error:.1e} s"
+    )
+    print(
+        f"Per-sample timestamps: {timestamps.nbytes / 1e6:.0f} MB in {timestamps_time:.2f}s; "
+        f"clock segments: {sum(x.nbytes for x in clock_segments)} bytes in {segments_time * 1e3:.2f} ms; "
+        f"max difference {max_timestamp_difference:.1e} s"
+    )
+    print(
+        f"{n_units} units: indexed from the per-sample timestamps {per_unit_time:.3f}s, "
+        f"align_sorting {bulk_time:.3f}s ({per_unit_time / bulk_time:.1f}x); "
+        f"max difference {max_spike_time_difference:.1e} s"
+    )
@@ -0,0 +1,78 @@
+"""Authors: Cody Baker."""
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import spikeextractors as se
+import spiketoolkit as st
+
+from brody_lab_to_nwb.sortingpipeline import save_recording
+from brody_lab_to_nwb.spikeglxpreprocessing import stream_common_median_reference
+from fixtures import write_spikeglx
+
+# Scale of the synthetic SpikeGLX AP file
+n_channels = 384
+duration = 10.
+freq_min = 300.  # set to None to only reference
+n_jobs = 4
+chunk_mb = 100
+seed = 0
+
+
+def read_through(file_path: Path, block_mb: float = 100):
+    """Read a file sequentially without processing it, as a reference for the disk bandwidth."""
+    with open(file_path, mode="rb") as f:
+        while f.read(int(block_mb * 1e6)):
+            pass
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as folder:
+        ap_file_path, _ = write_spikeglx(folder_path=folder, n_channels=n_channels, duration=duration, seed=seed)
+        file_mb = ap_file_path.stat().st_size / 1e6
+
+        t0 = perf_counter()
+        read_through(file_path=ap_file_path)
+        read_time = perf_counter() - t0
+
+        t0 = perf_counter()
+        recording = se.SpikeGLXRecordingExtractor(file_path=ap_file_path)
+        if freq_min is not None:
+            recording = st.preprocessing.highpass_filter(recording, freq_min=freq_min)
+        recording = st.preprocessing.common_reference(recording)
+        spiketoolkit_recording = save_recording(
+            recording, folder=Path(folder) / "spiketoolkit", n_jobs=n_jobs, chunk_mb=chunk_mb
+        )
+        spiketoolkit_time = perf_counter() - t0
+
+        t0 = perf_counter()
+        streamed_recording = stream_common_median_reference(
+            file_path=ap_file_path,
+            folder=Path(folder) / "streamed",
+            freq_min=freq_min,
+            n_jobs=n_jobs,
+            chunk_mb=chunk_mb
+        )
+        streamed_time = perf_counter() - t0
+
+        chunk_size = int(chunk_mb * 1e6 // (np.dtype("int16").itemsize * n_channels))
+
+        max_difference = max(
+            np.max(
+                np.abs(
+                    streamed_recording.get_traces(start_frame=x, end_frame=x + chunk_size, return_scaled=False)
+                    .astype("float32")
+                    - spiketoolkit_recording.get_traces(start_frame=x, end_frame=x + chunk_size, return_scaled=False)
+                )
+            )
+            for x in range(0, streamed_recording.get_num_frames(), chunk_size)
+        )  # chunk by chunk, as the full traces of a long recording do not fit in memory
+        del spiketoolkit_recording, streamed_recording
+
+    print(f"{n_channels} channels, {duration:.0f}s ({file_mb:.0f} MB); {n_jobs} jobs; high-pass: {freq_min}")
+    print(f"Maximum difference: {max_difference:.2f} bits")
+    print(f"Sequential read: {read_time:.2f}s ({file_mb / read_time:.0f} MB/s)")
+    print(f"spiketoolkit common_reference: {spiketoolkit_time:.2f}s ({file_mb / spiketoolkit_time:.0f} MB/s)")
+    print(f"Streamed common median reference: {streamed_time:.2f}s ({file_mb / streamed_time:.0f} MB/s)")
+    print(f"Speedup: {spiketoolkit_time / streamed_time:.1f}x")
@@ -0,0 +1,77 @@
+"""Authors: Cody Baker."""
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from brody_lab_to_nwb.interfaces.protocol_info.protocol_info_utils import make_beh_df, find_loudness, find_first_sound
+from fixtures import make_synthetic_behs
+
+# Scale of the synthetic session
+n_trials = 10000
+seed = 0
+
+
+def make_beh_df_per_trial(beh_info):
+    """The previous implementation of make_beh_df, which extracts the parsed events one trial at a time."""
+    beh_df = pd.DataFrame()
+    pd.options.mode.chained_assignment = None
+    beh_df['trial_num'] = np.arange(1, beh_info['n_completed_trials'] + 1)
+    prev_side_adj = np.roll(beh_info['prev_side'], 1)
+    prev_side_adj = np.where(prev_side_adj == 114, 'RIGHT', 'LEFT')
+    prev_side_adj[0] = 'N/A'
+    beh_df['hit_hist'] = beh_info['hit_history']
+    beh_df['hit_hist'] = beh_df['hit_hist'].mask(beh_df['hit_hist'] == 1.0, "hit")
+    beh_df['hit_hist'] = beh_df['hit_hist'].mask(beh_df['hit_hist'] == 0.0, "miss")
+    beh_df['hit_hist'][beh_df['hit_hist'].isnull()] = "viol"
+    beh_df['delay'] = beh_info['delay']
+    beh_df['pair_hist'] = beh_info['pair_history']
+    beh_df['correct_side'] = beh_info['correct_side']
+    beh_df['prev_side'] = prev_side_adj
+    beh_df['aud1_sigma'] = beh_info['aud1_sigma']
+    beh_df['aud2_sigma'] = beh_info['aud2_sigma']
+    parsed_events_dict = beh_info["parsed_events"]
+    n_events = len(parsed_events_dict)
+    c_poke, hit_state, end_state = (np.zeros(n_events) for _ in range(3))
+    aud1_on, aud1_off, aud2_on, aud2_off = (np.zeros(n_events) for _ in range(4))
+    for trial in range(n_events):
+        c_poke[trial] = parsed_events_dict[trial]['states']['cp'][0]
+        end_state[trial] = parsed_events_dict[trial]['states']['check_next_trial_ready'][1]
+        if beh_df['hit_hist'][trial] == 'viol':
+            hit_state[trial] = aud1_on[trial] = aud1_off[trial] = aud2_on[trial] = aud2_off[trial] = float("NaN")
+        else:
+            hit_name = 'hit_state' if beh_df['hit_hist'][trial] == 'hit' else 'second_hit_state'
+            hit_state[trial] = parsed_events_dict[trial]['states'][hit_name][0]
+            aud1_on[trial] = parsed_events_dict[trial]['waves']['stimAUD1'][0]
+            aud1_off[trial] = parsed_events_dict[trial]['waves']['stimAUD1'][1]
+            aud2_on[trial] = parsed_events_dict[trial]['waves']['stimAUD2'][0]
+            aud2_off[trial] = parsed_events_dict[trial]['waves']['stimAUD2'][1]
+    beh_df['c_poke'] = c_poke
+    beh_df['end_state'] = end_state
+    beh_df['hit_state'] = hit_state
+    beh_df['aud1_on'] = aud1_on
+    beh_df['aud1_off'] = aud1_off
+    beh_df['aud2_on'] = aud2_on
+    beh_df['aud2_off'] = aud2_off
+    find_loudness(beh_df)
+    find_first_sound(beh_df)
+    pd.options.mode.chained_assignment = 'warn'
+    return beh_df
+
+
+if __name__ == "__main__":
+    beh_info = make_synthetic_behs(n_trials=n_trials, seed=seed)
+
+    t0 = perf_counter()
+    per_trial_df = make_beh_df_per_trial(beh_info)
+    per_trial_time = perf_counter() - t0
+
+    t0 = perf_counter()
+    vectorized_df = make_beh_df(beh_info)
+    vectorized_time = perf_counter() - t0
+
+    pd.testing.assert_frame_equal(per_trial_df, vectorized_df)
+    print(f"{n_trials} trials; outputs are identical")
+    print(f"Per-trial make_beh_df: {per_trial_time:.3f}s")
+    print(f"Vectorized make_beh_df: {vectorized_time:.3f}s")
+    print(f"Speedup: {per_trial_time / vectorized_time:.1f}x")
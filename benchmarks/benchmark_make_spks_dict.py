@@ -0,0 +1,98 @@
+"""Authors: Cody Baker."""
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from brody_lab_to_nwb.interfaces.matreader import read_mat, read_mat_struct_array
+from brody_lab_to_nwb.interfaces.protocol_info.protocol_info_utils import make_spks_dict
+from fixtures import write_analysis_clusters
+
+# Scale of the synthetic PWMspkS struct array. The parse of the units is timed apart from the .mat read, which
+# dominates and takes about as long either way, so the conversion as a whole does not get faster.
+n_units = 1000
+spikes_per_unit = 2000.
+seed = 0
+
+
+def make_spks_dict_per_cell(spks_info):
+    """The previous implementation of make_spks_dict, which appends the fields of each unit to Python lists."""
+    spks_dict = dict()
+    ncells = len(spks_info)
+    trode_nums = []
+    m_waves = []
+    s_waves = []
+    spk_qual = []
+    spk_times = []
+    spks_dict['date'] = spks_info[0]['date']
+    spks_dict['spk2fsm'] = np.atleast_2d(spks_info[0]['behav_session']['spk2fsm_rt'])[0]
+    spks_dict['fs'] = spks_info[0]['fs']
+    for cell in range(ncells):
+        trode_nums.append(spks_info[cell]['trodenum'])
+        spk_times.append(np.atleast_1d(spks_info[cell]['event_ts_fsm']))  # In behavior time
+        m_waves.append(spks_info[cell]['waves_mn'].reshape(4, 32))
+        s_waves.append(spks_info[cell]['waves_std'].reshape(4, 32))
+
+        if spks_info[cell]['mua'] == 1:
+            spk_qual.append('multi')
+        elif spks_info[cell]['single'] == 1:
+            spk_qual.append('single')
+        else:
+            raise TypeError("Unit not marked as multi or single")
+    spks_dict['trode_nums'] = trode_nums
+    spks_dict['spk_qual'] = spk_qual
+    spks_dict['spk_times'] = spk_times
+    spks_dict['mean_wav'] = m_waves  # units x channel
+    spks_dict['std_wav'] = s_waves
+    return spks_dict
+
+
+def to_arrays_per_cell(spks_dict):
+    """The conversion of the per-cell lists into the arrays written by AnalysisClustersSortingInterface."""
+    spike_time_offsets = np.zeros(len(spks_dict["spk_times"]) + 1, dtype=np.int64)
+    np.cumsum([len(spk_times) for spk_times in spks_dict["spk_times"]], out=spike_time_offsets[1:])
+    return dict(
+        trode_nums=np.array(spks_dict["trode_nums"]),
+        spk_qual=np.array(spks_dict["spk_qual"], dtype=str),
+        spike_times=np.concatenate([np.empty(0)] + spks_dict["spk_times"]),
+        spike_time_offsets=spike_time_offsets,
+        mean_wav=np.array(spks_dict["mean_wav"]),
+        std_wav=np.array(spks_dict["std_wav"])
+    )
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = Path(folder) / "ksphy_clusters_foranalysis.mat"
+        write_analysis_clusters(file_path=file_path, n_units=n_units, spikes_per_unit=spikes_per_unit, seed=seed)
+
+        t0 = perf_counter()
+        with read_mat(file_path) as mat:
+            spks_info = mat["PWMspkS"]
+        per_cell_read_time = perf_counter() - t0
+        t0 = perf_counter()
+        per_cell_dict = to_arrays_per_cell(make_spks_dict_per_cell(spks_info))
+        per_cell_time = perf_counter() - t0
+
+        t0 = perf_counter()
+        spks_info = read_mat_struct_array(file_path=file_path, variable_name="PWMspkS")
+        preallocated_read_time = perf_counter() - t0
+        t0 = perf_counter()
+        preallocated_dict = make_spks_dict(spks_info)
+        preallocated_time = perf_counter() - t0
+
+        with read_mat(file_path) as mat:
+            lazy_dict = make_spks_dict(mat["PWMspkS"])
+
+    for key, value in per_cell_dict.items():
+        np.testing.assert_array_equal(value, preallocated_dict[key])
+        np.testing.assert_array_equal(value, lazy_dict[key])
+    print(f"{n_units} units; outputs are identical")
+    print(f"Per-cell make_spks_dict: {per_cell_time:.3f}s (+ {per_cell_read_time:.3f}s to read)")
+    print(f"Preallocated make_spks_dict: {preallocated_time:.3f}s (+ {preallocated_read_time:.3f}s to read)")
+    print(f"Speedup of the parse alone: {per_cell_time / preallocated_time:.1f}x")
+    print(
+        "Speedup including the read, i.e. end to end: "
+        f"{(per_cell_read_time + per_cell_time) / (preallocated_read_time + preallocated_time):.1f}x"
+    )
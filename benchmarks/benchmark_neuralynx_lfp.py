@@ -0,0 +1,59 @@
+"""Authors: Cody Baker."""
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+import numpy as np
+from scipy import signal
+
+from brody_lab_to_nwb.interfaces.neuralynxlfpinterface import NeuralynxLFPInterface
+from brody_lab_to_nwb.interfaces.utils import make_nlx_extractor
+from fixtures import write_neuralynx
+
+# Scale of the synthetic Neuralynx session
+n_channels = 32
+duration = 120.
+lfp_sampling_frequency = 1000.
+max_workers = 4
+read_mb = 64.
+buffer_frames = 60000  # decimated frames requested at a time, as by the buffer of the NWB data chunk iterator
+seed = 0
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as folder:
+        write_neuralynx(folder_path=folder, n_channels=n_channels, duration=duration, seed=seed)
+
+        tracemalloc.start()
+        t0 = perf_counter()
+        wideband_recording = make_nlx_extractor(folder_path=folder)
+        wideband_traces = wideband_recording.get_traces(return_scaled=False).astype("float64")
+        decimation_factor = round(wideband_recording.get_sampling_frequency() / lfp_sampling_frequency)
+        sos = signal.butter(8, 0.8 / decimation_factor, btype="lowpass", output="sos")
+        in_memory_lfp = np.rint(signal.sosfiltfilt(sos, wideband_traces, axis=1)[:, ::decimation_factor])
+        in_memory_time = perf_counter() - t0
+        in_memory_peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        del wideband_traces
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        t0 = perf_counter()
+        lfp_recording = NeuralynxLFPInterface(
+            folder_path=folder,
+            lfp_sampling_frequency=lfp_sampling_frequency,
+            max_workers=max_workers,
+            read_mb=read_mb
+        ).recording_extractor
+        max_difference = 0
+        for start_frame in range(0, lfp_recording.get_num_frames(), buffer_frames):
+            end_frame = min(start_frame + buffer_frames, lfp_recording.get_num_frames())
+            lfp_traces = lfp_recording.get_traces(start_frame=start_frame, end_frame=end_frame, return_scaled=False)
+            max_difference = max(max_difference, np.max(np.abs(lfp_traces - in_memory_lfp[:, start_frame:end_frame])))
+        streamed_time = perf_counter() - t0
+        streamed_peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+
+    print(f"{n_channels} channels, {duration:.0f}s, decimated by {decimation_factor}; {max_workers} workers")
+    print(f"Maximum difference: {max_difference:.0f} bits")
+    print(f"In memory sosfiltfilt: {in_memory_time:.2f}s, peak {in_memory_peak_mb:.0f} MB")
+    print(f"Streamed: {streamed_time:.2f}s, peak {streamed_peak_mb:.0f} MB")
@@ -0,0 +1,73 @@
+"""Authors: Cody Baker."""
+from time import perf_counter
+
+import numpy as np
+import spikeextractors as se
+import spiketoolkit as st
+
+from brody_lab_to_nwb.qualitymetrics import compute_quality_metrics, curate_sorting
+
+# Scale of the synthetic recording and sorting
+n_channels = 32
+duration = 60.
+sampling_frequency = 30000.
+n_units = 200
+seed = 0
+
+metric_names = ["snr", "isi_violation", "firing_rate"]
+thresholds = dict(firing_rate=(0.1, "less"), isi_violation=(0.5, "greater"), snr=(5, "less"))
+
+
+def make_recording_and_sorting():
+    """Gaussian noise traces and random spike trains, with templates stored as by st.postprocessing."""
+    rng = np.random.default_rng(seed=seed)
+    n_frames = int(duration * sampling_frequency)
+    recording = se.NumpyRecordingExtractor(
+        timeseries=rng.normal(scale=10., size=(n_channels, n_frames)).astype("float32"),
+        sampling_frequency=sampling_frequency
+    )
+    sorting = se.NumpySortingExtractor()
+    sorting.set_sampling_frequency(sampling_frequency)
+    for unit_id in range(n_units):
+        sorting.add_unit(unit_id, np.sort(rng.integers(low=0, high=n_frames, size=rng.integers(low=10, high=5000))))
+    st.postprocessing.get_unit_templates(recording, sorting, max_spikes_per_unit=1000, seed=seed)
+    return recording, sorting
+
+
+if __name__ == "__main__":
+    recording, sorting = make_recording_and_sorting()
+
+    t0 = perf_counter()
+    spiketoolkit_metrics = st.validation.compute_quality_metrics(
+        sorting, recording=recording, metric_names=metric_names, as_dataframe=True
+    )
+    spiketoolkit_metrics_time = perf_counter() - t0
+    t0 = perf_counter()
+    spiketoolkit_curated = st.curation.threshold_firing_rates(
+        sorting, duration_in_frames=recording.get_num_frames(), threshold=0.1, threshold_sign="less"
+    )
+    spiketoolkit_curated = st.curation.threshold_isi_violations(
+        spiketoolkit_curated, duration_in_frames=recording.get_num_frames(), threshold=0.5, threshold_sign="greater"
+    )
+    spiketoolkit_curated = st.curation.threshold_snrs(
+        spiketoolkit_curated, recording=recording, threshold=5, threshold_sign="less"
+    )
+    spiketoolkit_curation_time = perf_counter() - t0
+
+    t0 = perf_counter()
+    metrics = compute_quality_metrics(sorting, recording=recording, metric_names=metric_names)
+    metrics_time = perf_counter() - t0
+    t0 = perf_counter()
+    curated = curate_sorting(sorting, quality_metrics=metrics, thresholds=thresholds)
+    curation_time = perf_counter() - t0
+
+    for metric_name in metric_names:
+        np.testing.assert_allclose(metrics[metric_name].to_numpy(), spiketoolkit_metrics[metric_name].to_numpy())
+    assert curated.get_unit_ids() == spiketoolkit_curated.get_unit_ids()
+    print(f"{n_units} units, {n_channels} channels, {duration:.0f}s; metrics and curated units are identical")
+    print(f"spiketoolkit metrics: {spiketoolkit_metrics_time:.3f}s, curation: {spiketoolkit_curation_time:.3f}s")
+    print(f"Single pass metrics: {metrics_time:.3f}s, curation: {curation_time * 1e3:.1f}ms")
+    print(
+        "Speedup of metrics and curation: "
+        f"{(spiketoolkit_metrics_time + spiketoolkit_curation_time) / (metrics_time + curation_time):.1f}x"
+    )
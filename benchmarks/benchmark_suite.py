@@ -0,0 +1,302 @@
+"""Authors: Cody Baker."""
+import argparse
+import importlib
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+
+from pynwb import NWBHDF5IO
+from nwb_conversion_tools.utils.conversion_tools import get_default_nwbfile_metadata, make_nwbfile_from_metadata
+from nwb_conversion_tools.utils.json_schema import dict_deep_update
+
+from fixtures import (
+    write_msorted,
+    write_cells,
+    write_protocol_info,
+    write_analysis_clusters,
+    write_spikeglx,
+    write_neuralynx,
+)
+
+SCALES = dict(
+    small=dict(n_trials=200, n_units=20, spikes_per_unit=1000., n_channels=16, n_ncs_channels=8, duration=10.),
+    medium=dict(n_trials=1000, n_units=100, spikes_per_unit=10000., n_channels=64, n_ncs_channels=32, duration=60.),
+    large=dict(n_trials=5000, n_units=500, spikes_per_unit=50000., n_channels=384, n_ncs_channels=32, duration=300.),
+)
+SESSION_START_TIME = "2019-05-30T12:00:00"
+PACKAGES = ["numpy", "scipy", "h5py", "pandas", "hdmf", "pynwb", "spikeextractors", "nwb_conversion_tools", "neo"]
+
+
+def make_fixtures(folder_path: Path, scale: dict, seed: int = 0):
+    """Write one synthetic version of every source format into the folder, returning the path of each."""
+    spikeglx_ap, spikeglx_lf = write_spikeglx(
+        folder_path=folder_path / "spikeglx", n_channels=scale["n_channels"], duration=scale["duration"], seed=seed
+    )
+    fixtures = dict(
+        msorted=folder_path / "Msorted_A182_2018-10-05.mat",
+        cells=folder_path / "A242_2019_05_30_Cells.mat",
+        protocol_info=folder_path / "protocol_info.mat",
+        analysis_clusters=folder_path / "ksphy_clusters_foranalysis.mat",
+        spikeglx_ap=spikeglx_ap,
+        spikeglx_lf=spikeglx_lf,
+        neuralynx=write_neuralynx(
+            folder_path=folder_path / "neuralynx",
+            n_channels=scale["n_ncs_channels"],
+            duration=scale["duration"],
+            seed=seed
+        )
+    )
+    write_msorted(
+        file_path=fixtures["msorted"],
+        n_trials=scale["n_trials"],
+        n_units=scale["n_units"],
+        spikes_per_unit=scale["spikes_per_unit"],
+        seed=seed
+    )
+    write_cells(file_path=fixtures["cells"], n_trials=scale["n_trials"], seed=seed)
+    write_protocol_info(file_path=fixtures["protocol_info"], n_trials=scale["n_trials"], seed=seed)
+    write_analysis_clusters(
+        file_path=fixtures["analysis_clusters"],
+        n_units=scale["n_units"],
+        spikes_per_unit=scale["spikes_per_unit"],
+        seed=seed
+    )
+    return {name: str(path) for name, path in fixtures.items()}
+
+
+def make_cases(fixtures: dict):
+    """
+    The interfaces and converters to benchmark, with the source data of each.
+
+    SpikeGadgets .rec files are not generated, so the SpikeGadgets converter runs without its recording interface.
+    """
+    interfaces = "brody_lab_to_nwb.interfaces"
+    interface_cases = [
+        ("MSortedProcessed", f"{interfaces}.msorted.msortedprocesseddatainterface.MSortedProcessedInterface",
+         dict(file_path=fixtures["msorted"])),
+        ("MSortedSorting", f"{interfaces}.msorted.msortedsortinginterface.MSortedSortingInterface",
+         dict(file_path=fixtures["msorted"])),
+        ("MSortedSortingLazy", f"{interfaces}.msorted.msortedsortinginterface.MSortedSortingInterface",
+         dict(file_path=fixtures["msorted"], lazy=True)),
+        ("PoissonClicksProcessed",
+         f"{interfaces}.poisson_clicks.poissonclicksprocessedinterface.PoissonClicksProcessedInterface",
+         dict(file_path=fixtures["cells"])),
+        ("ProtocolInfo", f"{interfaces}.protocol_info.protocolinfodatainterface.ProtocolInfoInterface",
+         dict(file_path=fixtures["protocol_info"])),
+        ("AnalysisClusters",
+         f"{interfaces}.protocol_info.analysisclusterssortinginterface.AnalysisClustersSortingInterface",
+         dict(file_path=fixtures["analysis_clusters"])),
+        ("SpikeGLXRecording", "nwb_conversion_tools.SpikeGLXRecordingInterface",
+         dict(file_path=fixtures["spikeglx_ap"])),
+        ("SpikeGLXLFP", "nwb_conversion_tools.SpikeGLXLFPInterface", dict(file_path=fixtures["spikeglx_lf"])),
+        ("NeuralynxRecording", "nwb_conversion_tools.NeuralynxRecordingInterface",
+         dict(folder_path=fixtures["neuralynx"])),
+    ]
+    converter_cases = [
+        ("PoissonClicksNWBConverter", "brody_lab_to_nwb.PoissonClicksNWBConverter", dict(
+            SpikeGLXRecording=dict(file_path=fixtures["spikeglx_ap"]),
+            SpikeGLXLFP=dict(file_path=fixtures["spikeglx_lf"]),
+            ProcessedBehavior=dict(file_path=fixtures["cells"])
+        )),
+        ("BrodyNeuralynxNWBConverter", "brody_lab_to_nwb.BrodyNeuralynxNWBConverter", dict(
+            NeuralynxRecording=dict(folder_path=fixtures["neuralynx"]),
+            ProcessedBehavior=dict(file_path=fixtures["msorted"]),
+            MSorted=dict(file_path=fixtures["msorted"])
+        )),
+        ("BrodySpikeGadgetsNWBConverter", "brody_lab_to_nwb.BrodySpikeGadgetsNWBConverter", dict(
+            ProtocolInfo=dict(file_path=fixtures["protocol_info"]),
+            AnalysisClusters=dict(file_path=fixtures["analysis_clusters"])
+        )),
+    ]
+    return (
+        [dict(name=name, kind="interface", class_path=path, source_data=data) for name, path, data in interface_cases]
+        + [dict(name=name, kind="converter", class_path=path, source_data=data) for name, path, data in converter_cases]
+    )
+
+
+def get_peak_rss_mb():
+    """Peak resident memory of this process so far, in MB."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1e6
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1e6 if sys.platform == "darwin" else peak_rss / 1e3  # bytes on macOS, kB elsewhere
+
+
+def _import_class(class_path: str):
+    module_name, class_name = class_path.rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _profile_stage(stage: str, function):
+    peak_rss_before = get_peak_rss_mb()
+    start_time = time.perf_counter()
+    result = dict(stage=stage, status="ok")
+    value = None
+    try:
+        value = function()
+    except Exception as e:
+        result.update(status="failed", error=f"{type(e).__name__}: {e}")
+    peak_rss = get_peak_rss_mb()
+    result.update(
+        wall_time_s=time.perf_counter() - start_time,
+        peak_rss_mb=peak_rss,
+        peak_rss_increase_mb=peak_rss - peak_rss_before
+    )
+    return value, result
+
+
+def _write_interface(interface, metadata: dict, nwbfile_path: Path):
+    metadata = dict_deep_update(get_default_nwbfile_metadata(), metadata)
+    metadata["NWBFile"].update(session_start_time=SESSION_START_TIME)
+    nwbfile = make_nwbfile_from_metadata(metadata=metadata)
+    interface.run_conversion(nwbfile, metadata)
+    with NWBHDF5IO(str(nwbfile_path), mode="w") as io:
+        io.write(nwbfile)
+
+
+def _write_converter(converter, metadata: dict, nwbfile_path: Path):
+    metadata["NWBFile"].update(session_start_time=SESSION_START_TIME)
+    converter.run_conversion(metadata=metadata, nwbfile_path=str(nwbfile_path), overwrite=True)
+
+
+def run_case(case: dict, output_folder: str):
+    """
+    Time and memory profile the __init__, get_metadata and run_conversion of one interface or converter.
+
+    Meant to run in a fresh process, so that the peak resident memory only reflects this case. The run_conversion
+    stage includes writing the NWB file, as the raw recordings are only read while being written.
+    """
+    nwbfile_path = Path(output_folder) / f"{case['name']}.nwb"
+    data_class = _import_class(class_path=case["class_path"])
+    if case["kind"] == "interface":
+        stages = [
+            ("__init__", lambda: data_class(**case["source_data"])),
+            ("get_metadata", lambda obj: obj.get_metadata()),
+            ("run_conversion", lambda obj, metadata: _write_interface(obj, metadata, nwbfile_path)),
+        ]
+    else:
+        stages = [
+            ("__init__", lambda: data_class(source_data=case["source_data"])),
+            ("get_metadata", lambda obj: obj.get_metadata()),
+            ("run_conversion", lambda obj, metadata: _write_converter(obj, metadata, nwbfile_path)),
+        ]
+
+    results = []
+    values = []
+    for stage, function in stages:
+        if results and results[-1]["status"] != "ok":
+            results.append(dict(stage=stage, status="skipped"))
+            continue
+        value, result = _profile_stage(stage=stage, function=lambda: function(*values))
+        values.append(value)
+        results.append(result)
+    if nwbfile_path.is_file():
+        results[-1].update(bytes_written=nwbfile_path.stat().st_size)
+        nwbfile_path.unlink()
+    return [dict(case=case["name"], kind=case["kind"], **result) for result in results]
+
+
+def get_environment():
+    """Versions of Python, the platform and the main dependencies, along with the current git commit."""
+    versions = dict()
+    for package in PACKAGES:
+        try:
+            versions[package] = getattr(importlib.import_module(package), "__version__", "unknown")
+        except ImportError:
+            versions[package] = None
+    try:
+        git_commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_commit = None
+    return dict(python=platform.python_version(), platform=platform.platform(), git_commit=git_commit, **versions)
+
+
+def find_regressions(results: list, baseline_results: list, tolerance: float = 0.2):
+    """Stages that took more than (1 + tolerance) times as long as in the baseline run, or that no longer succeed."""
+    baseline = {(result["case"], result["stage"]): result for result in baseline_results}
+    regressions = []
+    for result in results:
+        baseline_result = baseline.get((result["case"], result["stage"]))
+        if baseline_result is None or baseline_result["status"] != "ok":
+            continue
+        if result["status"] != "ok":
+            regressions.append(dict(case=result["case"], stage=result["stage"], status=result["status"]))
+        elif result["wall_time_s"] > (1 + tolerance) * baseline_result["wall_time_s"]:
+            regressions.append(
+                dict(
+                    case=result["case"],
+                    stage=result["stage"],
+                    wall_time_s=result["wall_time_s"],
+                    baseline_wall_time_s=baseline_result["wall_time_s"]
+                )
+            )
+    return regressions
+
+
+def run_benchmark_suite(scale_name: str = "small", cases: list = None, seed: int = 0):
+    """Generate the fixtures at the given scale and profile every case, each in its own fresh process."""
+    scale = SCALES[scale_name]
+    with tempfile.TemporaryDirectory() as folder_path:
+        start_time = time.perf_counter()
+        fixtures = make_fixtures(folder_path=Path(folder_path), scale=scale, seed=seed)
+        fixture_time = time.perf_counter() - start_time
+
+        results = []
+        for case in make_cases(fixtures=fixtures):
+            if cases is not None and case["name"] not in cases:
+                continue
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                case_results = executor.submit(run_case, case, folder_path).result()
+            for result in case_results:
+                wall_time = result.get("wall_time_s", float("nan"))
+                peak_rss = result.get("peak_rss_mb", float("nan"))
+                print(
+                    f"{result['case']:>30} {result['stage']:>15} {result['status']:>8} "
+                    f"{wall_time:9.3f} s {peak_rss:9.1f} MB"
+                )
+            results.extend(case_results)
+    return dict(
+        created=datetime.now().isoformat(timespec="seconds"),
+        environment=get_environment(),
+        scale=dict(scale, name=scale_name, seed=seed),
+        fixture_time_s=fixture_time,
+        results=results
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every interface and converter on synthetic data.")
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--cases", nargs="*", default=None, help="Only run the cases with these names.")
+    parser.add_argument("--output", default=None, help="Path of the .json results file.")
+    parser.add_argument("--baseline", default=None, help="Path of a previous .json results file to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown against the baseline.")
+    args = parser.parse_args()
+
+    report = run_benchmark_suite(scale_name=args.scale, cases=args.cases)
+    if args.baseline is not None:
+        with open(args.baseline, mode="r") as f:
+            report["regressions"] = find_regressions(
+                results=report["results"], baseline_results=json.load(f)["results"], tolerance=args.tolerance
+            )
+    output_path = args.output or f"benchmark_results_{args.scale}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(output_path, mode="w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved at {output_path}!")
+    if report.get("regressions"):
+        print(f"{len(report['regressions'])} regressions against {args.baseline}:")
+        for regression in report["regressions"]:
+            print(regression)
+        sys.exit(1)
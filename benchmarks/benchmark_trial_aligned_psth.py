@@ -0,0 +1,64 @@
+"""Authors: Cody Baker."""
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import h5py
+import numpy as np
+
+from brody_lab_to_nwb.interfaces.msorted.msortedsortinginterface import MSortedSortingInterface
+from brody_lab_to_nwb.interfaces.trialalignedpsthinterface import get_trial_aligned_spike_counts
+from fixtures import write_msorted
+
+# Scale of the synthetic Msorted session
+n_trials = 500
+n_units = 50
+spikes_per_unit = 5000.
+window_start = -0.5
+window_stop = 1.
+bin_size = 0.01
+event_names = ["cpoke_in", "clicks_on"]
+seed = 0
+
+
+def get_spike_counts_per_window(spike_trains, event_times):
+    """The PSTH as computed in the analysis notebooks, with one np.histogram call per unit and trial."""
+    bin_edges = window_start + bin_size * np.arange(int(round((window_stop - window_start) / bin_size)) + 1)
+    return np.array(
+        [[np.histogram(spike_train - event_time, bins=bin_edges)[0] for event_time in event_times]
+         for spike_train in spike_trains]
+    )
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = Path(folder) / "Msorted_A182_2018-10-05.mat"
+        spike_trains = write_msorted(
+            file_path=file_path, n_trials=n_trials, n_units=n_units, spikes_per_unit=spikes_per_unit, seed=seed
+        )
+        with h5py.File(file_path, mode="r") as mat_file:
+            event_times = {x: mat_file[f"Msorted/Trials/stateTimes/{x}"][()].ravel() for x in event_names}
+        sorting = MSortedSortingInterface(file_path=file_path).sorting_extractor
+
+        per_window_time = 0.
+        vectorized_time = 0.
+        for event_name, reference_times in event_times.items():
+            t0 = perf_counter()
+            per_window = get_spike_counts_per_window(spike_trains=spike_trains, event_times=reference_times)
+            per_window_time += perf_counter() - t0
+
+            t0 = perf_counter()
+            spike_counts = get_trial_aligned_spike_counts(
+                sorting=sorting,
+                event_times=reference_times,
+                window_start=window_start,
+                window_stop=window_stop,
+                bin_size=bin_size
+            )
+            vectorized_time += perf_counter() - t0
+
+            assert np.array_equal(spike_counts, per_window)
+
+    print(f"{n_units} units x {n_trials} trials x {len(event_names)} events, {spike_counts.shape[2]} bins")
+    print(f"np.histogram per unit and trial: {per_window_time:.3f}s")
+    print(f"get_trial_aligned_spike_counts: {vectorized_time:.3f}s ({per_window_time / vectorized_time:.0f}x)")
@@ -0,0 +1,79 @@
+"""Authors: Cody Baker."""
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import h5py
+import numpy as np
+
+from brody_lab_to_nwb.interfaces.msorted.msortedsortinginterface import MSortedSortingInterface
+from fixtures import write_msorted
+
+# Scale of the synthetic Msorted session
+n_trials = 500
+n_units = 50
+spikes_per_unit = 5000.
+window = (-0.5, 1.)  # seconds around the aligned trial event
+event_names = ["cpoke_in", "clicks_on"]
+seed = 0
+
+
+def get_spike_trains_per_window(sorting, window_starts, window_ends, reference_times):
+    """The previous way of building the rasters, with one get_unit_spike_train call per unit and window."""
+    spike_trains = []
+    for unit_id in sorting.get_unit_ids():
+        for window_start, window_end, reference_time in zip(window_starts, window_ends, reference_times):
+            spike_train = sorting.get_unit_spike_train(unit_id=unit_id, start_frame=window_start, end_frame=window_end)
+            spike_trains.append(spike_train - reference_time)
+    return spike_trains
+
+
+def get_spike_trains_by_mask(spike_trains, window_starts, window_ends, reference_times):
+    """Reference result, selecting the spikes of every unit and window with a boolean mask."""
+    return [
+        spike_train[(spike_train >= window_start) & (spike_train < window_end)] - reference_time
+        for spike_train in spike_trains
+        for window_start, window_end, reference_time in zip(window_starts, window_ends, reference_times)
+    ]
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = Path(folder) / "Msorted_A182_2018-10-05.mat"
+        spike_trains = write_msorted(
+            file_path=file_path, n_trials=n_trials, n_units=n_units, spikes_per_unit=spikes_per_unit, seed=seed
+        )
+        with h5py.File(file_path, mode="r") as mat_file:
+            event_times = {x: mat_file[f"Msorted/Trials/stateTimes/{x}"][()].ravel() for x in event_names}
+
+        per_window_time = 0.
+        batched_time = 0.
+        for event_name, reference_times in event_times.items():
+            sorting = MSortedSortingInterface(file_path=file_path).sorting_extractor
+            sorting.get_spike_trains()
+            window_starts = reference_times + window[0]
+            window_ends = reference_times + window[1]
+
+            t0 = perf_counter()
+            per_window = get_spike_trains_per_window(
+                sorting=sorting, window_starts=window_starts, window_ends=window_ends, reference_times=reference_times
+            )
+            per_window_time += perf_counter() - t0
+
+            t0 = perf_counter()
+            spike_times, offsets = sorting.get_spike_trains_in_windows(
+                window_starts=window_starts, window_ends=window_ends, reference_times=reference_times
+            )
+            batched_time += perf_counter() - t0
+
+            # get_unit_spike_train casts the windows to whole seconds, so the result is checked against a mask instead
+            by_mask = get_spike_trains_by_mask(
+                spike_trains=spike_trains, window_starts=window_starts, window_ends=window_ends,
+                reference_times=reference_times
+            )
+            assert np.array_equal(np.diff(offsets), [len(x) for x in by_mask])
+            assert np.array_equal(spike_times, np.concatenate(by_mask))
+
+    print(f"{n_units} units x {n_trials} trials x {len(event_names)} events, {len(spike_times)} spikes per event")
+    print(f"get_unit_spike_train per window: {per_window_time:.3f}s")
+    print(f"get_spike_trains_in_windows: {batched_time:.3f}s ({per_window_time / batched_time:.0f}x)")
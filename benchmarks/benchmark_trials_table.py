@@ -0,0 +1,60 @@
+"""Authors: Cody Baker."""
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+from pynwb import NWBFile
+
+from brody_lab_to_nwb.interfaces.utils import add_trials_from_columns
+
+# Scale of the synthetic session
+n_trials = 5000
+n_float_columns = 30
+n_str_columns = 5
+seed = 0
+
+
+def make_synthetic_columns(n_trials: int, n_float_columns: int, n_str_columns: int, seed: int = 0):
+    """Generate start/stop times and a dictionary of columns shaped like a long behavioral session."""
+    rng = np.random.default_rng(seed=seed)
+    start_time = np.cumsum(rng.uniform(low=5., high=10., size=n_trials))
+    stop_time = start_time + rng.uniform(low=1., high=4., size=n_trials)
+    columns = {f"float_column_{j}": rng.random(size=n_trials) for j in range(n_float_columns)}
+    columns.update({f"str_column_{j}": rng.choice(["left", "right"], size=n_trials) for j in range(n_str_columns)})
+    return start_time, stop_time, columns
+
+
+def make_nwbfile():
+    return NWBFile(session_description="", identifier="benchmark", session_start_time=datetime.now().astimezone())
+
+
+def add_trials_per_row(nwbfile: NWBFile, start_time, stop_time, columns: dict):
+    """The previous approach of the behavior interfaces; one add_trial call per trial."""
+    for name in columns:
+        nwbfile.add_trial_column(name=name, description="")
+    for k in range(len(start_time)):
+        trial_kwargs = dict(start_time=start_time[k], stop_time=stop_time[k])
+        for name, values in columns.items():
+            trial_kwargs.update({name: values[k]})
+        nwbfile.add_trial(**trial_kwargs)
+
+
+if __name__ == "__main__":
+    start_time, stop_time, columns = make_synthetic_columns(
+        n_trials=n_trials, n_float_columns=n_float_columns, n_str_columns=n_str_columns, seed=seed
+    )
+
+    nwbfile = make_nwbfile()
+    t0 = perf_counter()
+    add_trials_per_row(nwbfile=nwbfile, start_time=start_time, stop_time=stop_time, columns=columns)
+    per_row_time = perf_counter() - t0
+
+    nwbfile = make_nwbfile()
+    t0 = perf_counter()
+    add_trials_from_columns(nwbfile=nwbfile, start_time=start_time, stop_time=stop_time, columns=columns)
+    columnar_time = perf_counter() - t0
+
+    print(f"{n_trials} trials x {n_float_columns + n_str_columns} columns")
+    print(f"Per-row add_trial: {per_row_time:.3f}s")
+    print(f"add_trials_from_columns: {columnar_time:.3f}s")
+    print(f"Speedup: {per_row_time / columnar_time:.1f}x")
@@ -0,0 +1,368 @@
+"""Authors: Cody Baker."""
+from datetime import datetime
+from pathlib import Path
+from typing import Union
+
+import h5py
+import numpy as np
+import scipy.io as spio
+
+PathType = Union[str, Path]
+
+MATLAB_USERBLOCK_SIZE = 512
+NCS_HEADER_SIZE = 16 * 1024
+NCS_SAMPLES_PER_RECORD = 512
+NCS_RECORD_DTYPE = np.dtype(
+    [
+        ("timestamp", "<u8"),
+        ("channel_id", "<u4"),
+        ("sample_rate", "<u4"),
+        ("num_valid_samples", "<u4"),
+        ("samples", "<i2", (NCS_SAMPLES_PER_RECORD,))
+    ]
+)
+MSORTED_STATE_NAMES = [
+    "wait_for_cpoke", "cpoke_in", "cpoke_out", "clicks_on", "clicks_off", "spoke", "right_reward", "left_reward",
+    "error", "break"
+]
+
+
+def make_trial_starts(n_trials: int, rng: np.random.Generator):
+    """Start time of each synthetic trial, with 5 to 10 seconds between trials."""
+    return np.cumsum(rng.uniform(low=5., high=10., size=n_trials))
+
+
+def make_spike_trains(n_units: int, spikes_per_unit: float, duration: float, rng: np.random.Generator):
+    """Sorted spike times of each unit, with a Poisson distributed number of spikes over the duration."""
+    n_spikes = rng.poisson(lam=spikes_per_unit, size=n_units)
+    return [np.sort(rng.uniform(low=0., high=duration, size=n_unit_spikes)) for n_unit_spikes in n_spikes]
+
+
+def _write_matlab_userblock(file_path: PathType):
+    header = (
+        f"MATLAB 7.3 MAT-file, Platform: GLNXA64, Created on: {datetime.now():%a %b %d %H:%M:%S %Y} "
+        "HDF5 schema 1.00 ."
+    )
+    with open(file_path, mode="r+b") as f:
+        f.write(header.encode().ljust(128, b" "))
+
+
+def _write_v73_array(group: h5py.Group, name: str, data, matlab_class: str = "double"):
+    """
+    Write an array the way MATLAB does in v7.3 files; transposed, as MATLAB is column-major.
+
+    One-dimensional data is written as a MATLAB column vector.
+    """
+    data = np.asarray(data)
+    if data.ndim < 2:
+        data = data.reshape(-1, 1)
+    if data.size == 0:
+        dataset = group.create_dataset(name, data=np.zeros(2, dtype=np.uint64))
+        dataset.attrs["MATLAB_empty"] = np.uint8(1)
+    else:
+        dataset = group.create_dataset(name, data=data.T)
+    dataset.attrs["MATLAB_class"] = np.bytes_(matlab_class)
+    return dataset
+
+
+def _write_v73_struct(group: h5py.Group, name: str):
+    struct = group.create_group(name)
+    struct.attrs["MATLAB_class"] = np.bytes_("struct")
+    return struct
+
+
+def _char_codes(values):
+    return np.array([ord(x) for x in values], dtype=np.uint16)
+
+
+def write_msorted(
+    file_path: PathType,
+    n_trials: int = 500,
+    n_units: int = 50,
+    spikes_per_unit: float = 5000.,
+    laser: bool = True,
+    pharma: bool = False,
+    seed: int = 0
+):
+    """
+    Write a synthetic Msorted_*.mat file, in the v7.3 (HDF5) format the Neuralynx sessions are saved in.
+
+    Every field read by MSortedProcessedInterface and MSortedSortingInterface is present, laid out as MATLAB writes it;
+    the spike times of each unit are a column vector in #refs#, pointed to by the Msorted.raw_spike_time_s cell.
+
+    Returns
+    -------
+    spike_trains : list of np.ndarray
+        The spike times written for each unit.
+    """
+    rng = np.random.default_rng(seed=seed)
+    trial_starts = make_trial_starts(n_trials=n_trials, rng=rng)
+    spike_trains = make_spike_trains(
+        n_units=n_units, spikes_per_unit=spikes_per_unit, duration=trial_starts[-1] + 10., rng=rng
+    )
+    with h5py.File(file_path, mode="w", userblock_size=MATLAB_USERBLOCK_SIZE) as mat_file:
+        refs = mat_file.create_group("#refs#")
+        msorted = _write_v73_struct(mat_file, "Msorted")
+        _write_v73_array(msorted, "sessid", [[123456.]])
+        _write_v73_array(msorted, "rat", _char_codes("A182")[np.newaxis], matlab_class="char")
+
+        trials = _write_v73_struct(msorted, "Trials")
+        state_times = _write_v73_struct(trials, "stateTimes")
+        _write_v73_array(state_times, "sending_trialnum", trial_starts)
+        _write_v73_array(state_times, "cleaned_up", trial_starts + 4.)
+        for state_name in MSORTED_STATE_NAMES:
+            _write_v73_array(state_times, state_name, trial_starts + rng.uniform(low=0., high=4., size=n_trials))
+        _write_v73_array(trials, "trial_type", _char_codes(rng.choice(list("ab"), n_trials)), matlab_class="char")
+        _write_v73_array(trials, "sides", _char_codes(rng.choice(list("lr"), n_trials)), matlab_class="char")
+        for field_name in ["violated", "is_hit", "pokedR"]:
+            _write_v73_array(trials, field_name, rng.integers(low=0, high=2, size=n_trials).astype(float))
+        for field_name in ["gamma", "reward_loc", "stim_dur_s", "click_diff_hz"]:
+            _write_v73_array(trials, field_name, rng.random(size=n_trials))
+
+        pharma_struct = _write_v73_struct(trials, "pharma")
+        pharma_size = n_trials if pharma else 1
+        _write_v73_array(pharma_struct, "manip", rng.integers(low=0, high=2, size=pharma_size).astype(float))
+        _write_v73_array(pharma_struct, "injector_mm", rng.random(size=pharma_size))
+        _write_v73_array(pharma_struct, "doseNG", rng.random(size=pharma_size))
+        laser_struct = _write_v73_struct(trials, "laser")
+        _write_v73_array(laser_struct, "isOn", rng.integers(low=0, high=2, size=n_trials).astype(float) * laser)
+        for field_name in ["pulseMS", "freqHz", "latencyMS", "durMS"]:
+            _write_v73_array(laser_struct, field_name, rng.random(size=n_trials))
+
+        unit_refs = [
+            _write_v73_array(refs, f"spike_times_{j}", spike_train).ref for j, spike_train in enumerate(spike_trains)
+        ]
+        cell = msorted.create_dataset("raw_spike_time_s", data=np.array([unit_refs], dtype=h5py.ref_dtype))
+        cell.attrs["MATLAB_class"] = np.bytes_("cell")
+    _write_matlab_userblock(file_path=file_path)
+    return spike_trains
+
+
+def write_cells(file_path: PathType, n_trials: int = 500, seed: int = 0):
+    """Write a synthetic *_Cells.mat file with the Trials struct read by PoissonClicksProcessedInterface."""
+    rng = np.random.default_rng(seed=seed)
+    trial_starts = make_trial_starts(n_trials=n_trials, rng=rng)
+    trials = dict(
+        stateTimes=dict(sending_trialnum=trial_starts[:, np.newaxis], cleaned_up=trial_starts[:, np.newaxis] + 4.),
+        trial_type=rng.choice(list("ab"), size=(n_trials, 1)),
+        violated=rng.integers(low=0, high=2, size=(n_trials, 1)).astype(float),
+        is_hit=rng.integers(low=0, high=2, size=(n_trials, 1)).astype(float),
+        sides=rng.choice(list("lr"), size=(n_trials, 1)),
+        gamma=rng.random(size=(n_trials, 1)),
+        reward_loc=rng.random(size=(n_trials, 1)),
+        pokedR=rng.integers(low=0, high=2, size=(n_trials, 1)).astype(float),
+        click_diff_hz=rng.random(size=(n_trials, 1))
+    )
+    spio.savemat(file_path, dict(Trials=trials))
+
+
+def make_synthetic_behs(n_trials: int, seed: int = 0):
+    """Generate a behS structure shaped like the one read from protocol_info.mat, with hits, misses and violations."""
+    rng = np.random.default_rng(seed=seed)
+    hit_history = rng.choice([1., 0., np.nan], size=n_trials, p=[0.6, 0.25, 0.15])
+    trial_starts = make_trial_starts(n_trials=n_trials, rng=rng)
+    parsed_events = []
+    for trial_start, hit in zip(trial_starts, hit_history):
+        states = dict(
+            cp=trial_start + np.array([0., 0.1]),
+            check_next_trial_ready=trial_start + np.array([4., 4.1])
+        )
+        waves = dict()
+        if hit == 1.:
+            states.update(hit_state=trial_start + np.array([3., 3.1]))
+        elif hit == 0.:
+            states.update(second_hit_state=trial_start + np.array([3.2, 3.3]))
+        if not np.isnan(hit):
+            waves.update(
+                stimAUD1=trial_start + np.array([0.5, 0.9]),
+                stimAUD2=trial_start + np.array([1.5, 1.9])
+            )
+        parsed_events.append(dict(states=states, waves=waves))
+    return dict(
+        n_completed_trials=n_trials,
+        prev_side=rng.choice([108, 114], size=n_trials),
+        hit_history=hit_history,
+        delay=rng.uniform(low=2., high=6., size=n_trials),
+        pair_history=rng.integers(low=1, high=11, size=n_trials),
+        correct_side=rng.choice([108, 114], size=n_trials),
+        aud1_sigma=rng.random(size=n_trials),
+        aud2_sigma=rng.random(size=n_trials),
+        parsed_events=parsed_events
+    )
+
+
+def write_protocol_info(file_path: PathType, n_trials: int = 500, seed: int = 0):
+    """Write a synthetic protocol_info.mat file holding the behS struct read by ProtocolInfoInterface."""
+    behs = make_synthetic_behs(n_trials=n_trials, seed=seed)
+    parsed_events = np.empty((n_trials, 1), dtype=[("states", object), ("waves", object)])
+    for j, trial_events in enumerate(behs["parsed_events"]):
+        parsed_events[j, 0] = (trial_events["states"], trial_events["waves"])
+    behs.update(parsed_events=parsed_events)
+    spio.savemat(file_path, dict(behS=behs))
+
+
+def write_analysis_clusters(
+    file_path: PathType, n_units: int = 50, spikes_per_unit: float = 5000., duration: float = 3600., seed: int = 0
+):
+    """
+    Write a synthetic ksphy_clusters_foranalysis.mat file holding the PWMspkS struct array read by
+    AnalysisClustersSortingInterface, with one struct per unit.
+
+    Returns
+    -------
+    spike_trains : list of np.ndarray
+        The spike times written for each unit, in behavior (FSM) time.
+    """
+    rng = np.random.default_rng(seed=seed)
+    spike_trains = make_spike_trains(n_units=n_units, spikes_per_unit=spikes_per_unit, duration=duration, rng=rng)
+    field_names = [
+        "date", "fs", "trodenum", "event_ts_fsm", "waves_mn", "waves_std", "mua", "single", "behav_session"
+    ]
+    units = np.empty((1, n_units), dtype=[(field_name, object) for field_name in field_names])
+    is_single = rng.random(size=n_units) < 0.5
+    for j, spike_train in enumerate(spike_trains):
+        units[0, j] = (
+            "2019-05-30",
+            30000.,
+            float(rng.integers(low=1, high=33)),
+            spike_train[:, np.newaxis],
+            rng.normal(size=(4, 32)),
+            rng.random(size=(4, 32)),
+            float(not is_single[j]),
+            float(is_single[j]),
+            dict(spk2fsm_rt=np.array([[1.0001, -12.5]]))
+        )
+    spio.savemat(file_path, dict(PWMspkS=units))
+    return spike_trains
+
+
+def _write_spikeglx_stream(
+    bin_path: Path, stream: str, n_channels: int, duration: float, sampling_frequency: float, rng: np.random.Generator
+):
+    """Write one SpikeGLX imec stream (.ap or .lf) and its .meta file, one second of samples at a time."""
+    n_saved_channels = n_channels + 1  # the last saved channel is the sync channel
+    n_frames = int(duration * sampling_frequency)
+    block_size = int(sampling_frequency)
+    with open(bin_path, mode="wb") as f:
+        for start_frame in range(0, n_frames, block_size):
+            n_block_frames = min(block_size, n_frames - start_frame)
+            block = rng.integers(low=-200, high=200, size=(n_block_frames, n_saved_channels), dtype=np.int16)
+            block[:, -1] = (np.arange(start_frame, start_frame + n_block_frames) // block_size) % 2
+            f.write(block.tobytes())
+    channel_prefix = "AP" if stream == "ap" else "LF"
+    channel_counts = f"{n_channels},0,1" if stream == "ap" else f"0,{n_channels},1"
+    imro_table = f"(0,{n_channels})" + "".join(f"({j} 0 0 500 250 1)" for j in range(n_channels))
+    channel_map = f"({n_channels},{n_channels},1)" + "".join(
+        f"({channel_prefix}{j};{j}:{j})" for j in range(n_channels)
+    ) + f"(SY0;{n_channels}:{n_channels})"
+    shank_map = "(1,2,480,1)" + "".join(f"(0:{j % 2}:{j // 2}:1)" for j in range(n_channels))
+    meta = dict(
+        fileCreateTime="2019-05-30T12:00:00",
+        fileSizeBytes=n_frames * n_saved_channels * 2,
+        fileTimeSecs=n_frames / sampling_frequency,
+        imAiRangeMax=0.6,
+        imAiRangeMin=-0.6,
+        imSampRate=sampling_frequency,
+        nSavedChans=n_saved_channels,
+        snsApLfSy=channel_counts,
+        snsSaveChanSubset="all",
+        typeThis="imec",
+        imroTbl=imro_table,
+        snsChanMap=channel_map,
+        snsShankMap=shank_map
+    )
+    bin_path.with_suffix(".meta").write_text("".join(f"{key}={value}\n" for key, value in meta.items()))
+
+
+def write_spikeglx(
+    folder_path: PathType,
+    session_str: str = "2019-05-30",
+    n_channels: int = 384,
+    duration: float = 60.,
+    ap_sampling_frequency: float = 30000.,
+    lf_sampling_frequency: float = 2500.,
+    seed: int = 0
+):
+    """
+    Write a synthetic SpikeGLX session, with the .ap.bin and .lf.bin files of one imec probe and their .meta files.
+
+    The files are laid out as SpikeGLX saves them, {session_str}_g0/{session_str}_g0_imec0/, and contain random
+    int16 samples with a square wave on the sync channel.
+
+    Returns
+    -------
+    ap_file_path, lf_file_path : Path
+    """
+    rng = np.random.default_rng(seed=seed)
+    probe_folder = Path(folder_path) / f"{session_str}_g0" / f"{session_str}_g0_imec0"
+    probe_folder.mkdir(parents=True, exist_ok=True)
+    file_paths = []
+    for stream, sampling_frequency in zip(["ap", "lf"], [ap_sampling_frequency, lf_sampling_frequency]):
+        bin_path = probe_folder / f"{session_str}_g0_t0.imec0.{stream}.bin"
+        _write_spikeglx_stream(
+            bin_path=bin_path,
+            stream=stream,
+            n_channels=n_channels,
+            duration=duration,
+            sampling_frequency=sampling_frequency,
+            rng=rng
+        )
+        file_paths.append(bin_path)
+    return tuple(file_paths)
+
+
+def write_ncs(
+    file_path: PathType, channel: int = 0, duration: float = 60., sampling_frequency: float = 32000., seed: int = 0
+):
+    """Write a synthetic Neuralynx .ncs file, a 16 kB text header followed by records of 512 samples."""
+    rng = np.random.default_rng(seed=seed)
+    n_records = int(np.ceil(duration * sampling_frequency / NCS_SAMPLES_PER_RECORD))
+    header = (
+        "######## Neuralynx Data File Header\r\n"
+        f"## File Name {file_path}\r\n"
+        "## Time Opened (m/d/y): 10/5/2018  (h:m:s.ms) 13:20:01.000\r\n"
+        "## Time Closed (m/d/y): 10/5/2018  (h:m:s.ms) 14:20:01.000\r\n"
+        "-CheetahRev 5.6.3\r\n"
+        f"-AcqEntName CSC{channel}\r\n"
+        "-FileType CSC\r\n"
+        "-FileVersion 3.4\r\n"
+        "-AcquisitionSystem AcqSystem1 DigitalLynxSX\r\n"
+        "-RecordSize 1044\r\n"
+        f"-SamplingFrequency {sampling_frequency:g}\r\n"
+        "-ADBitVolts 0.000000030518\r\n"
+        "-ADMaxValue 32767\r\n"
+        "-InputInverted False\r\n"
+        f"-ADChannel {channel}\r\n"
+    )
+    records = np.zeros(n_records, dtype=NCS_RECORD_DTYPE)
+    records["timestamp"] = 10 ** 9 + (np.arange(n_records) * NCS_SAMPLES_PER_RECORD * 1e6 / sampling_frequency).astype(
+        np.uint64
+    )
+    records["channel_id"] = channel
+    records["sample_rate"] = sampling_frequency
+    records["num_valid_samples"] = NCS_SAMPLES_PER_RECORD
+    records["samples"] = rng.integers(low=-2000, high=2000, size=(n_records, NCS_SAMPLES_PER_RECORD), dtype=np.int16)
+    with open(file_path, mode="wb") as f:
+        f.write(header.encode("latin-1").ljust(NCS_HEADER_SIZE, b"\0"))
+        f.write(records.tobytes())
+
+
+def write_neuralynx(
+    folder_path: PathType,
+    n_channels: int = 32,
+    duration: float = 60.,
+    sampling_frequency: float = 32000.,
+    seed: int = 0
+):
+    """Write a synthetic Neuralynx session folder with one CSC{n}.ncs file per channel."""
+    folder_path = Path(folder_path)
+    folder_path.mkdir(parents=True, exist_ok=True)
+    for channel in range(n_channels):
+        write_ncs(
+            file_path=folder_path / f"CSC{channel + 1}.ncs",
+            channel=channel,
+            duration=duration,
+            sampling_frequency=sampling_frequency,
+            seed=seed + channel
+        )
+    return folder_path
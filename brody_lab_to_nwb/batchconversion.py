@@ -0,0 +1,209 @@
+"""Authors: Cody Baker."""
+import hashlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from nwb_conversion_tools.utils.json_schema import dict_deep_update
+
+from .brodynwbconverter import PoissonClicksNWBConverter, BrodyNeuralynxNWBConverter, BrodySpikeGadgetsNWBConverter
+from .instrumentation import ConversionInstrumentation
+from .interfaces.utils import PathType
+
+CONVERTER_CLASSES = dict(
+    PoissonClicksNWBConverter=PoissonClicksNWBConverter,
+    BrodyNeuralynxNWBConverter=BrodyNeuralynxNWBConverter,
+    BrodySpikeGadgetsNWBConverter=BrodySpikeGadgetsNWBConverter,
+)
+LEDGER_SUFFIX = ".ledger.json"
+
+
+def load_manifest(manifest_path: PathType):
+    """
+    Load and check a batch conversion manifest.
+
+    The manifest is a .json file with a list of sessions, each of the form
+
+        dict(
+            session_id="A182_2018_10_05",
+            converter="BrodyNeuralynxNWBConverter",
+            source_data=dict(...),  # as passed to the converter
+            nwbfile_path="path/to/A182_2018_10_05.nwb",
+            metadata=dict(...),  # optional, deep updated onto the metadata from converter.get_metadata()
+            conversion_options=dict(...),  # optional
+            write_options=dict(...),  # optional, see BrodyNWBConverter.run_conversion
+            instrument=True,  # optional, saves a report of the time and memory of each interface next to the NWB file
+            preview=True,  # optional, subsamples the raw data over the whole session for a quick check of alignment
+            preview_sampling_frequency=30.,  # optional, the rate in Hz of the subsampled raw data
+            incremental=True  # optional, only rewrites the interfaces of an existing NWB file whose inputs changed
+        )
+
+    either at the top level or under a "sessions" key.
+    """
+    with open(manifest_path, mode="r") as f:
+        manifest = json.load(f)
+    sessions = manifest["sessions"] if isinstance(manifest, dict) else manifest
+    session_ids = set()
+    for session in sessions:
+        for key in ["session_id", "converter", "source_data", "nwbfile_path"]:
+            if key not in session:
+                raise ValueError(f"Manifest session {session.get('session_id', session)} is missing '{key}'!")
+        if session["converter"] not in CONVERTER_CLASSES:
+            raise ValueError(
+                f"Unknown converter '{session['converter']}' for session {session['session_id']}! "
+                f"Choose one of {list(CONVERTER_CLASSES)}."
+            )
+        if session["session_id"] in session_ids:
+            raise ValueError(f"Session {session['session_id']} appears more than once in the manifest!")
+        session_ids.add(session["session_id"])
+    return sessions
+
+
+def get_session_fingerprint(session: dict):
+    """Hash of the manifest entry of a session, so that editing the entry reruns a completed session."""
+    return hashlib.blake2b(json.dumps(session, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def get_source_size(source_data: dict):
+    """Total size in bytes of every file and folder named in the source_data of a session, each counted once."""
+    files = set()
+    for interface_source_data in source_data.values():
+        for key, value in interface_source_data.items():
+            if key not in ["file_path", "folder_path"] or not Path(value).exists():
+                continue
+            path = Path(value).resolve()
+            files.update([path] if path.is_file() else [x for x in path.rglob("*") if x.is_file()])
+    return sum(x.stat().st_size for x in files)
+
+
+def read_ledger(ledger_path: PathType):
+    """Read the status ledger of a batch conversion; an empty ledger if it does not exist yet."""
+    ledger_path = Path(ledger_path)
+    if not ledger_path.is_file():
+        return dict()
+    with open(ledger_path, mode="r") as f:
+        return json.load(f)
+
+
+def write_ledger(ledger_path: PathType, ledger: dict):
+    """Atomically write the status ledger, so that a crash never leaves it half written."""
+    ledger_path = Path(ledger_path)
+    temporary_path = ledger_path.with_name(f"{ledger_path.name}.tmp")
+    with open(temporary_path, mode="w") as f:
+        json.dump(ledger, f, indent=2)
+    os.replace(temporary_path, ledger_path)
+
+
+def convert_session(session: dict):
+    """
+    Run the conversion of a single manifest session, returning its ledger entry.
+
+    Errors are caught and recorded in the entry rather than raised, so that one bad session does not stop a batch.
+    """
+    start_time = time.perf_counter()
+    entry = dict(started=datetime.now().isoformat(timespec="seconds"), pid=os.getpid())
+    try:
+        source_size = get_source_size(source_data=session["source_data"])
+        converter = CONVERTER_CLASSES[session["converter"]](
+            source_data=session["source_data"],
+            instrumentation=ConversionInstrumentation() if session.get("instrument", False) else None
+        )
+        metadata = dict_deep_update(converter.get_metadata(), session.get("metadata", dict()))
+        Path(session["nwbfile_path"]).parent.mkdir(parents=True, exist_ok=True)
+        converter.run_conversion(
+            nwbfile_path=str(session["nwbfile_path"]),
+            metadata=metadata,
+            conversion_options=session.get("conversion_options"),
+            write_options=session.get("write_options"),
+            overwrite=True,
+            preview=session.get("preview", False),
+            preview_sampling_frequency=session.get("preview_sampling_frequency", 30.),
+            incremental=session.get("incremental", False)
+        )
+        wall_time = time.perf_counter() - start_time
+        entry.update(
+            status="completed",
+            wall_time_s=wall_time,
+            source_size_mb=source_size / 1e6,
+            nwbfile_size_mb=Path(session["nwbfile_path"]).stat().st_size / 1e6,
+            throughput_mb_s=source_size / 1e6 / wall_time
+        )
+    except Exception as e:
+        entry.update(
+            status="failed",
+            wall_time_s=time.perf_counter() - start_time,
+            error=f"{type(e).__name__}: {e}",
+            traceback=traceback.format_exc()
+        )
+    entry.update(finished=datetime.now().isoformat(timespec="seconds"))
+    return entry
+
+
+def run_batch_conversion(
+    manifest_path: PathType,
+    ledger_path: Optional[PathType] = None,
+    max_workers: Optional[int] = None,
+    retry_failed: bool = True
+):
+    """
+    Convert every session of a manifest concurrently, in a pool of worker processes, with a resumable status ledger.
+
+    The ledger records the status of each session ('running', 'completed' or 'failed') along with its wall time,
+    source size and throughput, and is rewritten after every session that finishes. Running the same manifest again
+    skips the sessions that completed, so an interrupted batch resumes with only the failed and unfinished sessions.
+    A completed session is converted again if its manifest entry was edited or its NWB file is missing.
+
+    Parameters
+    ----------
+    manifest_path : PathType
+        Path to the .json manifest of sessions; see load_manifest for its format.
+    ledger_path : PathType, optional
+        Path to the .json status ledger. Defaults to the manifest path with the suffix '.ledger.json'.
+    max_workers : int, optional
+        Number of sessions to convert at once. Defaults to the number of processors.
+    retry_failed : bool, default: True
+        Whether to convert sessions that failed in a previous run again.
+
+    Returns
+    -------
+    ledger : dict
+        Maps each session_id to its ledger entry.
+    """
+    sessions = load_manifest(manifest_path=manifest_path)
+    if ledger_path is None:
+        ledger_path = Path(manifest_path).with_suffix(LEDGER_SUFFIX)
+    ledger = read_ledger(ledger_path=ledger_path)
+
+    pending_sessions = []
+    for session in sessions:
+        fingerprint = get_session_fingerprint(session=session)
+        entry = ledger.get(session["session_id"], dict())
+        if entry.get("fingerprint") == fingerprint:
+            if entry.get("status") == "completed" and Path(session["nwbfile_path"]).is_file():
+                continue
+            if entry.get("status") == "failed" and not retry_failed:
+                continue
+        ledger[session["session_id"]] = dict(
+            fingerprint=fingerprint, status="running", attempts=entry.get("attempts", 0) + 1
+        )
+        pending_sessions.append(session)
+    write_ledger(ledger_path=ledger_path, ledger=ledger)
+    print(f"Converting {len(pending_sessions)} of {len(sessions)} sessions.")
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(convert_session, session): session["session_id"] for session in pending_sessions}
+        for future in as_completed(futures):
+            session_id = futures[future]
+            try:
+                ledger[session_id].update(future.result())
+            except BrokenProcessPool as e:  # e.g., a worker was killed for running out of memory
+                ledger[session_id].update(status="failed", error=f"{type(e).__name__}: {e}")
+            write_ledger(ledger_path=ledger_path, ledger=ledger)
+            print(f"Session {session_id} {ledger[session_id]['status']}.")
+    return ledger
@@ -1,4 +1,13 @@
 """Authors: Cody Baker."""
+import json
+import time
+from contextlib import ExitStack, contextmanager, nullcontext
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from pynwb import NWBFile
+from pynwb.ecephys import ElectricalSeries
 from nwb_conversion_tools import (
     NWBConverter,
     NeuralynxRecordingInterface,
@@ -6,39 +15,596 @@ from nwb_conversion_tools import (
     SpikeGLXLFPInterface,
     SpikeGadgetsRecordingInterface,
 )
+from nwb_conversion_tools.utils.json_schema import dict_deep_update
 
+from .incremental import (
+    combine_fingerprints,
+    get_interface_fingerprint,
+    get_metadata_fingerprint,
+    get_object_paths,
+    plan_incremental_update,
+    read_fingerprints,
+    remove_objects,
+    write_fingerprints,
+)
+from .instrumentation import ConversionInstrumentation, get_bytes_written_by_object
+from .interfaces.clockalignment import ClockAlignedRecordingExtractor, ClockMapping, add_clock_segments
+from .interfaces.h5pool import H5FilePool
+from .interfaces.utils import (
+    DEFAULT_WRITE_OPTIONS,
+    DecimatedRecordingExtractor,
+    make_recording_conversion_options,
+    get_recording_size,
+)
 from .interfaces.msorted.msortedprocesseddatainterface import MSortedProcessedInterface
 from .interfaces.msorted.msortedsortinginterface import MSortedSortingInterface
 from .interfaces.protocol_info.protocolinfodatainterface import ProtocolInfoInterface
 from .interfaces.protocol_info.analysisclusterssortinginterface import AnalysisClustersSortingInterface
 from .interfaces.poisson_clicks.poissonclicksprocessedinterface import PoissonClicksProcessedInterface
+from .interfaces.curatedsortinginterface import CuratedSortingInterface
+from .interfaces.neuralynxlfpinterface import NeuralynxLFPInterface
+from .interfaces.trialalignedpsthinterface import TrialAlignedPSTHInterface
+
+
+@contextmanager
+def _wrapped_methods(interfaces: dict, method_name: str, wrap: Callable):
+    """Within this context, the method of each interface is replaced by wrap(method, interface_name=interface_name)."""
+    shadowed_methods = {x: vars(y).get(method_name) for x, y in interfaces.items()}
+    try:
+        for interface_name, interface in interfaces.items():
+            setattr(interface, method_name, wrap(getattr(interface, method_name), interface_name=interface_name))
+        yield
+    finally:
+        for interface_name, interface in interfaces.items():
+            if shadowed_methods[interface_name] is None:
+                vars(interface).pop(method_name, None)
+            else:
+                setattr(interface, method_name, shadowed_methods[interface_name])
+
+
+def _get_object_ids(nwbfile: NWBFile):
+    """The object ids of every container in the nwbfile; NWBFile.objects is only computed on its first access."""
+    return {x.object_id for x in nwbfile.all_children()}
+
+
+class BrodyNWBConverter(NWBConverter):
+    """Base conversion class for the Brody lab data, streaming every raw recording with the same write options."""
+
+    recording_interface_names = ()
+    # Maps each interface computed from the output of other interfaces in the nwbfile to the names of those interfaces
+    interface_dependencies = dict()
+
+    def __init__(self, source_data, instrumentation: Optional[ConversionInstrumentation] = None):
+        """
+        Validate source_data against source_schema and initialize all data interfaces.
+
+        Parameters
+        ----------
+        source_data : dict
+        instrumentation : ConversionInstrumentation, optional
+            If passed, the construction, get_metadata and run_conversion of each interface, as well as the final write
+            of the NWB file, are recorded as timing and memory spans, and their report is saved next to the NWB file.
+            The default is None, in which case the conversion runs exactly as without instrumentation.
+        """
+        self.instrumentation = instrumentation
+        self.clock_mappings = dict()
+        # NWBConverter constructs each interface from self.data_interface_classes; shadow it to time each construction
+        self.data_interface_classes = {
+            interface_name: self._with_span(data_interface, phase="__init__", interface_name=interface_name)
+            for interface_name, data_interface in type(self).data_interface_classes.items()
+        }
+        try:
+            super().__init__(source_data=source_data)
+        finally:
+            del self.data_interface_classes
+
+    def _span(self, phase: str, interface_name: Optional[str] = None):
+        if self.instrumentation is None:
+            return nullcontext()
+        return self.instrumentation.span(phase=phase, interface_name=interface_name)
+
+    def _with_span(self, function: Callable, phase: str, interface_name: str):
+        """Wrap the function so that each of its calls is recorded as a span."""
+        if self.instrumentation is None:
+            return function
+
+        def function_with_span(*args, **kwargs):
+            with self._span(phase=phase, interface_name=interface_name):
+                return function(*args, **kwargs)
+
+        return function_with_span
+
+    def get_metadata(self):
+        """Auto-fill as much of the metadata as possible. Must comply with metadata schema."""
+        wrap = partial(self._with_span, phase="get_metadata")
+        with _wrapped_methods(interfaces=self.data_interface_objects, method_name="get_metadata", wrap=wrap):
+            return super().get_metadata()
+
+    def get_recording_conversion_options(
+        self,
+        conversion_options: dict,
+        write_options: Optional[dict] = None,
+        interface_names: Optional[Iterable[str]] = None
+    ):
+        """
+        Fill in the streaming write options for each of the raw recording interfaces.
+
+        Options passed explicitly in the conversion_options of an interface take precedence over the write_options.
+        If interface_names is passed, only the recording interfaces among them are filled in and counted.
+
+        Returns
+        -------
+        conversion_options : dict
+            A copy of the conversion_options with the write options of each recording interface added.
+        raw_data_size : int
+            Total size in bytes of the raw traces that will be written.
+        """
+        write_options = dict(DEFAULT_WRITE_OPTIONS, **(write_options or dict()))
+        conversion_options = {name: dict(options) for name, options in conversion_options.items()}
+        raw_data_size = 0
+        for interface_name in self.recording_interface_names:
+            if interface_name not in self.data_interface_objects:
+                continue
+            if interface_names is not None and interface_name not in interface_names:
+                continue
+            interface_options = conversion_options.get(interface_name, dict())
+            recording = self.data_interface_objects[interface_name].subset_recording(
+                stub_test=interface_options.get("stub_test", False)
+            )
+            conversion_options[interface_name] = dict(
+                make_recording_conversion_options(recording=recording, **write_options), **interface_options
+            )
+            raw_data_size += get_recording_size(recording=recording)
+        return conversion_options, raw_data_size
+
+    def get_fingerprints(
+        self,
+        metadata: dict,
+        conversion_options: dict,
+        write_options: Optional[dict] = None,
+        file_entries: Optional[dict] = None
+    ):
+        """
+        Fingerprint the inputs of the file and of each data interface, for an incremental conversion.
+
+        See get_interface_fingerprint for what each interface fingerprint covers; the fingerprint of an interface in
+        interface_dependencies also covers those of the interfaces it depends on, and the fingerprint of the file
+        covers the NWBFile and Subject metadata. file_entries holds the sizes, modification times and hashes of the
+        source files from a previous run, so that unchanged files are not hashed again.
+        """
+        write_options = dict(DEFAULT_WRITE_OPTIONS, **(write_options or dict()))
+        file_entries = dict() if file_entries is None else dict(file_entries)
+        interfaces = dict()
+        for interface_name, interface in self.data_interface_objects.items():
+            fingerprint = get_interface_fingerprint(
+                interface=interface,
+                metadata=metadata,
+                conversion_options=conversion_options.get(interface_name, dict()),
+                file_entries=file_entries,
+                write_options=write_options if interface_name in self.recording_interface_names else None
+            )
+            interfaces[interface_name] = dict(fingerprint=fingerprint, paths=[])
+        for interface_name, dependency_names in self.interface_dependencies.items():
+            if interface_name in interfaces:
+                interfaces[interface_name].update(
+                    fingerprint=combine_fingerprints(
+                        [interfaces[interface_name]["fingerprint"]]
+                        + [interfaces[x]["fingerprint"] for x in dependency_names if x in interfaces]
+                    )
+                )
+        return dict(file=get_metadata_fingerprint(metadata=metadata), files=file_entries, interfaces=interfaces)
+
+    def _prepare_incremental_update(self, nwbfile_path: str, fingerprints: dict, previous_fingerprints: Optional[dict]):
+        """
+        Remove the objects of the interfaces whose fingerprints changed from the NWB file, to write them again.
+
+        Returns the names of the interfaces to write, or None if the whole file has to be rewritten. The fingerprints
+        of the kept interfaces are updated with the paths of their objects.
+        """
+        if previous_fingerprints is None or previous_fingerprints["file"] != fingerprints["file"]:
+            return None
+        previous_interfaces = previous_fingerprints["interfaces"]
+        changed_interface_names = {
+            interface_name for interface_name, entry in fingerprints["interfaces"].items()
+            if entry["fingerprint"] is None
+            or entry["fingerprint"] != previous_interfaces.get(interface_name, dict()).get("fingerprint")
+        }
+        changed_interface_names.update(set(previous_interfaces) - set(fingerprints["interfaces"]))
+        if not changed_interface_names:
+            return []
+        rewritten_interface_names, removed_paths = plan_incremental_update(
+            nwbfile_path=nwbfile_path,
+            object_paths={interface_name: entry["paths"] for interface_name, entry in previous_interfaces.items()},
+            changed_interface_names=changed_interface_names
+        )
+        if rewritten_interface_names is None:
+            return None
+        # Invalidate the rewritten interfaces before removing their objects, so that a failed update is redone
+        write_fingerprints(
+            nwbfile_path=nwbfile_path,
+            fingerprints=dict(
+                previous_fingerprints,
+                interfaces={
+                    interface_name: dict(entry, fingerprint=None) if interface_name in rewritten_interface_names
+                    else entry for interface_name, entry in previous_interfaces.items()
+                }
+            )
+        )
+        remove_objects(nwbfile_path=nwbfile_path, paths=removed_paths)
+        for interface_name, entry in fingerprints["interfaces"].items():
+            if interface_name not in rewritten_interface_names:
+                entry.update(paths=previous_interfaces[interface_name]["paths"])
+        return [x for x in self.data_interface_objects if x in rewritten_interface_names]
+
+    def set_clock_mapping(self, interface_name: str, clock_mapping: ClockMapping):
+        """
+        Time the raw recording of an interface on another clock, such as the behavior FSM, through a ClockMapping.
 
+        The recording is written with the starting_time and rate of the mapping, and a table of its segments if it spans
+        more than one; see ClockAlignedRecordingExtractor and add_clock_segments. No per-sample timestamps are written.
+        """
+        if interface_name not in self.recording_interface_names or interface_name not in self.data_interface_objects:
+            raise ValueError(f"'{interface_name}' is not one of the recording interfaces of this converter!")
+        self.clock_mappings[interface_name] = clock_mapping
 
-class PoissonClicksNWBConverter(NWBConverter):
+    @contextmanager
+    def aligned_recordings(self):
+        """Within this context, each recording interface with a clock mapping writes its clock aligned recording."""
+        recordings = dict()
+        try:
+            for interface_name, clock_mapping in self.clock_mappings.items():
+                interface = self.data_interface_objects[interface_name]
+                if isinstance(interface.recording_extractor, ClockAlignedRecordingExtractor):
+                    continue
+                recordings[interface_name] = interface.recording_extractor
+                interface.recording_extractor = ClockAlignedRecordingExtractor(
+                    recording=interface.recording_extractor, clock_mapping=clock_mapping
+                )
+            yield
+        finally:
+            for interface_name, recording in recordings.items():
+                self.data_interface_objects[interface_name].recording_extractor = recording
+
+    @contextmanager
+    def preview_recordings(self, sampling_frequency: float = 30.):
+        """
+        Within this context, each raw recording interface writes its recording subsampled to about sampling_frequency.
+
+        The subsampled recordings span the full session at the same start time, so the alignment of the raw data with
+        the behavior and units can be checked on a file that takes minutes to write instead of hours.
+        """
+        recordings = dict()
+        try:
+            for interface_name in self.recording_interface_names:
+                if interface_name not in self.data_interface_objects:
+                    continue
+                interface = self.data_interface_objects[interface_name]
+                recordings[interface_name] = interface.recording_extractor
+                recording_sampling_frequency = interface.recording_extractor.get_sampling_frequency()
+                decimation_factor = max(1, round(recording_sampling_frequency / sampling_frequency))
+                interface.recording_extractor = DecimatedRecordingExtractor(
+                    recording=interface.recording_extractor, decimation_factor=decimation_factor
+                )
+            yield
+        finally:
+            for interface_name, recording in recordings.items():
+                self.data_interface_objects[interface_name].recording_extractor = recording
+
+    def run_conversion(
+        self,
+        metadata: Optional[dict] = None,
+        save_to_file: Optional[bool] = True,
+        nwbfile_path: Optional[str] = None,
+        overwrite: Optional[bool] = False,
+        nwbfile: Optional[NWBFile] = None,
+        conversion_options: Optional[dict] = None,
+        write_options: Optional[dict] = None,
+        preview: bool = False,
+        preview_sampling_frequency: float = 30.,
+        incremental: bool = False,
+        verbose: bool = True,
+    ):
+        """
+        Run the NWB conversion over all the instantiated data interfaces, through NWBConverter.run_conversion.
+
+        The options below only set up the recordings and the conversion of each interface around it; see
+        preview_recordings, aligned_recordings and converting_interfaces.
+
+        The raw recordings are streamed in bounded memory according to the write_options, a dictionary with any of
+        the keys buffer_mb, chunk_policy, chunk_mb, compression, compression_level, and max_memory_mb; see
+        make_recording_conversion_options for their meaning and DEFAULT_WRITE_OPTIONS for their defaults. The size of
+        the raw data, the wall time of the whole conversion, and the time and raw data throughput of the write of the
+        file are stored in the write_report attribute, and printed if verbose is True. Since the raw traces are only
+        read from their iterators as the file is written, the write time covers the raw data, along with the few
+        other datasets that are written with it; nothing is written, and there is no write time or throughput, if
+        save_to_file is False.
+
+        If preview is True, every other interface is converted in full, but the raw recordings are subsampled over
+        the whole session to about preview_sampling_frequency Hz; see preview_recordings. This is noted in the notes
+        of the NWBFile.
+
+        The raw recordings given a clock mapping by set_clock_mapping are timed on its clock; see aligned_recordings.
+
+        If incremental is True, a fingerprint of the inputs of each interface is recorded in the NWB file, along with
+        the paths of the objects it wrote; see BrodyNWBConverter.get_fingerprints. When the conversion is run again
+        to the same nwbfile_path, only the interfaces whose fingerprints changed are written again, in place, after
+        their previous objects are removed, along with any interface that refers to those objects; the rest of the
+        file, such as the raw acquisition of an unchanged recording, is left untouched. The whole file is rewritten
+        if it has no fingerprints or if its NWBFile or Subject metadata changed; overwrite does not apply. See
+        plan_incremental_update for the details. If verbose is True, the interfaces being updated, or that the file is
+        up to date, are printed.
+
+        If the converter was constructed with instrumentation, the report of its spans is stored in the
+        conversion_report attribute and saved as .report.json next to the NWB file, even if the conversion fails.
+        Since the raw traces are only read from their iterators as the file is written, their time is spent in the
+        write_nwbfile span; the bytes_written of each run_conversion span still count the datasets of its interface.
+        """
+        if metadata is None:
+            metadata = self.get_metadata()
+        if preview:
+            preview_notes = f"Preview conversion; the raw data is subsampled to {preview_sampling_frequency} Hz."
+            notes = metadata.get("NWBFile", dict()).get("notes")
+            metadata = dict_deep_update(
+                metadata, dict(NWBFile=dict(notes=preview_notes if notes is None else f"{preview_notes}\n{notes}"))
+            )
+        with ExitStack() as recordings:
+            if preview:
+                recordings.enter_context(self.preview_recordings(sampling_frequency=preview_sampling_frequency))
+            recordings.enter_context(self.aligned_recordings())
+
+            interface_names = list(self.data_interface_objects)
+            fingerprints = None
+            if incremental:
+                if not save_to_file or nwbfile_path is None:
+                    raise ValueError(
+                        "An incremental conversion updates the NWB file in place; pass a nwbfile_path with "
+                        "save_to_file=True!"
+                    )
+                previous_fingerprints = None
+                if Path(nwbfile_path).is_file():
+                    previous_fingerprints = read_fingerprints(nwbfile_path=nwbfile_path)
+                fingerprints = self.get_fingerprints(
+                    metadata=metadata,
+                    conversion_options=self.get_conversion_options() if conversion_options is None
+                    else conversion_options,
+                    write_options=write_options,
+                    file_entries=None if previous_fingerprints is None else previous_fingerprints["files"]
+                )
+                updated_interface_names = self._prepare_incremental_update(
+                    nwbfile_path=nwbfile_path, fingerprints=fingerprints, previous_fingerprints=previous_fingerprints
+                )
+                if updated_interface_names is not None and not updated_interface_names:
+                    if verbose:
+                        print(f"NWB file at {nwbfile_path} is up to date!")
+                    return
+                if updated_interface_names is not None and verbose:
+                    print(f"Updating {updated_interface_names} in {nwbfile_path}.")
+                overwrite = updated_interface_names is None
+                if updated_interface_names is not None:
+                    interface_names = updated_interface_names
+            interface_options, raw_data_size = self.get_recording_conversion_options(
+                conversion_options=self.get_conversion_options() if conversion_options is None else conversion_options,
+                write_options=write_options,
+                interface_names=interface_names
+            )
+
+            object_owners = dict()
+            file_write = dict()
+            write_report = None
+            start_time = time.perf_counter()
+            try:
+                with self.converting_interfaces(
+                    interface_names=interface_names,
+                    interface_options=interface_options,
+                    object_owners=object_owners,
+                    nwbfile_path=nwbfile_path if save_to_file else None,
+                    file_write=file_write
+                ):
+                    nwbfile = super().run_conversion(
+                        metadata=metadata,
+                        save_to_file=save_to_file,
+                        nwbfile_path=nwbfile_path,
+                        overwrite=overwrite,
+                        nwbfile=nwbfile,
+                        conversion_options=conversion_options
+                    )
+                if fingerprints is not None:
+                    object_paths = get_object_paths(nwbfile_path=nwbfile_path, object_owners=object_owners)
+                    for interface_name in interface_names:
+                        fingerprints["interfaces"][interface_name].update(paths=object_paths.get(interface_name, []))
+                    write_fingerprints(nwbfile_path=nwbfile_path, fingerprints=fingerprints)
+                write_time = file_write.get("wall_time_s")
+                write_report = dict(
+                    raw_data_mb=raw_data_size / 1e6,
+                    wall_time_s=time.perf_counter() - start_time,
+                    write_time_s=write_time,
+                    throughput_mb_s=raw_data_size / 1e6 / write_time if write_time else None
+                )
+            finally:
+                if self.instrumentation is not None:
+                    self._write_conversion_report(
+                        nwbfile_path=nwbfile_path if save_to_file else None,
+                        object_owners=object_owners,
+                        write_report=write_report
+                    )
+
+        self.write_report = write_report
+        if verbose and raw_data_size and write_report["throughput_mb_s"] is not None:
+            print(
+                f"Wrote {write_report['raw_data_mb']:.1f} MB of raw data in {write_report['write_time_s']:.1f} s "
+                f"({write_report['throughput_mb_s']:.1f} MB/s)."
+            )
+        return nwbfile
+
+    @contextmanager
+    def converting_interfaces(
+        self,
+        interface_names: Iterable[str],
+        interface_options: dict,
+        object_owners: dict,
+        nwbfile_path: Optional[str] = None,
+        file_write: Optional[dict] = None
+    ):
+        """
+        Within this context, NWBConverter.run_conversion converts only the named interfaces.
+
+        The other interfaces stay in the converter, so that the metadata and conversion options are still validated
+        against the schema of the whole converter, but their run_conversion does nothing. Each named interface is
+        converted with its interface_options, such as the write options filled in by get_recording_conversion_options,
+        under the options passed to NWBConverter.run_conversion. The clock segments of each clock aligned recording are
+        added after it, and the objects added by each interface are noted in object_owners. The write of the file at
+        nwbfile_path, once the last interface is converted, is timed; its wall_time_s and bytes_written are noted in
+        file_write. With instrumentation, the conversion of each interface and the write are also recorded as spans.
+        """
+        remaining_interface_names = set(self.data_interface_objects).intersection(interface_names)
+        file_write = dict() if file_write is None else file_write
+        write_span = dict()
+
+        def skip_conversion(nwbfile: NWBFile, metadata: dict, **conversion_options):
+            pass
+
+        def make_run_conversion(run_conversion: Callable, interface_name: str):
+            if interface_name not in remaining_interface_names:
+                return skip_conversion
+
+            def run_interface_conversion(nwbfile: NWBFile, metadata: dict, **conversion_options):
+                object_ids = _get_object_ids(nwbfile=nwbfile)
+                conversion_options = dict(interface_options.get(interface_name, dict()), **conversion_options)
+                with self._span(phase="run_conversion", interface_name=interface_name):
+                    run_conversion(nwbfile, metadata, **conversion_options)
+                    if interface_name in self.clock_mappings:
+                        self._add_clock_segments(
+                            nwbfile=nwbfile,
+                            interface_name=interface_name,
+                            object_ids=object_ids,
+                            stub_test=conversion_options.get("stub_test", False)
+                        )
+                object_owners.update({x: interface_name for x in _get_object_ids(nwbfile=nwbfile) - object_ids})
+                remaining_interface_names.discard(interface_name)
+                if not remaining_interface_names and nwbfile_path is not None:
+                    write_span.update(
+                        span=write_stack.enter_context(self._span(phase="write_nwbfile")),
+                        file_size=Path(nwbfile_path).stat().st_size,
+                        start_time=time.perf_counter()
+                    )
+
+            return run_interface_conversion
+
+        with ExitStack() as write_stack:
+            with _wrapped_methods(
+                interfaces=self.data_interface_objects, method_name="run_conversion", wrap=make_run_conversion
+            ):
+                yield
+        if "start_time" in write_span:
+            file_write.update(
+                wall_time_s=time.perf_counter() - write_span["start_time"],
+                bytes_written=Path(nwbfile_path).stat().st_size - write_span["file_size"]
+            )
+            if write_span["span"] is not None:
+                write_span["span"].update(bytes_written=file_write["bytes_written"])
+
+    def _add_clock_segments(self, nwbfile: NWBFile, interface_name: str, object_ids: set, stub_test: bool):
+        """Add the clock segments of each series just written by a clock aligned recording interface."""
+        data_interface = self.data_interface_objects[interface_name]
+        num_frames = data_interface.subset_recording(stub_test=stub_test).get_num_frames()
+        new_series = [
+            x for x in nwbfile.all_children() if isinstance(x, ElectricalSeries) and x.object_id not in object_ids
+        ]
+        for electrical_series in new_series:
+            add_clock_segments(
+                nwbfile=nwbfile,
+                electrical_series=electrical_series,
+                recording=data_interface.recording_extractor,
+                num_frames=num_frames
+            )
+
+    def _write_conversion_report(self, nwbfile_path: Optional[str], object_owners: dict, write_report: Optional[dict]):
+        """Attribute the bytes written to the interfaces, then save the report of the spans next to the NWB file."""
+        if nwbfile_path is not None and write_report is not None and object_owners:
+            bytes_written = get_bytes_written_by_object(nwbfile_path=nwbfile_path, object_ids=object_owners)
+            for span in self.instrumentation.spans:
+                if span["phase"] == "run_conversion":
+                    span.update(bytes_written=bytes_written.get(span["interface"], 0))
+        self.conversion_report = dict(
+            self.instrumentation.report(), nwbfile_path=nwbfile_path, write_report=write_report
+        )
+        if nwbfile_path is not None:
+            with open(Path(nwbfile_path).with_suffix(".report.json"), mode="w") as f:
+                json.dump(self.conversion_report, f, indent=2)
+
+
+class PoissonClicksNWBConverter(BrodyNWBConverter):
     """Primary conversion class for the SpikeGLX formatted Brody lab data."""
 
     data_interface_classes = dict(
         SpikeGLXRecording=SpikeGLXRecordingInterface,
         SpikeGLXLFP=SpikeGLXLFPInterface,
         ProcessedBehavior=PoissonClicksProcessedInterface,
+        CuratedSorting=CuratedSortingInterface,
     )
+    recording_interface_names = ("SpikeGLXRecording", "SpikeGLXLFP")
 
 
-class BrodyNeuralynxNWBConverter(NWBConverter):
+class BrodyNeuralynxNWBConverter(BrodyNWBConverter):
     """Primary conversion class for the Neuralynx formatted Brody lab data."""
 
     data_interface_classes = dict(
         NeuralynxRecording=NeuralynxRecordingInterface,
+        NeuralynxLFP=NeuralynxLFPInterface,
         ProcessedBehavior=MSortedProcessedInterface,
         MSorted=MSortedSortingInterface,
+        TrialAlignedPSTH=TrialAlignedPSTHInterface,
     )
+    recording_interface_names = ("NeuralynxRecording", "NeuralynxLFP")
+    interface_dependencies = dict(TrialAlignedPSTH=("ProcessedBehavior", "MSorted"))
+
+    def __init__(self, source_data, instrumentation: Optional[ConversionInstrumentation] = None):
+        # The processed behavior and sorting interfaces both read the same Msorted .mat file; they share its handle
+        self.h5_pool = H5FilePool()
+        with self.h5_pool.activate():
+            super().__init__(source_data=source_data, instrumentation=instrumentation)
+
+    def run_conversion(
+        self,
+        metadata: Optional[dict] = None,
+        save_to_file: Optional[bool] = True,
+        nwbfile_path: Optional[str] = None,
+        overwrite: Optional[bool] = False,
+        nwbfile: Optional[NWBFile] = None,
+        conversion_options: Optional[dict] = None,
+        write_options: Optional[dict] = None,
+        preview: bool = False,
+        preview_sampling_frequency: float = 30.,
+        incremental: bool = False,
+        verbose: bool = True,
+    ):
+        """Run the conversion as in BrodyNWBConverter.run_conversion, closing every shared source file handle after."""
+        try:
+            return super().run_conversion(
+                metadata=metadata,
+                save_to_file=save_to_file,
+                nwbfile_path=nwbfile_path,
+                overwrite=overwrite,
+                nwbfile=nwbfile,
+                conversion_options=conversion_options,
+                write_options=write_options,
+                preview=preview,
+                preview_sampling_frequency=preview_sampling_frequency,
+                incremental=incremental,
+                verbose=verbose
+            )
+        finally:
+            self.h5_pool.close()
 
 
-class BrodySpikeGadgetsNWBConverter(NWBConverter):
+class BrodySpikeGadgetsNWBConverter(BrodyNWBConverter):
     """Primary conversion class for the SpikeGadgets formatted Brody lab data."""
 
     data_interface_classes = dict(
         SpikeGadgetsRecording=SpikeGadgetsRecordingInterface,
         ProtocolInfo=ProtocolInfoInterface,
         AnalysisClusters=AnalysisClustersSortingInterface,
+        TrialAlignedPSTH=TrialAlignedPSTHInterface,
     )
+    recording_interface_names = ("SpikeGadgetsRecording",)
+    interface_dependencies = dict(TrialAlignedPSTH=("ProtocolInfo", "AnalysisClusters"))
@@ -0,0 +1,17 @@
+"""Authors: Cody Baker."""
+from pathlib import Path
+
+from brody_lab_to_nwb.batchconversion import run_batch_conversion
+
+# Point to the manifest of sessions to convert; see brody_lab_to_nwb.batchconversion.load_manifest for its format
+manifest_path = Path("E:/Brody/conversion_manifest.json")
+
+# Set the number of sessions to convert at once; each one holds its own source and NWB files open
+max_workers = 4
+
+
+# Run the conversion; running this again resumes with only the failed or unfinished sessions
+if __name__ == "__main__":
+    ledger = run_batch_conversion(manifest_path=manifest_path, max_workers=max_workers)
+    for session_id, entry in ledger.items():
+        print(session_id, entry["status"], entry.get("throughput_mb_s"), entry.get("error", ""))
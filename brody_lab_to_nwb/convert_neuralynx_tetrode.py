@@ -4,6 +4,7 @@ from isodate import duration_isoformat
 from datetime import timedelta, datetime
 
 from brody_lab_to_nwb import BrodyNeuralynxNWBConverter
+from brody_lab_to_nwb.interfaces.utils import DEFAULT_WRITE_OPTIONS
 
 # Point to the base folder path for both recording data and Virmen
 base_path = Path("E:/Brody/Neuralynx Tetrode Data")
@@ -31,15 +32,34 @@ subject_info = dict(
 
 # Set some global conversion options here
 stub_test = True
+# Set preview to True to write all of the behavior and sorting data, along with the raw data subsampled to about
+# preview_sampling_frequency over the whole session, to check the alignment and metadata before a full conversion
+preview = False
+preview_sampling_frequency = 30.
+# Set incremental to True to record a fingerprint of the inputs of each interface in the NWB file; a rerun then only
+# rewrites the interfaces whose source files, options or metadata changed, leaving the raw data in place
+incremental = False
+# Streaming options for the raw data, see BrodyNWBConverter.run_conversion; only those that differ are overridden
+write_options = dict(DEFAULT_WRITE_OPTIONS, max_memory_mb=2000.)
+lfp_sampling_frequency = 1000.  # the LFP is anti-alias filtered and decimated from the raw data in the same pass
+# Trials table columns around which to write the spike counts of each unit in the bins of psth_options; empty to skip
+psth_event_names = ["cpoke_in_time", "clicks_on_time"]
+psth_options = dict(window_start=-0.5, window_stop=1., bin_size=0.01)  # in seconds
 
 
 # Run the conversion
 source_data = dict(
     NeuralynxRecording=dict(folder_path=str(raw_data_folder)),
+    NeuralynxLFP=dict(folder_path=str(raw_data_folder), lfp_sampling_frequency=lfp_sampling_frequency),
     ProcessedBehavior=dict(file_path=str(processed_file_path)),
     MSorted=dict(file_path=str(processed_file_path))
 )
-conversion_options = dict(NeuralynxRecording=dict(stub_test=stub_test))
+if psth_event_names:
+    source_data.update(TrialAlignedPSTH=dict(event_names=psth_event_names, **psth_options))
+conversion_options = dict(
+    NeuralynxRecording=dict(stub_test=stub_test and not preview),
+    NeuralynxLFP=dict(stub_test=stub_test and not preview)
+)
 converter = BrodyNeuralynxNWBConverter(source_data=source_data)
 metadata = converter.get_metadata()
 metadata['NWBFile'].update(session_description=session_description)
@@ -48,5 +68,9 @@ converter.run_conversion(
     nwbfile_path=str(nwbfile_path),
     metadata=metadata,
     conversion_options=conversion_options,
-    overwrite=True
+    write_options=write_options,
+    overwrite=True,
+    preview=preview,
+    preview_sampling_frequency=preview_sampling_frequency,
+    incremental=incremental
 )
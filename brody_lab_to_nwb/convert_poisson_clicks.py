@@ -4,6 +4,7 @@ from isodate import duration_isoformat
 from datetime import timedelta, datetime
 
 from brody_lab_to_nwb import PoissonClicksNWBConverter
+from brody_lab_to_nwb.interfaces.utils import DEFAULT_WRITE_OPTIONS
 
 # Point to the base folder path for both recording data and Virmen
 base_path = Path("E:/Brody/Chronic Rat Neuropixels (Poisson Clicks Task)")
@@ -29,6 +30,15 @@ subject_info = dict(
 
 # Set some global conversion options here
 stub_test = True
+# Set preview to True to write all of the behavior and sorting data, along with the raw data subsampled to about
+# preview_sampling_frequency over the whole session, to check the alignment and metadata before a full conversion
+preview = False
+preview_sampling_frequency = 30.
+# Set incremental to True to record a fingerprint of the inputs of each interface in the NWB file; a rerun then only
+# rewrites the interfaces whose source files, options or metadata changed, leaving the raw data in place
+incremental = False
+# Streaming options for the raw data, see BrodyNWBConverter.run_conversion; only those that differ are overridden
+write_options = dict(DEFAULT_WRITE_OPTIONS, max_memory_mb=2000.)
 
 
 # Run the conversion
@@ -41,7 +51,10 @@ source_data = dict(
     SpikeGLXLFP=dict(file_path=str(lfp_data_file)),
     ProcessedBehavior=dict(file_path=str(processed_file_path))
 )
-conversion_options = dict(SpikeGLXRecording=dict(stub_test=stub_test), SpikeGLXLFP=dict(stub_test=stub_test))
+conversion_options = dict(
+    SpikeGLXRecording=dict(stub_test=stub_test and not preview),
+    SpikeGLXLFP=dict(stub_test=stub_test and not preview)
+)
 converter = PoissonClicksNWBConverter(source_data=source_data)
 metadata = converter.get_metadata()
 metadata['NWBFile'].update(session_description=session_description)
@@ -50,5 +63,9 @@ converter.run_conversion(
     nwbfile_path=str(nwbfile_path),
     metadata=metadata,
     conversion_options=conversion_options,
-    overwrite=True
+    write_options=write_options,
+    overwrite=True,
+    preview=preview,
+    preview_sampling_frequency=preview_sampling_frequency,
+    incremental=incremental
 )
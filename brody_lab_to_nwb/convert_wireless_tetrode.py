@@ -4,6 +4,7 @@ from isodate import duration_isoformat
 from datetime import timedelta, datetime
 
 from brody_lab_to_nwb import BrodySpikeGadgetsNWBConverter
+from brody_lab_to_nwb.interfaces.utils import DEFAULT_WRITE_OPTIONS
 
 # Point to the base folder path for both recording data and Virmen
 base_path = Path("E:/Brody/WirelessTetrodes")
@@ -34,6 +35,22 @@ subject_info = dict(
 
 # Set some global conversion options here
 stub_test = True
+# Set preview to True to write all of the behavior and sorting data, along with the raw data subsampled to about
+# preview_sampling_frequency over the whole session, to check the alignment and metadata before a full conversion
+preview = False
+preview_sampling_frequency = 30.
+# Set incremental to True to record a fingerprint of the inputs of each interface in the NWB file; a rerun then only
+# rewrites the interfaces whose source files, options or metadata changed, leaving the raw data in place
+incremental = False
+# Streaming options for the raw data, see BrodyNWBConverter.run_conversion; only those that differ are overridden
+write_options = dict(DEFAULT_WRITE_OPTIONS, max_memory_mb=2000.)
+# Trials table columns around which to write the spike counts of each unit in the bins of psth_options; empty to skip
+psth_event_names = ["c_poke_time"]
+psth_options = dict(window_start=-0.5, window_stop=1., bin_size=0.01)  # in seconds
+# Set align_to_behavior_clock to True to time the raw data on the behavior FSM clock, like the units and trials, through
+# the spk2fsm mapping of the clusters file, once that mapping has been checked against the sync pulses of the session;
+# a mapping fit from sync pulses by fit_clock_mapping can be set the same way
+align_to_behavior_clock = False
 
 
 # Run the conversion
@@ -46,10 +63,17 @@ source_data = dict(
     ProtocolInfo=dict(file_path=str(protocol_info_file)),
     AnalysisClusters=dict(file_path=str(clusters_for_analysis_file)),
 )
+if psth_event_names:
+    source_data.update(TrialAlignedPSTH=dict(event_names=psth_event_names, **psth_options))
 conversion_options = dict(
-    SpikeGadgetsRecording=dict(stub_test=stub_test),
+    SpikeGadgetsRecording=dict(stub_test=stub_test and not preview),
 )
 converter = BrodySpikeGadgetsNWBConverter(source_data=source_data)
+if align_to_behavior_clock:
+    converter.set_clock_mapping(
+        interface_name="SpikeGadgetsRecording",
+        clock_mapping=converter.data_interface_objects["AnalysisClusters"].clock_mapping
+    )
 metadata = converter.get_metadata()
 metadata['NWBFile'].update(session_description=session_description)
 metadata.update(Subject=subject_info)
@@ -57,5 +81,9 @@ converter.run_conversion(
     nwbfile_path=str(nwbfile_path),
     metadata=metadata,
     conversion_options=conversion_options,
-    overwrite=True
+    write_options=write_options,
+    overwrite=True,
+    preview=preview,
+    preview_sampling_frequency=preview_sampling_frequency,
+    incremental=incremental
 )
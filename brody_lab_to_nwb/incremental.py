@@ -0,0 +1,309 @@
+"""Authors: Cody Baker."""
+import hashlib
+import inspect
+import json
+from datetime import date, datetime
+from pathlib import Path
+from typing import Iterable, Optional
+
+import h5py
+import numpy as np
+
+from .interfaces.clockalignment import ClockAlignedRecordingExtractor
+from .interfaces.utils import PathType
+
+FINGERPRINT_ATTRIBUTE = "brody_lab_to_nwb_fingerprints"
+FINGERPRINT_VERSION = 1
+SOURCE_PATH_KEYS = ("file_path", "folder_path", "filename")
+HASH_CHUNK_SIZE = 2 ** 24
+
+
+def _hash_file(file_path: Path):
+    hasher = hashlib.blake2b(digest_size=20)
+    with open(file_path, mode="rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _to_json(value):
+    """json.dumps default for the numpy values of metadata and options; anything else cannot be fingerprinted."""
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    if isinstance(value, Path):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} cannot be fingerprinted!")
+
+
+def _digest(value):
+    return hashlib.blake2b(json.dumps(value, sort_keys=True, default=_to_json).encode(), digest_size=16).hexdigest()
+
+
+def get_path_fingerprint(path: PathType, file_entries: dict, hash_contents: bool = True):
+    """
+    Fingerprint of the contents of a source file, or of every file in a source folder other than hidden sidecars.
+
+    If hash_contents is True, the files are hashed, so that copying or touching them does not change the fingerprint;
+    otherwise, as for the raw recordings, which are too large to read through on every conversion, they are
+    fingerprinted by their size and modification time alone. Hashes are reused from file_entries, which maps the
+    absolute path of each file to its size, modification time and hash, as long as the first two are unchanged;
+    file_entries is updated in place.
+    """
+    path = Path(path).absolute()
+    if path.is_file():
+        files = [(path.name, path)]
+    else:
+        files = sorted(
+            (str(x.relative_to(path)), x) for x in path.rglob("*") if x.is_file() and not x.name.startswith(".")
+        )
+    fingerprint = []
+    for name, file_path in files:
+        file_stat = file_path.stat()
+        entry = file_entries.get(str(file_path))
+        if (
+            entry is None
+            or entry["size"] != file_stat.st_size
+            or entry["mtime_ns"] != file_stat.st_mtime_ns
+            or (hash_contents and entry["hash"] is None)
+        ):
+            file_hash = _hash_file(file_path=file_path) if hash_contents else None
+            entry = dict(size=file_stat.st_size, mtime_ns=file_stat.st_mtime_ns, hash=file_hash)
+            file_entries[str(file_path)] = entry
+        fingerprint.append([name, entry["size"], entry["hash"] if hash_contents else entry["mtime_ns"]])
+    return fingerprint
+
+
+def _restrict_metadata(metadata, template):
+    """The entries of metadata at the keys of template, recursing into the dictionaries they both hold."""
+    if not isinstance(metadata, dict) or not isinstance(template, dict):
+        return metadata
+    return {key: _restrict_metadata(metadata.get(key), value) for key, value in template.items()}
+
+
+def get_interface_fingerprint(
+    interface, metadata: dict, conversion_options: dict, file_entries: dict, write_options: Optional[dict] = None
+):
+    """
+    Fingerprint of everything that determines what a data interface writes to the NWB file.
+
+    That is the contents of its source files and folders, its other source data, the contents of any other files it
+    declares in an input_file_paths attribute, such as the column_mapping.csv of ProtocolInfoInterface, the source
+    code of its module, the part of the metadata at the keys it fills in itself, its conversion options and, for a
+    recording interface, the write options and the shape and timing of its recording. Returns None if any of these
+    cannot be fingerprinted, such as an in memory sorting; such an interface is always rewritten.
+
+    The write_options are passed only for the recording interfaces, whose raw source files are fingerprinted by their
+    size and modification time; the source files of every other interface, e.g. the processed and behavior .mat files,
+    are hashed.
+    """
+    source_data = {
+        key: get_path_fingerprint(path=value, file_entries=file_entries, hash_contents=write_options is None)
+        if key in SOURCE_PATH_KEYS and value is not None and Path(value).exists() else value
+        for key, value in interface.source_data.items()
+    }
+    fingerprint = dict(
+        interface=f"{type(interface).__module__}.{type(interface).__name__}",
+        source_code=_hash_file(file_path=Path(inspect.getsourcefile(type(interface)))),
+        source_data=source_data,
+        input_files=[
+            get_path_fingerprint(path=x, file_entries=file_entries) for x in getattr(interface, "input_file_paths", ())
+        ],
+        metadata=_restrict_metadata(metadata=metadata, template=interface.get_metadata()),
+        conversion_options=conversion_options,
+    )
+    if write_options is not None:
+        recording = interface.recording_extractor
+        fingerprint.update(
+            write_options=write_options,
+            recording=[
+                recording.get_sampling_frequency(),
+                recording.get_num_frames(),
+                recording.get_num_channels(),
+                recording.frame_to_time(0)
+            ]
+        )
+        if isinstance(recording, ClockAlignedRecordingExtractor):
+            fingerprint.update(clock_segments=recording.get_clock_segments())
+    try:
+        return _digest(fingerprint)
+    except TypeError:
+        return None
+
+
+def combine_fingerprints(fingerprints: Iterable[Optional[str]]):
+    """Fingerprint of several fingerprints together, e.g., of an interface and the interfaces it is computed from."""
+    fingerprints = list(fingerprints)
+    return None if None in fingerprints else _digest(fingerprints)
+
+
+def get_metadata_fingerprint(metadata: dict):
+    """
+    Fingerprint of the file level metadata, which can only be updated by rewriting the whole file.
+
+    The identifier is left out, since get_default_nwbfile_metadata draws a new one each time; an updated file keeps
+    the identifier it was first written with.
+    """
+    nwbfile_metadata = {key: value for key, value in metadata.get("NWBFile", dict()).items() if key != "identifier"}
+    return _digest(dict(NWBFile=nwbfile_metadata, Subject=metadata.get("Subject")))
+
+
+def read_fingerprints(nwbfile_path: PathType):
+    """The fingerprints recorded in an NWB file by an incremental conversion, or None if there are none."""
+    with h5py.File(nwbfile_path, mode="r") as file:
+        fingerprints = file.attrs.get(FINGERPRINT_ATTRIBUTE)
+    if fingerprints is None:
+        return None
+    fingerprints = json.loads(fingerprints)
+    return fingerprints if fingerprints.get("version") == FINGERPRINT_VERSION else None
+
+
+def write_fingerprints(nwbfile_path: PathType, fingerprints: dict):
+    """Record the fingerprints as a variable length string attribute of the root of the NWB file."""
+    with h5py.File(nwbfile_path, mode="r+") as file:
+        file.attrs[FINGERPRINT_ATTRIBUTE] = json.dumps(dict(fingerprints, version=FINGERPRINT_VERSION))
+
+
+def get_object_paths(nwbfile_path: PathType, object_owners: dict):
+    """Map the owner of each NWB container, as in object_owners, to the sorted HDF5 paths of its containers."""
+    object_paths = dict()
+    with h5py.File(nwbfile_path, mode="r") as file:
+
+        def add_object(path: str, node):
+            object_id = node.attrs.get("object_id")
+            object_id = object_id.decode() if isinstance(object_id, bytes) else object_id
+            if object_id in object_owners:
+                object_paths.setdefault(object_owners[object_id], []).append(f"/{path}")
+
+        file.visititems(add_object)
+    return {owner: sorted(paths) for owner, paths in object_paths.items()}
+
+
+def _get_ancestors(path: str):
+    """The path itself followed by each of its parent groups, excluding the root."""
+    while path:
+        yield path
+        path = path.rpartition("/")[0]
+
+
+def _is_under(path: str, paths: set):
+    return any(x in paths for x in _get_ancestors(path))
+
+
+def _get_references(file: h5py.File):
+    """
+    The (source, target) paths of every soft link and object reference in the file, and the paths of its tables.
+
+    Links are found as soft links, such as the device of an electrode group, and as object references in datasets and
+    attributes, such as the group column of the electrodes table or the table of a DynamicTableRegion.
+    """
+    references = []
+    table_paths = set()
+
+    def add_object_references(source_path: str, values):
+        references.extend((source_path, file[x].name) for x in np.ravel(values) if isinstance(x, h5py.Reference) and x)
+
+    def visit(group: h5py.Group):
+        if "colnames" in group.attrs:
+            table_paths.add(group.name)
+        for value in group.attrs.values():
+            add_object_references(source_path=group.name, values=value)
+        for name in group:
+            path = f"{group.name.rstrip('/')}/{name}"
+            link = group.get(name, getlink=True)
+            if isinstance(link, h5py.SoftLink):
+                references.append((path, link.path))
+                continue
+            if not isinstance(link, h5py.HardLink):
+                continue
+            node = group[name]
+            if isinstance(node, h5py.Group):
+                visit(node)
+                continue
+            for value in node.attrs.values():
+                add_object_references(source_path=path, values=value)
+            fields = node.dtype.names or [None]
+            for field in fields:
+                field_dtype = node.dtype if field is None else node.dtype.fields[field][0]
+                if h5py.check_dtype(ref=field_dtype) is h5py.Reference:
+                    add_object_references(source_path=path, values=node[()] if field is None else node[field])
+
+    visit(file)
+    return references, table_paths
+
+
+def plan_incremental_update(nwbfile_path: PathType, object_paths: dict, changed_interface_names: Iterable[str]):
+    """
+    Find the objects to remove from an NWB file so that the changed interfaces can be written to it again.
+
+    Each changed interface loses every object it owns, except for the groups that also hold objects of unchanged
+    interfaces, such as a shared processing module. If an unchanged interface refers to a removed object, through a
+    link or object reference, or shares a table with a rewritten interface, it is rewritten as well, and so on until
+    nothing left in the file depends on anything removed.
+
+    Parameters
+    ----------
+    nwbfile_path : PathType
+    object_paths : dict
+        Maps the name of each interface in the file to the paths of the containers it owns, as by get_object_paths.
+    changed_interface_names : iterable of str
+
+    Returns
+    -------
+    rewritten_interface_names : set of str, or None
+        The interfaces to write again. None if an object that does not belong to any interface depends on a removed
+        one, in which case the whole file has to be rewritten.
+    removed_paths : list of str
+        The paths to remove from the file, at most one per branch.
+    """
+    owners = {path: interface_name for interface_name, paths in object_paths.items() for path in paths}
+
+    def get_owner(path: str):
+        return next((owners[x] for x in _get_ancestors(path) if x in owners), None)
+
+    with h5py.File(nwbfile_path, mode="r") as file:
+        references, table_paths = _get_references(file=file)
+    rewritten_interface_names = set(changed_interface_names)
+    while True:
+        kept_ancestors = set()
+        for path, interface_name in owners.items():
+            if interface_name not in rewritten_interface_names:
+                kept_ancestors.update(_get_ancestors(path))
+        removed_paths = set()
+        for path in sorted(owners, key=lambda x: x.count("/")):
+            if owners[path] in rewritten_interface_names and path not in kept_ancestors:
+                if not _is_under(path, removed_paths):
+                    removed_paths.add(path)
+        dependent_interface_names = {
+            get_owner(source_path) for source_path, target_path in references
+            if _is_under(target_path, removed_paths) and not _is_under(source_path, removed_paths)
+        }
+        # A table is written as a whole, so one that would only be partly removed is rewritten with all its columns
+        partial_table_paths = {
+            x for x in table_paths if not _is_under(x, removed_paths) and (
+                get_owner(x) in rewritten_interface_names or any(y.rpartition("/")[0] == x for y in removed_paths)
+            )
+        }
+        dependent_interface_names.update(get_owner(x) for x in partial_table_paths)
+        dependent_interface_names.update(
+            interface_name for path, interface_name in owners.items()
+            if any(path.startswith(f"{x}/") for x in partial_table_paths)
+        )
+        if None in dependent_interface_names:
+            return None, []
+        if dependent_interface_names <= rewritten_interface_names:
+            return rewritten_interface_names, sorted(removed_paths)
+        rewritten_interface_names |= dependent_interface_names
+
+
+def remove_objects(nwbfile_path: PathType, paths: Iterable[str]):
+    """
+    Unlink the objects at these paths from the NWB file.
+
+    HDF5 does not reclaim the space of unlinked objects; run h5repack on the file to compact it after many updates.
+    """
+    with h5py.File(nwbfile_path, mode="r+") as file:
+        for path in paths:
+            if path in file:
+                del file[path]
@@ -0,0 +1,160 @@
+"""Authors: Cody Baker."""
+import cProfile
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import h5py
+
+from .interfaces.utils import PathType
+
+
+def get_rss_mb():
+    """Current resident memory of this process, in MB."""
+    import psutil
+
+    return psutil.Process().memory_info().rss / 1e6
+
+
+def get_peak_rss_mb():
+    """Peak resident memory of this process so far, in MB."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        import psutil
+
+        return psutil.Process().memory_info().peak_wset / 1e6
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1e6 if sys.platform == "darwin" else peak_rss / 1e3  # bytes on macOS, kB elsewhere
+
+
+def make_cprofile_hook(output_folder: PathType):
+    """
+    Profiler hook for ConversionInstrumentation that saves a cProfile .prof file for each profiled phase.
+
+    Any other profiler can be hooked in the same way; the hook is called with the name of the phase and must return a
+    context manager that profiles its body, e.g., lambda name: pyinstrument.Profiler() for a sampling profiler.
+    """
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def cprofile_hook(name: str):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield profile
+        finally:
+            profile.disable()
+            profile.dump_stats(str(output_folder / f"{name}.prof"))
+
+    return cprofile_hook
+
+
+class ConversionInstrumentation:
+    """
+    Records a timing and memory span for each phase of a conversion.
+
+    Each span holds its wall time, the change in resident memory, and the peak resident memory of the process by its
+    end. Optionally, a profiler hook is wrapped around the phases named in profile_phases. The resident memory is
+    read through psutil, which is only imported once a span is recorded, so the converters do not require it.
+    """
+
+    def __init__(self, profiler: Optional[Callable] = None, profile_phases: Optional[Iterable[str]] = None):
+        """
+        Parameters
+        ----------
+        profiler : callable, optional
+            Called with the name of a phase, e.g. 'MSorted.run_conversion', returning a context manager that profiles
+            the phase; see make_cprofile_hook.
+        profile_phases : iterable of str, optional
+            Names of the phases to profile, either in full ('MSorted.run_conversion') or by phase ('run_conversion').
+            Defaults to every phase.
+        """
+        self.profiler = profiler
+        self.profile_phases = None if profile_phases is None else set(profile_phases)
+        self.spans = []
+
+    def _is_profiled(self, name: str, phase: str):
+        if self.profiler is None:
+            return False
+        return self.profile_phases is None or name in self.profile_phases or phase in self.profile_phases
+
+    @contextmanager
+    def span(self, phase: str, interface_name: Optional[str] = None):
+        """Record a span around the body; the yielded dictionary can be updated with extra fields."""
+        name = phase if interface_name is None else f"{interface_name}.{phase}"
+        span = dict(name=name, interface=interface_name, phase=phase, status="ok")
+        rss_before = get_rss_mb()
+        peak_rss_before = get_peak_rss_mb()
+        start_time = time.perf_counter()
+        try:
+            with self.profiler(name) if self._is_profiled(name=name, phase=phase) else nullcontext():
+                yield span
+        except Exception as e:
+            span.update(status="failed", error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            peak_rss = get_peak_rss_mb()
+            span.update(
+                wall_time_s=time.perf_counter() - start_time,
+                rss_increase_mb=get_rss_mb() - rss_before,
+                peak_rss_mb=peak_rss,
+                peak_rss_increase_mb=peak_rss - peak_rss_before
+            )
+            self.spans.append(span)
+
+    def report(self):
+        """The spans recorded so far, along with the totals per interface."""
+        interfaces = dict()
+        for span in self.spans:
+            if span["interface"] is not None:
+                totals = interfaces.setdefault(span["interface"], dict(wall_time_s=0., peak_rss_mb=0.))
+                totals["wall_time_s"] += span["wall_time_s"]
+                totals["peak_rss_mb"] = max(totals["peak_rss_mb"], span["peak_rss_mb"])
+                if "bytes_written" in span:
+                    totals["bytes_written"] = totals.get("bytes_written", 0) + span["bytes_written"]
+        return dict(
+            created=datetime.now().isoformat(timespec="seconds"),
+            peak_rss_mb=get_peak_rss_mb(),
+            interfaces=interfaces,
+            spans=self.spans
+        )
+
+
+def get_bytes_written_by_object(nwbfile_path: PathType, object_ids: dict):
+    """
+    Storage size of the datasets in an NWB file, attributed to the owners of the containers that hold them.
+
+    Parameters
+    ----------
+    nwbfile_path : PathType
+        Path to the written NWB file.
+    object_ids : dict
+        Maps the object_id of each NWB container to the name of its owner, e.g. the interface that added it.
+        A dataset counts towards the owner of its nearest enclosing container, or towards None if there is none.
+    """
+    bytes_written = dict()
+    with h5py.File(nwbfile_path, mode="r") as file:
+        owners = dict()
+
+        def find_owner(path: str):
+            while path not in owners:
+                node_id = file[path].attrs.get("object_id") if path else None
+                owner = object_ids.get(node_id.decode() if isinstance(node_id, bytes) else node_id, ...)
+                if owner is not ... or path == "":
+                    owners[path] = None if owner is ... else owner
+                    break
+                owners[path] = find_owner(path.rpartition("/")[0])
+            return owners[path]
+
+        def add_dataset(path: str, node):
+            if isinstance(node, h5py.Dataset):
+                owner = find_owner(path)
+                bytes_written[owner] = bytes_written.get(owner, 0) + node.id.get_storage_size()
+
+        file.visititems(add_dataset)
+    return bytes_written
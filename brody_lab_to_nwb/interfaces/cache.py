@@ -0,0 +1,198 @@
+"""Authors: Cody Baker."""
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from .utils import PathType
+
+DEFAULT_CACHE_MAX_SIZE_MB = 10000.
+HASH_CHUNK_SIZE = 2 ** 24
+FILE_HASH_INDEX_NAME = "file_hashes.json"
+TEMPORARY_SUFFIX = ".tmp"
+
+_caches = dict()
+
+
+def get_cache(cache_folder: PathType, max_size_mb: Optional[float] = None):
+    """
+    Return the ParsedSourceCache for this folder, shared by every interface in the process.
+
+    Parameters
+    ----------
+    cache_folder : PathType
+        Folder to store the cached entries in. It is created if it does not exist.
+    max_size_mb : float, optional
+        Total size the cache is allowed to grow to before the least recently used entries are evicted.
+        Only used when the cache for this folder is first created; defaults to DEFAULT_CACHE_MAX_SIZE_MB.
+    """
+    cache_folder = Path(cache_folder).absolute()
+    if cache_folder not in _caches:
+        _caches[cache_folder] = ParsedSourceCache(
+            cache_folder=cache_folder, max_size_mb=DEFAULT_CACHE_MAX_SIZE_MB if max_size_mb is None else max_size_mb
+        )
+    return _caches[cache_folder]
+
+
+def cached_parse(
+    file_path: PathType,
+    parser_name: str,
+    parser_version: int,
+    compute: Callable,
+    cache_folder: Optional[PathType] = None
+):
+    """
+    Parse a source file through the ParsedSourceCache of cache_folder, or directly if cache_folder is None.
+
+    See ParsedSourceCache.get_or_compute for the arguments.
+    """
+    if cache_folder is None:
+        return compute()
+    return get_cache(cache_folder=cache_folder).get_or_compute(
+        file_path=file_path, parser_name=parser_name, parser_version=parser_version, compute=compute
+    )
+
+
+def dataframe_to_arrays(df: pd.DataFrame, prefix: str = ""):
+    """Split a DataFrame into a dictionary of column arrays that can be stored without pickling."""
+    arrays = dict()
+    for column in df.columns:
+        values = df[column].to_numpy()
+        arrays[f"{prefix}{column}"] = values.astype(str) if values.dtype == object else values
+    arrays[f"{prefix}__columns__"] = np.array(df.columns, dtype=str)
+    arrays[f"{prefix}__object_columns__"] = np.array(
+        [column for column in df.columns if df[column].dtype == object], dtype=str
+    )
+    return arrays
+
+
+def arrays_to_dataframe(arrays: dict, prefix: str = ""):
+    """Rebuild a DataFrame stored by dataframe_to_arrays."""
+    object_columns = set(arrays[f"{prefix}__object_columns__"])
+    columns = dict()
+    for column in arrays[f"{prefix}__columns__"]:
+        values = arrays[f"{prefix}{column}"]
+        columns[column] = values.astype(object) if column in object_columns else values
+    return pd.DataFrame(columns)
+
+
+class ParsedSourceCache:
+    """
+    Content-addressed on-disk cache of the arrays parsed from a source file.
+
+    Entries are keyed by a hash of the contents of the source file together with the name and version of the parser,
+    so editing the file or changing the parser invalidates them. Each entry is a single uncompressed .npz file; once
+    the total size of the entries exceeds max_size_mb, the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_folder: PathType, max_size_mb: float = DEFAULT_CACHE_MAX_SIZE_MB):
+        self.cache_folder = Path(cache_folder)
+        self.cache_folder.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = max_size_mb * 1e6
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _replace_atomically(self, path: Path, write: Callable):
+        """
+        Write a file of the cache through a uniquely named temporary file, then move it into place in one step.
+
+        Readers, including other processes sharing the cache folder, therefore only ever see complete files, and
+        concurrent writers never write to the same temporary file.
+        """
+        temporary_file = tempfile.NamedTemporaryFile(
+            dir=self.cache_folder, prefix=f"{path.stem}-", suffix=f"{TEMPORARY_SUFFIX}{path.suffix}", delete=False
+        )
+        try:
+            with temporary_file:
+                write(temporary_file)
+            os.replace(temporary_file.name, path)
+        finally:
+            if os.path.exists(temporary_file.name):
+                os.unlink(temporary_file.name)
+
+    def _read_file_hashes(self, index_path: Path):
+        """The index of file hashes, or an empty one if it is missing or unreadable; it is only ever an optimization."""
+        try:
+            return json.loads(index_path.read_text())
+        except (OSError, ValueError):
+            return dict()
+
+    def _get_entry_paths(self):
+        """The paths of the stored entries, excluding the temporary files of entries still being written."""
+        return [
+            path for path in self.cache_folder.glob("*.npz") if not path.name.endswith(f"{TEMPORARY_SUFFIX}.npz")
+        ]
+
+    def _hash_file(self, file_path: Path):
+        """Hash the contents of the file, reusing the previous hash if its size and modification time are the same."""
+        index_path = self.cache_folder / FILE_HASH_INDEX_NAME
+        file_hashes = self._read_file_hashes(index_path=index_path)
+        file_stat = file_path.stat()
+        file_key = [file_stat.st_size, file_stat.st_mtime_ns]
+        entry = file_hashes.get(str(file_path.absolute()))
+        if entry is not None and entry["key"] == file_key:
+            return entry["hash"]
+        hasher = hashlib.blake2b(digest_size=20)
+        with open(file_path, mode="rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        file_hash = hasher.hexdigest()
+        file_hashes[str(file_path.absolute())] = dict(key=file_key, hash=file_hash)
+        self._replace_atomically(path=index_path, write=lambda f: f.write(json.dumps(file_hashes, indent=2).encode()))
+        return file_hash
+
+    def _entry_path(self, file_path: Path, parser_name: str, parser_version: int):
+        return self.cache_folder / f"{parser_name}-v{parser_version}-{self._hash_file(file_path=file_path)}.npz"
+
+    def get_or_compute(self, file_path: PathType, parser_name: str, parser_version: int, compute: Callable):
+        """
+        Return the arrays parsed from the source file, computing and storing them if they are not yet cached.
+
+        Parameters
+        ----------
+        file_path : PathType
+            Path to the source file.
+        parser_name : str
+            Name of the parser, used to keep the entries of different parsers of the same file apart.
+        parser_version : int
+            Version of the parser; bump it whenever the parser output changes.
+        compute : callable
+            Called without arguments on a cache miss, returning a dictionary of numpy arrays.
+        """
+        entry_path = self._entry_path(file_path=Path(file_path), parser_name=parser_name, parser_version=parser_version)
+        if entry_path.is_file():
+            self.hits += 1
+            os.utime(entry_path)  # the modification time of an entry marks its last use
+            with np.load(entry_path, allow_pickle=False) as entry:
+                return {name: entry[name] for name in entry.files}
+        self.misses += 1
+        arrays = compute()
+        self._replace_atomically(path=entry_path, write=lambda f: np.savez(f, **arrays))
+        self._evict()
+        return arrays
+
+    def _evict(self):
+        entries = sorted(self._get_entry_paths(), key=lambda path: path.stat().st_mtime_ns)
+        total_size = sum(path.stat().st_size for path in entries)
+        for entry_path in entries[:-1]:  # never evict the most recent entry
+            if total_size <= self.max_size_bytes:
+                break
+            total_size -= entry_path.stat().st_size
+            entry_path.unlink()
+            self.evictions += 1
+
+    def report(self):
+        """Summary of the cache hits, misses, and evictions so far in this process, and the current cache size."""
+        return dict(
+            cache_folder=str(self.cache_folder),
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            size_mb=sum(path.stat().st_size for path in self._get_entry_paths()) / 1e6
+        )
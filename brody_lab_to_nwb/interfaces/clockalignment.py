@@ -0,0 +1,253 @@
+"""Authors: Cody Baker."""
+import numpy as np
+from pynwb import NWBFile
+from pynwb.ecephys import ElectricalSeries
+from pynwb.epoch import TimeIntervals
+from hdmf.common import DynamicTable
+from spikeextractors import RecordingExtractor, SortingExtractor
+from spikeextractors.extraction_tools import check_get_traces_args
+
+from .customsortingextractor import CustomSortingExtractor
+from .utils import ArrayType
+from ..qualitymetrics import get_spike_trains
+
+
+class ClockMapping:
+    """
+    Piecewise linear mapping of times on one clock onto another, such as from the spike clock onto the behavior FSM.
+
+    Times from segment_starts[k] up to segment_starts[k + 1] map to slopes[k] * times + intercepts[k]; times before
+    the first segment map through the first one. Any number of times are mapped at once, in a single vectorized pass.
+    """
+
+    def __init__(self, segment_starts: ArrayType, slopes: ArrayType, intercepts: ArrayType):
+        """
+        Parameters
+        ----------
+        segment_starts : ArrayType
+            Time on the source clock at which each segment starts, increasing.
+        slopes : ArrayType
+            Rate of the target clock relative to the source clock in each segment.
+        intercepts : ArrayType
+            Time on the target clock of the time 0 on the source clock, extrapolated from each segment.
+        """
+        self.segment_starts = np.asarray(segment_starts, dtype=np.float64).ravel()
+        self.slopes = np.asarray(slopes, dtype=np.float64).ravel()
+        self.intercepts = np.asarray(intercepts, dtype=np.float64).ravel()
+        if not len(self.segment_starts) == len(self.slopes) == len(self.intercepts) > 0:
+            raise ValueError("A clock mapping needs one start, slope and intercept for each of at least one segment!")
+        if np.any(np.diff(self.segment_starts) <= 0):
+            raise ValueError("The segments of a clock mapping must start at increasing times!")
+
+    @classmethod
+    def from_spk2fsm(cls, spk2fsm: ArrayType):
+        """The linear mapping of the spk2fsm_rt of a behavior session, as the [slope, intercept] of np.polyfit."""
+        slope, intercept = np.ravel(spk2fsm)[:2]
+        return cls(segment_starts=[0.], slopes=[slope], intercepts=[intercept])
+
+    def __len__(self):
+        return len(self.slopes)
+
+    def get_segment_indices(self, times: ArrayType):
+        """The index of the segment of each time on the source clock."""
+        return np.maximum(np.searchsorted(self.segment_starts, times, side="right") - 1, 0)
+
+    def __call__(self, times: ArrayType):
+        """Map times on the source clock onto the target clock."""
+        times = np.asarray(times, dtype=np.float64)
+        if len(self) == 1:
+            return self.slopes[0] * times + self.intercepts[0]
+        segment_indices = self.get_segment_indices(times=times)
+        return self.slopes[segment_indices] * times + self.intercepts[segment_indices]
+
+
+def fit_clock_mapping(source_times: ArrayType, target_times: ArrayType, max_rate_deviation: float = 1e-3):
+    """
+    Fit the mapping between two clocks from the times of the same sync pulses on each of them.
+
+    The pulses are split into segments wherever the interval between two consecutive pulses differs between the clocks
+    by more than max_rate_deviation, relative to the median ratio of the intervals, such as over a pause of one of the
+    recordings; each segment is then fit by least squares, all at once.
+
+    Parameters
+    ----------
+    source_times : ArrayType
+        Times of the sync pulses on the source clock, e.g., of the sync channel of the recording, increasing.
+    target_times : ArrayType
+        Times of the same sync pulses on the target clock, e.g., of the behavior FSM, increasing.
+    max_rate_deviation : float, default: 1e-3
+
+    Returns
+    -------
+    ClockMapping
+    """
+    source_times = np.asarray(source_times, dtype=np.float64).ravel()
+    target_times = np.asarray(target_times, dtype=np.float64).ravel()
+    if len(source_times) != len(target_times) or len(source_times) < 2:
+        raise ValueError(
+            f"Got {len(source_times)} source and {len(target_times)} target pulses, but at least two pairs are needed!"
+        )
+    source_intervals = np.diff(source_times)
+    target_intervals = np.diff(target_times)
+    if np.any(source_intervals <= 0) or np.any(target_intervals <= 0):
+        raise ValueError("The sync pulses must be at increasing times on both clocks!")
+    rates = target_intervals / source_intervals
+    median_rate = np.median(rates)
+    is_break = np.abs(rates / median_rate - 1) > max_rate_deviation
+    segment_indices = np.concatenate(([0], np.cumsum(is_break)))
+    n_segments = segment_indices[-1] + 1
+
+    n_pulses = np.bincount(segment_indices, minlength=n_segments)
+    source_means = np.bincount(segment_indices, weights=source_times, minlength=n_segments) / n_pulses
+    target_means = np.bincount(segment_indices, weights=target_times, minlength=n_segments) / n_pulses
+    source_deviations = source_times - source_means[segment_indices]
+    target_deviations = target_times - target_means[segment_indices]
+    source_variances = np.bincount(segment_indices, weights=source_deviations ** 2, minlength=n_segments)
+    covariances = np.bincount(segment_indices, weights=source_deviations * target_deviations, minlength=n_segments)
+    slopes = np.full(n_segments, median_rate)  # segments of a single pulse keep the median rate
+    is_fit = n_pulses > 1
+    slopes[is_fit] = covariances[is_fit] / source_variances[is_fit]
+    return ClockMapping(
+        segment_starts=source_times[np.concatenate(([0], np.flatnonzero(is_break) + 1))],
+        slopes=slopes,
+        intercepts=target_means - slopes * source_means
+    )
+
+
+def align_sorting(sorting: SortingExtractor, clock_mapping: ClockMapping):
+    """
+    Map the spike times of every unit of a sorting onto another clock in a single vectorized call.
+
+    Returns
+    -------
+    CustomSortingExtractor
+        The units of the sorting with their spike times in seconds on the target clock, at a sampling frequency of 1
+        so that they are written exactly, along with every unit property shared by all the units.
+    """
+    if isinstance(sorting, CustomSortingExtractor):
+        spike_frames, offsets = sorting.get_spike_trains()
+    else:
+        spike_frames, offsets = get_spike_trains(sorting=sorting)
+    aligned_sorting = CustomSortingExtractor()
+    aligned_sorting.set_sampling_frequency(sampling_frequency=1.)
+    aligned_sorting.add_units(
+        unit_ids=sorting.get_unit_ids(),
+        spike_times=clock_mapping(sorting.frame_to_time(spike_frames)),
+        offsets=offsets
+    )
+    for property_name in sorting.get_shared_unit_property_names():
+        if isinstance(sorting, CustomSortingExtractor):
+            values = sorting.get_units_property(property_name=property_name)
+        else:
+            values = [sorting.get_unit_property(unit_id=x, property_name=property_name) for x in sorting.get_unit_ids()]
+        aligned_sorting.set_units_property(property_name=property_name, values=values)
+    return aligned_sorting
+
+
+class ClockAlignedRecordingExtractor(RecordingExtractor):
+    """
+    A recording whose frames are timed on another clock through a ClockMapping, such as the behavior FSM.
+
+    The traces are those of the parent recording. The time of each frame is never materialized: within a segment of
+    the mapping, it is set by the time of the first frame and the sampling frequency on the new clock, so a recording
+    spanning one segment is written with a starting_time and rate like any other. See get_clock_segments for more.
+    """
+
+    extractor_name = "ClockAlignedRecording"
+    installed = True
+    is_writable = False
+
+    def __init__(self, recording: RecordingExtractor, clock_mapping: ClockMapping):
+        RecordingExtractor.__init__(self)
+        self._recording = recording
+        self.clock_mapping = clock_mapping
+        self.has_unscaled = recording.has_unscaled
+        self.copy_channel_properties(recording=recording)
+        self._kwargs = dict(recording=recording.make_serialized_dict())
+
+    def get_channel_ids(self):
+        return self._recording.get_channel_ids()
+
+    def get_num_frames(self):
+        return self._recording.get_num_frames()
+
+    def get_sampling_frequency(self):
+        """The sampling frequency on the new clock, in the segment of the first frame."""
+        first_segment_index = self.clock_mapping.get_segment_indices(times=self._recording.frame_to_time(0))
+        return self._recording.get_sampling_frequency() / self.clock_mapping.slopes[first_segment_index]
+
+    @check_get_traces_args
+    def get_traces(self, channel_ids=None, start_frame=None, end_frame=None, return_scaled=True):
+        return self._recording.get_traces(
+            channel_ids=channel_ids,
+            start_frame=start_frame,
+            end_frame=end_frame,
+            return_scaled=not self.has_unscaled  # gains are applied once, by check_get_traces_args
+        )
+
+    def frame_to_time(self, frames):
+        return self.clock_mapping(self._recording.frame_to_time(np.asarray(frames)))
+
+    def get_clock_segments(self, num_frames: int = None):
+        """
+        The frames at which each segment of the clock mapping starts within the recording, with its timing.
+
+        Parameters
+        ----------
+        num_frames : int, optional
+            Number of frames written, e.g., of a stub of the recording. Defaults to all frames.
+
+        Returns
+        -------
+        first_frames : np.ndarray
+            The first frame of each segment, starting with 0.
+        starting_times : np.ndarray
+            Time on the new clock of the first frame of each segment.
+        rates : np.ndarray
+            Sampling frequency on the new clock within each segment.
+        """
+        num_frames = self.get_num_frames() if num_frames is None else num_frames
+        sampling_frequency = self._recording.get_sampling_frequency()
+        start_time = self._recording.frame_to_time(0)
+        # The first segment also covers any time before its start, so only the later segments can start a new one
+        segment_starts = self.clock_mapping.segment_starts[1:]
+        first_frames = np.ceil((segment_starts - start_time) * sampling_frequency).astype(np.int64)
+        first_frames = np.concatenate(([0], first_frames[(first_frames > 0) & (first_frames < num_frames)]))
+        segment_indices = self.clock_mapping.get_segment_indices(times=self._recording.frame_to_time(first_frames))
+        rates = sampling_frequency / self.clock_mapping.slopes[segment_indices]
+        return first_frames, self.frame_to_time(first_frames), rates
+
+
+def add_clock_segments(
+    nwbfile: NWBFile, electrical_series: ElectricalSeries, recording: ClockAlignedRecordingExtractor, num_frames: int
+):
+    """
+    Record the timing of each clock segment of a series written from a ClockAlignedRecordingExtractor.
+
+    The series itself carries the starting_time and rate of its first segment. If the recording spans more than one
+    segment, a <series name>_clock_segments table is added to the intervals of the nwbfile, with a row per segment
+    holding the range of samples of the series it covers and its rate; the time of sample i of the series within the
+    segment of a row is then its start_time + (i - idx_start) / rate. Returns the table, or None for a single segment.
+    """
+    first_frames, starting_times, rates = recording.get_clock_segments(num_frames=num_frames)
+    if len(first_frames) == 1:
+        return
+    counts = np.diff(np.append(first_frames, num_frames))
+    clock_segments = TimeIntervals(
+        name=f"{electrical_series.name}_clock_segments",
+        description=(
+            f"Segments of the piecewise linear clock mapping of {electrical_series.name}; the time of sample i of the "
+            "series within the segment of a row is start_time + (i - idx_start) / rate."
+        )
+    )
+    clock_segments.add_column(name="rate", description="Sampling frequency of the series within the segment, in Hz.")
+    for first_frame, count, starting_time, rate in zip(first_frames, counts, starting_times, rates):
+        DynamicTable.add_row(
+            clock_segments,
+            start_time=starting_time,
+            stop_time=starting_time + count / rate,
+            timeseries=[(int(first_frame), int(count), electrical_series)],
+            rate=rate
+        )
+    nwbfile.add_time_intervals(clock_segments)
+    return clock_segments
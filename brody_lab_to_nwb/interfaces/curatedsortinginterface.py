@@ -0,0 +1,98 @@
+"""Authors: Cody Baker."""
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import spikeextractors as se
+from pynwb import NWBFile
+from nwb_conversion_tools.datainterfaces.ecephys.basesortingextractorinterface import BaseSortingExtractorInterface
+
+from .customsortingextractor import CustomSortingExtractor
+from .unitswriter import write_sorting_units
+from ..qualitymetrics import get_spike_trains
+
+QUALITY_METRIC_DESCRIPTIONS = dict(
+    num_spikes="Number of spikes of the unit.",
+    firing_rate="Firing rate of the unit, in Hz.",
+    isi_violation="Rate of refractory period violations of the unit, relative to its firing rate.",
+    snr="Signal-to-noise ratio of the template of the unit, on its largest channel.",
+)
+
+
+class CuratedSortingInterface(BaseSortingExtractorInterface):
+    """
+    Conversion class for a sorting held in memory, such as the curated output of the SpikeInterface pipeline.
+
+    The units are written along with their templates, as the waveform_mean column, and with a column per quality
+    metric, in the same pass as the other interfaces of the converter rather than appended to the NWB file after.
+    """
+
+    SX = CustomSortingExtractor
+
+    @classmethod
+    def get_source_schema(cls):
+        source_schema = dict(
+            required=["sorting"],
+            properties=dict(
+                sorting=dict(
+                    description=(
+                        "A spikeextractors SortingExtractor. Its 'template' unit property, stored by "
+                        "st.postprocessing.get_unit_templates, is written as the waveform_mean of each unit."
+                    )
+                ),
+                quality_metrics=dict(
+                    description=(
+                        "Optional pandas DataFrame of quality metrics indexed by unit id, such as the table of "
+                        "compute_quality_metrics; each of its columns is written as a column of the units table."
+                    )
+                )
+            ),
+            type="object",
+            additionalProperties=False
+        )
+        return source_schema
+
+    def __init__(self, sorting: se.SortingExtractor, quality_metrics: Optional[pd.DataFrame] = None):
+        super().__init__()
+        self.source_data = dict(sorting=sorting, quality_metrics=quality_metrics)
+        unit_ids = sorting.get_unit_ids()
+        spike_frames, offsets = get_spike_trains(sorting=sorting)
+        self.sorting_extractor.set_sampling_frequency(sampling_frequency=sorting.get_sampling_frequency())
+        self.sorting_extractor.add_units(unit_ids=unit_ids, spike_times=spike_frames, offsets=offsets)
+        if "template" in sorting.get_shared_unit_property_names():
+            # Templates are (channels x samples); the waveform columns of the units table are (samples x channels)
+            templates = np.array([sorting.get_unit_property(unit_id=x, property_name="template") for x in unit_ids])
+            self.sorting_extractor.set_units_property(
+                property_name="waveform_mean", values=templates.transpose(0, 2, 1)
+            )
+        self.quality_metric_names = []
+        if quality_metrics is not None:
+            quality_metrics = quality_metrics.reindex(unit_ids)
+            for metric_name in quality_metrics:
+                self.sorting_extractor.set_units_property(
+                    property_name=metric_name, values=quality_metrics[metric_name].to_numpy()
+                )
+                self.quality_metric_names.append(metric_name)
+
+    def get_metadata(self):
+        unit_properties = [
+            dict(name=x, description=QUALITY_METRIC_DESCRIPTIONS.get(x, f"Quality metric '{x}' of the unit."))
+            for x in self.quality_metric_names
+        ]
+        if "waveform_mean" in self.sorting_extractor.get_shared_unit_property_names():
+            unit_properties.append(
+                dict(name="waveform_mean", description="Median template of the unit, over every recorded channel.")
+            )
+        return dict(Ecephys=dict(UnitProperties=unit_properties))
+
+    def run_conversion(
+        self, nwbfile: NWBFile, metadata: dict, stub_test: bool = False, write_ecephys_metadata: bool = False
+    ):
+        """Write the units in bulk, with one chunked and compressed dataset per column; see write_sorting_units."""
+        write_sorting_units(
+            sorting_extractor=self.sorting_extractor,
+            nwbfile=nwbfile,
+            metadata=metadata,
+            stub_test=stub_test,
+            write_ecephys_metadata=write_ecephys_metadata
+        )
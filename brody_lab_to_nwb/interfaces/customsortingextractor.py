@@ -4,25 +4,238 @@ import spikeextractors as se
 
 
 class CustomSortingExtractor(se.SortingExtractor):
+    """
+    In-memory sorting extractor with compressed sparse row (CSR) storage of the spike trains.
+
+    The spike times of all units are held in one concatenated array, sorted within each unit, alongside an array
+    of offsets such that the spike train of the unit at index j is spike_times[offsets[j]:offsets[j + 1]].
+    Units added one at a time are buffered and merged into the concatenated array on the next query, and units added
+    through add_lazy_units only have their spike times loaded the first time they are queried. Unit properties
+    can likewise be set for all units at once with set_units_property, held as one array with a row per unit.
+    """
+
     extractor_name = "custom"
     is_writable = False
 
     def __init__(self):
         super().__init__()
-        self._units = {}
+        self._unit_ids = []
+        self._unit_indices = {}
+        self._spike_times = np.empty(0)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._pending_times = []
+        self._lazy_units = {}
+        self._units_properties = {}
         self.is_dumpable = False
 
     def set_sampling_frequency(self, sampling_frequency):
         self._sampling_frequency = sampling_frequency
 
+    def _register_unit_ids(self, unit_ids):
+        if self._units_properties:
+            raise ValueError("Units cannot be added after properties have been set for all units at once!")
+        for unit_id in unit_ids:
+            if unit_id in self._unit_indices:
+                raise ValueError(f"Unit {unit_id} has already been added!")
+            self._unit_indices[unit_id] = len(self._unit_ids)
+            self._unit_ids.append(unit_id)
+
     def add_unit(self, unit_id, times):
-        self._units[unit_id] = dict(times=times)
+        self._register_unit_ids(unit_ids=[unit_id])
+        self._pending_times.append(np.sort(np.asarray(times).ravel()))
+
+    @staticmethod
+    def _check_offsets(n_units: int, n_spikes: int, offsets):
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if len(offsets) != n_units + 1 or offsets[0] != 0 or offsets[-1] != n_spikes:
+            raise ValueError(
+                "The offsets must start at 0, end at the total number of spikes, and have one more entry than there "
+                "are units!"
+            )
+        return offsets
+
+    def add_units(self, unit_ids, spike_times, offsets):
+        """
+        Add many units at once from their concatenated spike times.
+
+        Parameters
+        ----------
+        unit_ids : list
+            The ids of the units to add.
+        spike_times : ArrayType
+            The spike times of all units, concatenated in the same order as unit_ids.
+        offsets : ArrayType
+            Array of length len(unit_ids) + 1 such that the spike times of unit_ids[j] are
+            spike_times[offsets[j]:offsets[j + 1]].
+        """
+        spike_times = np.asarray(spike_times).ravel()
+        offsets = self._check_offsets(n_units=len(unit_ids), n_spikes=len(spike_times), offsets=offsets)
+        self._register_unit_ids(unit_ids=unit_ids)
+        self._consolidate()
+        unit_index = np.repeat(np.arange(len(unit_ids)), np.diff(offsets))
+        if not np.all((np.diff(spike_times) >= 0) | (np.diff(unit_index) > 0)):
+            spike_times = spike_times[np.lexsort((spike_times, unit_index))]  # sort within each unit
+        self._spike_times = np.concatenate((self._spike_times, spike_times))
+        self._offsets = np.concatenate((self._offsets, self._offsets[-1] + offsets[1:]))
+
+    def add_lazy_units(self, unit_ids, offsets, load_unit):
+        """
+        Add many units whose spike times are only loaded the first time each unit is queried.
+
+        Parameters
+        ----------
+        unit_ids : list
+            The ids of the units to add.
+        offsets : ArrayType
+            Array of length len(unit_ids) + 1 such that unit_ids[j] has offsets[j + 1] - offsets[j] spikes.
+        load_unit : callable
+            Called with the position j of a unit in unit_ids, returning the offsets[j + 1] - offsets[j] spike times
+            of that unit.
+        """
+        offsets = self._check_offsets(n_units=len(unit_ids), n_spikes=np.asarray(offsets)[-1], offsets=offsets)
+        self._register_unit_ids(unit_ids=unit_ids)
+        self._consolidate()
+        first_unit_index = len(self._offsets) - 1
+        self._spike_times = np.concatenate((self._spike_times, np.empty(offsets[-1])))
+        self._offsets = np.concatenate((self._offsets, self._offsets[-1] + offsets[1:]))
+        self._lazy_units.update({first_unit_index + j: (load_unit, j) for j in range(len(unit_ids))})
+
+    def _load_lazy_unit(self, unit_index: int):
+        load_unit, j = self._lazy_units.pop(unit_index)
+        start, end = self._offsets[unit_index], self._offsets[unit_index + 1]
+        self._spike_times[start:end] = np.sort(np.asarray(load_unit(j)).ravel())
+
+    def _consolidate(self):
+        """Merge any units added one at a time into the concatenated spike times."""
+        if not self._pending_times:
+            return
+        lengths = [len(times) for times in self._pending_times]
+        self._spike_times = np.concatenate([self._spike_times] + self._pending_times)
+        self._offsets = np.concatenate((self._offsets, self._offsets[-1] + np.cumsum(lengths)))
+        self._pending_times = []
 
     def get_unit_ids(self):
-        return list(self._units.keys())
+        return list(self._unit_ids)
+
+    def set_units_property(self, property_name: str, values):
+        """Set a property of every unit at once from an array whose first axis runs over the units in order."""
+        values = np.asarray(values)
+        if len(values) != len(self._unit_ids):
+            raise ValueError(
+                f"Got {len(values)} values for property '{property_name}', but there are {len(self._unit_ids)} units!"
+            )
+        self._units_properties[property_name] = values
+
+    def get_units_property(self, property_name: str):
+        """Get a property of every unit as one array whose first axis runs over the units in order."""
+        if property_name in self._units_properties:
+            return self._units_properties[property_name]
+        return np.array([self.get_unit_property(unit_id=x, property_name=property_name) for x in self._unit_ids])
+
+    def set_unit_property(self, unit_id, property_name, value):
+        if property_name in self._units_properties:
+            self._units_properties[property_name][self._unit_indices[unit_id]] = value
+        else:
+            super().set_unit_property(unit_id=unit_id, property_name=property_name, value=value)
+
+    def get_unit_property(self, unit_id, property_name):
+        if property_name in self._units_properties and unit_id in self._unit_indices:
+            return self._units_properties[property_name][self._unit_indices[unit_id]]
+        return super().get_unit_property(unit_id=unit_id, property_name=property_name)
+
+    def get_unit_property_names(self, unit_id):
+        return sorted(set(super().get_unit_property_names(unit_id=unit_id)).union(self._units_properties))
+
+    def get_spike_trains(self):
+        """
+        Get the spike times of every unit in one array, loading any lazy units first.
+
+        Returns
+        -------
+        spike_times : np.ndarray
+            The spike times of all units, concatenated in the order of get_unit_ids() and sorted within each unit.
+        offsets : np.ndarray
+            Array of length len(get_unit_ids()) + 1 such that the spike times of the unit at index j are
+            spike_times[offsets[j]:offsets[j + 1]].
+        """
+        self._consolidate()
+        for unit_index in list(self._lazy_units):
+            self._load_lazy_unit(unit_index=unit_index)
+        spike_times = self._spike_times.view()
+        spike_times.flags.writeable = False
+        return spike_times, self._offsets.copy()
+
+    def get_spike_trains_in_windows(self, window_starts, window_ends, unit_ids=None, reference_times=None):
+        """
+        Get the spikes of many units within many windows at once, such as the trials of a session.
+
+        The spikes of each unit are located in every window by a single np.searchsorted call over all the windows,
+        instead of one get_unit_spike_train call per unit and window. The windows are in the units of the spike
+        times, i.e. seconds for the units of MSortedSortingInterface and AnalysisClustersSortingInterface; unlike the
+        start_frame and end_frame of get_unit_spike_train, they are not cast to integers.
+
+        Parameters
+        ----------
+        window_starts : ArrayType
+            Start of each window, inclusive.
+        window_ends : ArrayType
+            End of each window, exclusive, as the end_frame of get_unit_spike_train.
+        unit_ids : list, optional
+            The units to query. Defaults to all units, in the order of get_unit_ids().
+        reference_times : ArrayType, optional
+            If passed, the spike times in each window are returned relative to its reference time, e.g., the trial
+            event the windows are aligned to, as for a raster.
+
+        Returns
+        -------
+        spike_times : np.ndarray
+            The spike times of every unit within every window, concatenated unit by unit and window by window.
+        offsets : np.ndarray
+            Array of length len(unit_ids) * len(window_starts) + 1 such that the spike times of unit_ids[j] within
+            window k are spike_times[offsets[j * n_windows + k]:offsets[j * n_windows + k + 1]]; np.diff(offsets)
+            reshaped to (n_units, n_windows) are the spike counts.
+        """
+        window_starts = np.asarray(window_starts, dtype=np.float64).ravel()
+        window_ends = np.asarray(window_ends, dtype=np.float64).ravel()
+        if len(window_starts) != len(window_ends):
+            raise ValueError(f"Got {len(window_starts)} window starts, but {len(window_ends)} window ends!")
+        if np.any(window_ends < window_starts):
+            raise ValueError("Every window must end at or after its start!")
+        unit_ids = self.get_unit_ids() if unit_ids is None else list(unit_ids)
+        unit_indices = [self._unit_indices[x] for x in unit_ids]
+        self._consolidate()
+        for unit_index in unit_indices:
+            if unit_index in self._lazy_units:
+                self._load_lazy_unit(unit_index=unit_index)
+
+        n_windows = len(window_starts)
+        first_spikes = np.empty((len(unit_indices), n_windows), dtype=np.int64)
+        last_spikes = np.empty((len(unit_indices), n_windows), dtype=np.int64)
+        for j, unit_index in enumerate(unit_indices):
+            unit_start = self._offsets[unit_index]
+            times = self._spike_times[unit_start:self._offsets[unit_index + 1]]
+            first_spikes[j] = unit_start + np.searchsorted(times, window_starts, side="left")
+            last_spikes[j] = unit_start + np.searchsorted(times, window_ends, side="left")
+        spike_counts = (last_spikes - first_spikes).ravel()
+        offsets = np.zeros(len(spike_counts) + 1, dtype=np.int64)
+        np.cumsum(spike_counts, out=offsets[1:])
+        spike_indices = np.arange(offsets[-1]) + np.repeat(first_spikes.ravel() - offsets[:-1], spike_counts)
+        spike_times = self._spike_times[spike_indices]
+        if reference_times is not None:
+            reference_times = np.asarray(reference_times, dtype=np.float64).ravel()
+            if len(reference_times) != n_windows:
+                raise ValueError(f"Got {len(reference_times)} reference times, but there are {n_windows} windows!")
+            spike_times -= np.repeat(np.tile(reference_times, len(unit_indices)), spike_counts)
+        return spike_times, offsets
 
     @se.extraction_tools.check_get_unit_spike_train
     def get_unit_spike_train(self, unit_id, start_frame=None, end_frame=None):
-        times = self._units[unit_id]["times"]
-        inds = np.where((start_frame <= times) & (times < end_frame))[0]
-        return np.array(times[inds])
+        self._consolidate()
+        unit_index = self._unit_indices[unit_id]
+        if unit_index in self._lazy_units:
+            self._load_lazy_unit(unit_index=unit_index)
+        times = self._spike_times[self._offsets[unit_index]:self._offsets[unit_index + 1]]
+        start, end = np.searchsorted(times, [start_frame, end_frame], side="left")
+        spike_train = times[start:end]
+        spike_train.flags.writeable = False
+        return spike_train
@@ -0,0 +1,84 @@
+"""Authors: Cody Baker."""
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from h5py import File
+
+from .utils import PathType
+
+DEFAULT_RDCC_NBYTES = 64 * 1024 ** 2
+DEFAULT_RDCC_NSLOTS = 10007  # a prime well above the number of chunks that fit in the cache, as HDF5 recommends
+
+_active_pool = None
+
+
+class H5FilePool:
+    """
+    Pool of read-only h5py.File handles, so that every interface of a conversion shares one handle per source file.
+
+    Files are opened on first use with an enlarged raw data chunk cache and stay open until close is called; a file
+    requested again after the pool has been closed is simply reopened. Users that hold on to data in a file, such as
+    lazily loaded units, can check closed to fail clearly instead of reopening the file after its owner closed it.
+    """
+
+    def __init__(self, rdcc_nbytes: int = DEFAULT_RDCC_NBYTES, rdcc_nslots: int = DEFAULT_RDCC_NSLOTS):
+        self.rdcc_nbytes = rdcc_nbytes
+        self.rdcc_nslots = rdcc_nslots
+        self._files = dict()
+        self.closed = False
+
+    def get(self, file_path: PathType):
+        """Return the open handle of the file, opening it if it is not yet open."""
+        key = Path(file_path).absolute()
+        if key not in self._files or not self._files[key]:  # closed h5py.File objects are falsy
+            self._files[key] = File(key, mode="r", rdcc_nbytes=self.rdcc_nbytes, rdcc_nslots=self.rdcc_nslots)
+        self.closed = False
+        return self._files[key]
+
+    def close(self):
+        """Close every handle in the pool."""
+        for file in self._files.values():
+            if file:
+                file.close()
+        self._files.clear()
+        self.closed = True
+
+    def __len__(self):
+        return sum(bool(file) for file in self._files.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @contextmanager
+    def activate(self):
+        """Make this the pool picked up by get_active_h5_pool, e.g., while a converter initializes its interfaces."""
+        global _active_pool
+        previous_pool = _active_pool
+        _active_pool = self
+        try:
+            yield self
+        finally:
+            _active_pool = previous_pool
+
+
+def get_active_h5_pool():
+    """Return the H5FilePool activated by the enclosing H5FilePool.activate block, if any."""
+    return _active_pool
+
+
+@contextmanager
+def open_h5_file(file_path: PathType, pool: Optional[H5FilePool] = None):
+    """
+    Open a source file for reading, through the pool if one is given.
+
+    Pooled handles are left open for the other users of the pool; otherwise the file is closed on exit.
+    """
+    if pool is not None:
+        yield pool.get(file_path=file_path)
+        return
+    with File(file_path, mode="r", rdcc_nbytes=DEFAULT_RDCC_NBYTES, rdcc_nslots=DEFAULT_RDCC_NSLOTS) as file:
+        yield file
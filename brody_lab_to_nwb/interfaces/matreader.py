@@ -0,0 +1,207 @@
+"""Authors: Cody Baker."""
+from collections.abc import Mapping
+from functools import partial
+from typing import Optional
+
+import h5py
+import numpy as np
+import scipy.io as spio
+
+from .h5pool import H5FilePool, get_active_h5_pool
+from .utils import PathType
+
+
+class LazyMatStruct(Mapping):
+    """
+    Read-only mapping over the fields of a MATLAB struct, or the variables of a .mat file.
+
+    Each field is only decoded the first time it is accessed; the decoded value, including any nested LazyMatStruct,
+    is memoized for every later access. The mapping returned by read_mat for a v7.3 file owns its HDF5 handle, and is
+    used as a context manager to close it; fields not decoded by then can no longer be read.
+    """
+
+    def __init__(self, field_names, decode_field, file: Optional[h5py.File] = None):
+        self._field_names = list(field_names)
+        self._decode_field = decode_field
+        self._decoded = dict()
+        self._file = file
+
+    def close(self):
+        """Close the file this mapping reads from, if it owns one."""
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getitem__(self, key):
+        if key not in self._decoded:
+            if key not in self._field_names:
+                raise KeyError(key)
+            self._decoded[key] = self._decode_field(key)
+        return self._decoded[key]
+
+    def __iter__(self):
+        return iter(self._field_names)
+
+    def __len__(self):
+        return len(self._field_names)
+
+    def __repr__(self):
+        return f"LazyMatStruct({self._field_names})"
+
+
+def _squeeze(array: np.ndarray):
+    """Squeeze an array the same way scipy.io.loadmat(squeeze_me=True) does; size one arrays become scalars."""
+    array = np.squeeze(array)
+    if array.shape == () and array.dtype.isbuiltin:
+        return array.item()
+    return array
+
+
+def _object_array(values, shape):
+    """Fill an object array element by element, so that numpy does not try to iterate into mappings or arrays."""
+    array = np.empty(len(values), dtype=object)
+    for j, value in enumerate(values):
+        array[j] = value
+    return array.reshape(shape)
+
+
+def _decode_v5(value):
+    if isinstance(value, spio.matlab.mio5_params.mat_struct):
+        return LazyMatStruct(field_names=value._fieldnames, decode_field=partial(_decode_v5_field, value))
+    if isinstance(value, np.ndarray) and value.dtype == object:
+        return _object_array(values=[_decode_v5(x) for x in value.ravel()], shape=value.shape)
+    return value
+
+
+def _decode_v5_field(struct, field_name: str):
+    return _decode_v5(getattr(struct, field_name))
+
+
+def _load_v5_variable(file_path: PathType, variable_name: str):
+    """Read one variable of a v5 file; scipy reads and decodes the whole variable, whichever fields are then used."""
+    mat = spio.loadmat(file_path, variable_names=[variable_name], struct_as_record=False, squeeze_me=True)
+    return _decode_v5(mat[variable_name])
+
+
+def _is_struct_array(group: h5py.Group):
+    """In v7.3 files the fields of a struct array are reference datasets with no MATLAB_class of their own."""
+    fields = list(group.values())
+    return len(fields) > 0 and all(
+        isinstance(field, h5py.Dataset)
+        and field.dtype == h5py.ref_dtype
+        and "MATLAB_class" not in field.attrs
+        for field in fields
+    )
+
+
+def _decode_v73(file: h5py.File, node):
+    if isinstance(node, h5py.Group):
+        if _is_struct_array(group=node):
+            field_names = list(node.keys())
+            references = {name: node[name][()].T for name in field_names}
+            shape = references[field_names[0]].shape
+            structs = [
+                LazyMatStruct(
+                    field_names=field_names,
+                    decode_field=partial(
+                        _decode_v73_reference, file, {name: references[name][idx] for name in field_names}
+                    )
+                )
+                for idx in np.ndindex(shape)
+            ]
+            return _squeeze(_object_array(values=structs, shape=shape))
+        return LazyMatStruct(field_names=node.keys(), decode_field=partial(_decode_v73_child, file, node))
+
+    matlab_class = node.attrs.get("MATLAB_class", b"")
+    matlab_class = matlab_class.decode() if isinstance(matlab_class, bytes) else matlab_class
+    if node.attrs.get("MATLAB_empty", 0):
+        return np.empty(0)
+    data = node[()].T  # MATLAB is column-major
+    if node.dtype == h5py.ref_dtype:
+        return _squeeze(_object_array(values=[_decode_v73(file, file[x]) for x in data.ravel()], shape=data.shape))
+    if matlab_class == "char":
+        data = np.atleast_2d(data)
+        return _squeeze(np.array(["".join(map(chr, row)) for row in data]))
+    if matlab_class == "logical":
+        data = data.astype(bool)
+    return _squeeze(data)
+
+
+def _decode_v73_child(file: h5py.File, group: h5py.Group, name: str):
+    return _decode_v73(file, group[name])
+
+
+def _decode_v73_reference(file: h5py.File, references: dict, name: str):
+    return _decode_v73(file, file[references[name]])
+
+
+def _decode_fully(value):
+    """Decode every field of the structs within a value, so that it no longer reads from the file."""
+    if isinstance(value, LazyMatStruct):
+        return {name: _decode_fully(value[name]) for name in value}
+    if isinstance(value, np.ndarray) and value.dtype == object:
+        return _object_array(values=[_decode_fully(x) for x in value.ravel()], shape=value.shape)
+    return value
+
+
+def read_mat(file_path: PathType, pool: Optional[H5FilePool] = None):
+    """
+    Lazily read a .mat file of any version, returning a mapping from variable names to their values.
+
+    Both v5 and v7.3 (HDF5) files are decoded to the same structure as scipy.io.loadmat(squeeze_me=True) gives for
+    v5 files, except that structs become LazyMatStruct mappings and struct arrays become object arrays of them.
+    Variables are only read when first accessed. In v7.3 files, each field of a struct is also read on its own when
+    first accessed; a variable of a v5 file is read and decoded in full by scipy on its first access.
+
+    The v7.3 file stays open until the returned mapping is closed, so it should be used as a context manager,
+    decoding every value needed within the with block:
+
+        with read_mat(file_path) as mat:
+            trials = mat["Trials"]["stateTimes"]["cpoke_in"]
+
+    Parameters
+    ----------
+    file_path : PathType
+        Path to the .mat file.
+    pool : H5FilePool, optional
+        Pool to take the handle of a v7.3 file from, which is then left open for the other users of the pool when the
+        mapping is closed. Defaults to the pool activated by the converter, if any.
+    """
+    if h5py.is_hdf5(file_path):
+        pool = get_active_h5_pool() if pool is None else pool
+        file = h5py.File(file_path, mode="r") if pool is None else pool.get(file_path=file_path)
+        variable_names = [name for name in file.keys() if not name.startswith("#")]
+        return LazyMatStruct(
+            field_names=variable_names,
+            decode_field=partial(_decode_v73_child, file, file),
+            file=file if pool is None else None
+        )
+    variable_names = [name for name, _, _ in spio.whosmat(file_path)]
+    return LazyMatStruct(field_names=variable_names, decode_field=partial(_load_v5_variable, file_path))
+
+
+def read_mat_struct_array(file_path: PathType, variable_name: str):
+    """
+    Read a struct array variable of a .mat file so that each of its fields can be taken across all structs at once.
+
+    For v5 files the struct array is read as a numpy record array, of which each field is an object array with one
+    entry per struct. v7.3 (HDF5) files are read as by read_mat, then every field of every struct is decoded into an
+    object array of dictionaries before the file is closed.
+
+    Parameters
+    ----------
+    file_path : PathType
+        Path to the .mat file.
+    variable_name : str
+        Name of the struct array variable.
+    """
+    if h5py.is_hdf5(file_path):
+        with read_mat(file_path) as mat:
+            return _decode_fully(mat[variable_name])
+    mat = spio.loadmat(file_path, variable_names=[variable_name], struct_as_record=True, squeeze_me=True)
+    return mat[variable_name]
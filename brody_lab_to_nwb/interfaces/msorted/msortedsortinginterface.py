@@ -1,10 +1,71 @@
 """Authors: Cody Baker."""
+from typing import Optional
+
 import numpy as np
 
-from h5py import File
+from h5py import File, Dataset
+from pynwb import NWBFile
 from nwb_conversion_tools.datainterfaces.ecephys.basesortingextractorinterface import BaseSortingExtractorInterface
 
+from ..cache import cached_parse
+from ..h5pool import H5FilePool, get_active_h5_pool, open_h5_file
 from ..customsortingextractor import CustomSortingExtractor
+from ..unitswriter import write_sorting_units
+
+
+def get_matlab_size(dataset: Dataset):
+    """Number of elements in a v7.3 .mat dataset; MATLAB stores empty arrays as their dimensions with a flag."""
+    if dataset.attrs.get("MATLAB_empty", 0):
+        return 0
+    return dataset.size
+
+
+def read_matlab_vector(dataset: Dataset, out: np.ndarray = None):
+    """Read a v7.3 .mat vector of any orientation into a flat array, optionally writing directly into 'out'."""
+    size = get_matlab_size(dataset)
+    if out is None:
+        out = np.empty(size, dtype=np.float64)
+    if size > 0:
+        dataset.read_direct(out.reshape(dataset.shape))
+    return out
+
+
+def resolve_spike_time_datasets(mat_file: File, references):
+    """Resolve the spike time reference of each unit to its dataset, along with the CSR offsets of the units."""
+    datasets = [mat_file[reference] for reference in references]
+    offsets = np.zeros(len(datasets) + 1, dtype=np.int64)
+    np.cumsum([get_matlab_size(dataset) for dataset in datasets], out=offsets[1:])
+    return datasets, offsets
+
+
+def read_spike_times(mat_file: File, references):
+    """
+    Resolve all spike time references and read them into a single concatenated array.
+
+    MATLAB stores the spike times of each unit as a separate dataset, so the reads stay one read_direct per reference;
+    what is saved over reading unit by unit is the intermediate arrays, as each dataset is read straight into its
+    slice of the preallocated output.
+
+    Parameters
+    ----------
+    mat_file : h5py.File
+        The open v7.3 .mat file.
+    references : iterable of h5py.Reference
+        The object references pointing to the spike times of each unit.
+
+    Returns
+    -------
+    spike_times : np.ndarray
+        The spike times of all units, concatenated in the order of the references.
+    offsets : np.ndarray
+        Array of length len(references) + 1 such that the spike times of unit j are
+        spike_times[offsets[j]:offsets[j + 1]].
+    """
+    datasets, offsets = resolve_spike_time_datasets(mat_file=mat_file, references=references)
+    spike_times = np.empty(offsets[-1], dtype=np.float64)
+    for j, dataset in enumerate(datasets):
+        read_matlab_vector(dataset=dataset, out=spike_times[offsets[j]:offsets[j + 1]])
+    return spike_times, offsets
 
 
 class MSortedSortingInterface(BaseSortingExtractorInterface):
@@ -21,6 +82,19 @@ class MSortedSortingInterface(BaseSortingExtractorInterface):
                     type="string",
                     format="file",
                     description="Path to .mat file containing processed data."
+                ),
+                lazy=dict(
+                    type="boolean",
+                    default=False,
+                    description="Whether to defer reading the spike times of each unit until it is first accessed."
+                ),
+                cache_folder=dict(
+                    type="string",
+                    format="directory",
+                    description=(
+                        "Optional folder in which to cache the parsed spike times between conversions. "
+                        "Cached spike times are always loaded in full."
+                    )
                 )
             ),
             type="object",
@@ -29,9 +103,78 @@ class MSortedSortingInterface(BaseSortingExtractorInterface):
         return source_schema
 
     def __init__(self, **source_data):
+        self.source_data = source_data
+        self.h5_pool = get_active_h5_pool()
+        self._owns_h5_pool = False
         processed_file_path = source_data["file_path"]
-        mat_file = File(processed_file_path, mode="r")
         self.sorting_extractor = self.SX()
         self.sorting_extractor.set_sampling_frequency(sampling_frequency=1.)  # Times must copy over exactly
-        for j, unit in enumerate(mat_file["Msorted"]["raw_spike_time_s"][0]):
-            self.sorting_extractor.add_unit(unit_id=j, times=np.array([x[0] for x in mat_file[unit][()]]))
+        if source_data.get("cache_folder") is not None:
+            spike_data = cached_parse(
+                file_path=processed_file_path,
+                parser_name="msorted_spike_times",
+                parser_version=1,
+                compute=lambda: self._read_spike_data(processed_file_path=processed_file_path, pool=self.h5_pool),
+                cache_folder=source_data["cache_folder"]
+            )
+            unit_ids = list(range(len(spike_data["offsets"]) - 1))
+            self.sorting_extractor.add_units(unit_ids=unit_ids, **spike_data)
+        elif source_data.get("lazy", False):
+            if self.h5_pool is None:  # the file must stay open until the units are loaded; see close
+                self.h5_pool = H5FilePool()
+                self._owns_h5_pool = True
+            mat_file = self.h5_pool.get(file_path=processed_file_path)
+            references = mat_file["Msorted"]["raw_spike_time_s"][0]
+            _, offsets = resolve_spike_time_datasets(mat_file=mat_file, references=references)
+            self.sorting_extractor.add_lazy_units(
+                unit_ids=list(range(len(references))), offsets=offsets, load_unit=self._make_load_unit(references)
+            )
+        else:
+            spike_data = self._read_spike_data(processed_file_path=processed_file_path, pool=self.h5_pool)
+            unit_ids = list(range(len(spike_data["offsets"]) - 1))
+            self.sorting_extractor.add_units(unit_ids=unit_ids, **spike_data)
+
+    def _make_load_unit(self, references):
+        """The loader of the lazy units, which reads the spike times of a unit from the open .mat file."""
+        file_path = self.source_data["file_path"]
+
+        def load_unit(j: int):
+            if self.h5_pool.closed:
+                raise ValueError(
+                    f"The spike times of unit {j} cannot be loaded, since {file_path} has been closed! Load the lazy "
+                    "units, e.g., by running the conversion, before the interface or its converter is closed."
+                )
+            return read_matlab_vector(dataset=self.h5_pool.get(file_path=file_path)[references[j]])
+
+        return load_unit
+
+    def close(self):
+        """Close the .mat file of the lazy units, if the interface opened it itself rather than through a converter."""
+        if self._owns_h5_pool:
+            self.h5_pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def run_conversion(
+        self, nwbfile: NWBFile, metadata: dict, stub_test: bool = False, write_ecephys_metadata: bool = False
+    ):
+        """Write the units in bulk, with one chunked and compressed dataset per column; see write_sorting_units."""
+        write_sorting_units(
+            sorting_extractor=self.sorting_extractor,
+            nwbfile=nwbfile,
+            metadata=metadata,
+            stub_test=stub_test,
+            write_ecephys_metadata=write_ecephys_metadata
+        )
+
+    @staticmethod
+    def _read_spike_data(processed_file_path: str, pool: Optional[H5FilePool] = None):
+        with open_h5_file(processed_file_path, pool=pool) as mat_file:
+            spike_times, offsets = read_spike_times(
+                mat_file=mat_file, references=mat_file["Msorted"]["raw_spike_time_s"][0]
+            )
+        return dict(spike_times=spike_times, offsets=offsets)
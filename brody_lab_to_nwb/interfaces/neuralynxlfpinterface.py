@@ -0,0 +1,95 @@
+"""Authors: Cody Baker."""
+from typing import Optional
+
+from nwb_conversion_tools.datainterfaces.ecephys.baselfpextractorinterface import BaseLFPExtractorInterface
+from nwb_conversion_tools.utils.json_schema import FolderPathType, get_schema_from_method_signature
+
+from .utils import LowpassDecimatedRecordingExtractor, make_nlx_extractor
+
+
+class NeuralynxLFPInterface(BaseLFPExtractorInterface):
+    """
+    Data interface class for the LFP band of the Neuralynx wideband recording, written as a decimated LFP series.
+
+    The .ncs files are memory mapped by make_nlx_extractor, then anti-alias filtered and decimated per channel as they
+    are streamed into the NWB file by a LowpassDecimatedRecordingExtractor, in the same pass as the raw recording. The
+    memory used is bounded by the read_mb of the filter and the write options of the converter, whatever the length of
+    the session.
+    """
+
+    RX = LowpassDecimatedRecordingExtractor
+
+    @classmethod
+    def get_source_schema(cls):
+        source_schema = get_schema_from_method_signature(class_method=cls.__init__)
+        source_schema["properties"]["folder_path"]["description"] = "Path to the folder of Neuralynx .ncs files."
+        source_schema["properties"]["cache_folder"].update(
+            description="Optional folder in which to keep the parsed .ncs headers between conversions."
+        )
+        return source_schema
+
+    def __init__(
+        self,
+        folder_path: FolderPathType,
+        lfp_sampling_frequency: float = 1000.,
+        cutoff_ratio: float = 0.8,
+        filter_order: int = 8,
+        max_workers: Optional[int] = None,
+        read_mb: float = 64.,
+        cache_folder: Optional[FolderPathType] = None
+    ):
+        """
+        Parameters
+        ----------
+        folder_path : FolderPathType
+            Path to the folder of Neuralynx .ncs files.
+        lfp_sampling_frequency : float, default: 1000.
+            Target sampling rate of the LFP in Hz; the decimation factor is the nearest integer ratio to it.
+        cutoff_ratio : float, default: 0.8
+            Cutoff frequency of the anti-alias filter, as a fraction of the Nyquist frequency of the LFP.
+        filter_order : int, default: 8
+            Order of the zero-phase Butterworth anti-alias filter.
+        max_workers : int, optional
+            Number of threads used to open the files and to filter the channels.
+            Defaults to the ThreadPoolExecutor default.
+        read_mb : float, default: 64.
+            Size of each span of the wideband recording read at once.
+        cache_folder : FolderPathType, optional
+            Folder in which to keep the parsed .ncs headers, so that later conversions memory map the contiguous files
+            without parsing them again. The default is to parse every file.
+        """
+        self.subset_channels = None
+        self.source_data = dict(
+            folder_path=folder_path,
+            lfp_sampling_frequency=lfp_sampling_frequency,
+            cutoff_ratio=cutoff_ratio,
+            filter_order=filter_order,
+            max_workers=max_workers,
+            read_mb=read_mb,
+            cache_folder=cache_folder
+        )
+        recording = make_nlx_extractor(folder_path=folder_path, max_workers=max_workers, cache_folder=cache_folder)
+        decimation_factor = max(1, round(recording.get_sampling_frequency() / lfp_sampling_frequency))
+        self.recording_extractor = self.RX(
+            recording=recording,
+            decimation_factor=decimation_factor,
+            cutoff_ratio=cutoff_ratio,
+            filter_order=filter_order,
+            max_workers=max_workers,
+            read_mb=read_mb
+        )
+
+    def get_metadata(self):
+        metadata = super().get_metadata()
+        metadata["Ecephys"]["ElectricalSeries_lfp"] = dict(
+            name="LFP",
+            description=(
+                "LFP traces of the Neuralynx wideband recording, anti-alias filtered and decimated to "
+                f"{self.recording_extractor.get_sampling_frequency()} Hz."
+            )
+        )
+        return metadata
+
+    def get_conversion_options(self):
+        conversion_options = dict(stub_test=False)
+        return conversion_options
@@ -1,12 +1,28 @@
 """Authors: Cody Baker."""
-import numpy as np
-import scipy.io as spio
+from typing import Optional
 
+import numpy as np
+from pynwb import NWBFile
 from nwb_conversion_tools.datainterfaces.ecephys.basesortingextractorinterface import BaseSortingExtractorInterface
-from nwb_conversion_tools.utils.json_schema import FilePathType
+from nwb_conversion_tools.utils.json_schema import FilePathType, FolderPathType
 
 from .protocol_info_utils import make_spks_dict
+from ..cache import cached_parse
+from ..clockalignment import ClockMapping
 from ..customsortingextractor import CustomSortingExtractor
+from ..matreader import read_mat_struct_array
+from ..unitswriter import write_sorting_units
+
+
+def parse_analysis_clusters(file_path: FilePathType):
+    """Parse the units of a ksphy_clusters_foranalysis.mat file into a dictionary of arrays."""
+    spks_dict = make_spks_dict(read_mat_struct_array(file_path=file_path, variable_name="PWMspkS"))
+    return dict(
+        spks_dict,
+        date=np.array(spks_dict["date"], dtype=str),
+        spk2fsm=np.asarray(spks_dict["spk2fsm"]),
+        fs=np.array(spks_dict["fs"])
+    )
 
 
 class AnalysisClustersSortingInterface(BaseSortingExtractorInterface):
@@ -18,22 +34,47 @@ class AnalysisClustersSortingInterface(BaseSortingExtractorInterface):
     def get_source_schema(cls):
         source_schema = super().get_source_schema()
         source_schema["properties"]["file_path"].update(description="Path to .mat file containing processed data.")
+        source_schema["properties"]["cache_folder"].update(
+            description="Optional folder in which to cache the parsed units between conversions."
+        )
         return source_schema
 
-    def __init__(self, file_path: FilePathType):
+    def __init__(self, file_path: FilePathType, cache_folder: Optional[FolderPathType] = None):
         super().__init__()
-        spks_info = spio.loadmat(file_path)
-        spks_info = spks_info["PWMspkS"][0]
-        spks_dict = make_spks_dict(spks_info)
-        self.sorting_extractor.set_sampling_frequency(sampling_frequency=spks_dict["fs"])
-        for j, spk_times in enumerate(spks_dict["spk_times"]):
-            self.sorting_extractor.add_unit(unit_id=j, times=np.array([x[0] for x in spk_times]))
+        self.source_data = dict(file_path=file_path, cache_folder=cache_folder)
+        spks_dict = cached_parse(
+            file_path=file_path,
+            parser_name="analysis_clusters",
+            parser_version=2,
+            compute=lambda: parse_analysis_clusters(file_path=file_path),
+            cache_folder=cache_folder
+        )
+        # The event_ts_fsm are already in seconds on the behavior FSM clock, so the times must copy over exactly
+        self.sorting_extractor.set_sampling_frequency(sampling_frequency=1.)
+        self.clock_mapping = ClockMapping.from_spk2fsm(spk2fsm=spks_dict["spk2fsm"])  # of the recording onto the FSM
+        unit_ids = list(range(len(spks_dict["trode_nums"])))
+        self.sorting_extractor.add_units(
+            unit_ids=unit_ids, spike_times=spks_dict["spike_times"], offsets=spks_dict["spike_time_offsets"]
+        )
         for property_name in ["spk_qual", "trode_nums"]:
-            for j, value in enumerate(spks_dict[property_name]):
-                self.sorting_extractor.set_unit_property(unit_id=j, property_name=property_name, value=value)
+            self.sorting_extractor.set_units_property(property_name=property_name, values=spks_dict[property_name])
         for mat_name, property_name in zip(["mean_wav", "std_wav"], ["waveform_mean", "waveform_sd"]):
-            for j, value in enumerate(spks_dict[mat_name]):
-                self.sorting_extractor.set_unit_property(unit_id=j, property_name=property_name, value=value.T)
+            # Stacked as (units x samples x channels), the layout of the waveform columns in the NWB units table
+            self.sorting_extractor.set_units_property(
+                property_name=property_name, values=spks_dict[mat_name].transpose(0, 2, 1)
+            )
+
+    def run_conversion(
+        self, nwbfile: NWBFile, metadata: dict, stub_test: bool = False, write_ecephys_metadata: bool = False
+    ):
+        """Write the units in bulk, with one chunked and compressed dataset per column; see write_sorting_units."""
+        write_sorting_units(
+            sorting_extractor=self.sorting_extractor,
+            nwbfile=nwbfile,
+            metadata=metadata,
+            stub_test=stub_test,
+            write_ecephys_metadata=write_ecephys_metadata
+        )
 
     def get_metadata(self):
         return dict(
@@ -1,65 +1,8 @@
 """Authors: Jess Breda and Cody Baker."""
+from collections.abc import Mapping
+
 import numpy as np
 import pandas as pd
-import scipy.io as spio
-
-
-def load_nested_mat(filename):
-    """
-    Replace scipy.io.loadmat.
-
-    It cures the problem of not properly recovering python dictionaries from mat files.
-    It calls the function check keys to cure all entries which are still mat-objects.
-    From https://stackoverflow.com/questions/48970785/complex-matlab-struct-mat-file-read-by-python.
-    """
-
-    def _check_vars(d):
-        """
-        Check if entries in dictionary are mat-objects.
-
-        If yes todict is called to change them to nested dictionaries
-        """
-        for key in d:
-            if isinstance(d[key], spio.matlab.mio5_params.mat_struct):
-                d[key] = _todict(d[key])
-            elif isinstance(d[key], np.ndarray):
-                d[key] = _toarray(d[key])
-        return d
-
-    def _todict(matobj):
-        """Recursive function which constructs from matobjects nested dictionaries."""
-        d = {}
-        for strg in matobj._fieldnames:
-            elem = matobj.__dict__[strg]
-            if isinstance(elem, spio.matlab.mio5_params.mat_struct):
-                d[strg] = _todict(elem)
-            elif isinstance(elem, np.ndarray):
-                d[strg] = _toarray(elem)
-            else:
-                d[strg] = elem
-        return d
-
-    def _toarray(ndarray):
-        """
-        Recursive function which constructs ndarray from cellarrays (which are loaded as numpy ndarrays).
-
-        Recurses into the elements if they contain matobjects.
-        """
-        if ndarray.dtype != 'float64':
-            elem_list = []
-            for sub_elem in ndarray:
-                if isinstance(sub_elem, spio.matlab.mio5_params.mat_struct):
-                    elem_list.append(_todict(sub_elem))
-                elif isinstance(sub_elem, np.ndarray):
-                    elem_list.append(_toarray(sub_elem))
-                else:
-                    elem_list.append(sub_elem)
-            return np.array(elem_list)
-        else:
-            return ndarray
-
-    data = spio.loadmat(filename, struct_as_record=False, squeeze_me=True)
-    return _check_vars(data)
 
 
 def make_beh_df(beh_info):
@@ -103,47 +46,35 @@ def make_beh_df(beh_info):
 
     # extract parsed events/state machine info for each trial
     parsed_events_dict = beh_info["parsed_events"]
-
-    # initilize space
-    c_poke = np.zeros((len(parsed_events_dict)))
-    hit_state = np.zeros((len(parsed_events_dict)))
-    aud1_on = np.zeros((len(parsed_events_dict)))
-    aud1_off = np.zeros((len(parsed_events_dict)))
-    aud2_on = np.zeros((len(parsed_events_dict)))
-    aud2_off = np.zeros((len(parsed_events_dict)))
-    end_state = np.zeros((len(parsed_events_dict)))
-
-    # iterate over items from state matrix
-    for trial in range(len(parsed_events_dict)):
-
-        # every trial has a center poke & end_state
-        c_poke[trial] = parsed_events_dict[trial]['states']['cp'][0]
-        end_state[trial] = parsed_events_dict[trial]['states']['check_next_trial_ready'][1]
-
-        # not all trials will have sound/hit time/etc, pull out info for non-violated
-        if beh_df['hit_hist'][trial] == 'viol':
-            hit_state[trial] = float("NaN")
-            aud1_on[trial] = float("NaN")
-            aud1_off[trial] = float("NaN")
-            aud2_on[trial] = float("NaN")
-            aud2_off[trial] = float("NaN")
-
-        elif beh_df['hit_hist'][trial] == 'hit':
-            hit_state[trial] = parsed_events_dict[trial]['states']['hit_state'][0]
-            aud1_on[trial] = parsed_events_dict[trial]['waves']['stimAUD1'][0]
-            aud1_off[trial] = parsed_events_dict[trial]['waves']['stimAUD1'][1]
-            aud2_on[trial] = parsed_events_dict[trial]['waves']['stimAUD2'][0]
-            aud2_off[trial] = parsed_events_dict[trial]['waves']['stimAUD2'][1]
-
-        elif beh_df['hit_hist'][trial] == 'miss':
-            hit_state[trial] = parsed_events_dict[trial]['states']['second_hit_state'][0]
-            aud1_on[trial] = parsed_events_dict[trial]['waves']['stimAUD1'][0]
-            aud1_off[trial] = parsed_events_dict[trial]['waves']['stimAUD1'][1]
-            aud2_on[trial] = parsed_events_dict[trial]['waves']['stimAUD2'][0]
-            aud2_off[trial] = parsed_events_dict[trial]['waves']['stimAUD2'][1]
-
-        else:
-            raise Exception('hit_hist doesn''t appear to have correct structure (hit, miss, viol)')
+    n_events = len(parsed_events_dict)
+    states = [trial_events['states'] for trial_events in parsed_events_dict]
+    hit_hist = beh_df['hit_hist'].to_numpy()[:n_events]
+
+    is_hit = hit_hist == 'hit'
+    is_miss = hit_hist == 'miss'
+    is_viol = hit_hist == 'viol'
+    if not np.all(is_hit | is_miss | is_viol):
+        raise Exception('hit_hist doesn''t appear to have correct structure (hit, miss, viol)')
+
+    # every trial has a center poke & end_state
+    c_poke = _stack_event_times([trial_states['cp'] for trial_states in states])[:, 0]
+    end_state = _stack_event_times([trial_states['check_next_trial_ready'] for trial_states in states])[:, 1]
+
+    # not all trials will have sound/hit time/etc, pull out info for non-violated
+    hit_state = np.full(n_events, np.nan)
+    hit_state[is_hit] = _stack_event_times([states[trial]['hit_state'] for trial in np.flatnonzero(is_hit)])[:, 0]
+    hit_state[is_miss] = _stack_event_times(
+        [states[trial]['second_hit_state'] for trial in np.flatnonzero(is_miss)]
+    )[:, 0]
+
+    aud_on_off = dict(stimAUD1=np.full((n_events, 2), np.nan), stimAUD2=np.full((n_events, 2), np.nan))
+    non_viol_trials = np.flatnonzero(~is_viol)
+    for wave_name, on_off in aud_on_off.items():
+        on_off[~is_viol] = _stack_event_times(
+            [parsed_events_dict[trial]['waves'][wave_name] for trial in non_viol_trials]
+        )[:, :2]
+    aud1_on, aud1_off = aud_on_off['stimAUD1'].T
+    aud2_on, aud2_off = aud_on_off['stimAUD2'].T
 
     beh_df['c_poke'] = c_poke
     beh_df['end_state'] = end_state
@@ -161,6 +92,13 @@ def make_beh_df(beh_info):
     return beh_df
 
 
+def _stack_event_times(event_times):
+    """Stack the [onset, offset] pairs of one parsed event across trials into an (n_trials x 2) array."""
+    if len(event_times) == 0:
+        return np.empty((0, 2))
+    return np.array(event_times, dtype=float).reshape(len(event_times), -1)
+
+
 def find_loudness(beh_df):
     """
     Quick function for converting from pair history info to determine which sound was louder in a trial.
@@ -192,45 +130,64 @@ def find_first_sound(beh_df):
     beh_df['first_sound'] = np.select(conditions, values)
 
 
+def _get_struct_field(struct_array, field_name):
+    """The values of one field across a struct array, either a record array or a sequence of struct mappings."""
+    if isinstance(struct_array, np.ndarray) and struct_array.dtype.names is not None:
+        return list(struct_array[field_name])
+    return [struct[field_name] for struct in struct_array]
+
+
+def _unwrap_record_value(value):
+    """Values nested in a record array are wrapped in zero dimensional object arrays."""
+    if isinstance(value, np.ndarray) and value.dtype == object and value.ndim == 0:
+        return value.item()
+    return value
+
+
 def make_spks_dict(spks_info):
     """
-    Wrangle the ndarry and put it into a tidy dataframe.
+    Wrangle the ndarry and put it into a tidy dictionary of arrays.
 
     Parameters
     ----------
     spks_info : ndarray
-        Extracted .mat structure.
+        Extracted .mat struct array, with one struct per unit; either a record array, as read by
+        read_mat_struct_array, or a sequence of struct mappings, as read by read_mat.
 
     Returns
     -------
     spks_dict : dict
-        Dictionary with spiking information for each unit.
+        Dictionary with spiking information for each unit. The spike times of all units are concatenated in
+        'spike_times', such that those of unit j are spike_times[spike_time_offsets[j]:spike_time_offsets[j + 1]].
     """
+    if isinstance(spks_info, Mapping):  # a file with a single unit is squeezed down to one struct
+        spks_info = [spks_info]
+    elif isinstance(spks_info, np.ndarray):
+        spks_info = spks_info.ravel()
+    ncells = len(spks_info)
     spks_dict = dict()
-    ncells = len(spks_info['trodenum'])
-    trode_nums = []
-    m_waves = []
-    s_waves = []
-    spk_qual = []
-    spk_times = []
-    spks_dict['date'] = spks_info['date'][0][0]
-    spks_dict['spk2fsm'] = spks_info['behav_session'][0]['spk2fsm_rt'][0][0][0]
-    spks_dict['fs'] = spks_info['fs'][0][0][0]
-    for cell in range(ncells):
-        trode_nums.append(spks_info['trodenum'][cell][0][0])
-        spk_times.append(spks_info['event_ts_fsm'][cell])  # In behavior time
-        m_waves.append(spks_info['waves_mn'][cell].reshape(4, 32))
-        s_waves.append(spks_info['waves_std'][cell].reshape(4, 32))
-
-        if spks_info['mua'][cell][0][0] == 1:
-            spk_qual.append('multi')
-        elif spks_info['single'][cell][0][0] == 1:
-            spk_qual.append('single')
-        else:
-            raise TypeError("Unit not marked as multi or single")
-    spks_dict['trode_nums'] = trode_nums
-    spks_dict['spk_qual'] = spk_qual
-    spks_dict['spk_times'] = spk_times
-    spks_dict['mean_wav'] = m_waves  # units x channel
-    spks_dict['std_wav'] = s_waves
+    spks_dict['date'] = _get_struct_field(spks_info[:1], 'date')[0]
+    behav_session = _get_struct_field(spks_info[:1], 'behav_session')[0]
+    spks_dict['spk2fsm'] = np.atleast_2d(_unwrap_record_value(behav_session['spk2fsm_rt']))[0]
+    spks_dict['fs'] = _get_struct_field(spks_info[:1], 'fs')[0]
+    spks_dict['trode_nums'] = np.array(_get_struct_field(spks_info, 'trodenum'), dtype=np.float64).astype(np.int64)
+
+    is_mua = np.array(_get_struct_field(spks_info, 'mua'), dtype=np.float64) == 1
+    is_single = np.array(_get_struct_field(spks_info, 'single'), dtype=np.float64) == 1
+    if not np.all(is_mua | is_single):
+        raise TypeError("Unit not marked as multi or single")
+    spks_dict['spk_qual'] = np.where(is_mua, 'multi', 'single')
+
+    spk_times = [np.ravel(x) for x in _get_struct_field(spks_info, 'event_ts_fsm')]  # In behavior time
+    spike_time_offsets = np.zeros(ncells + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in spk_times], out=spike_time_offsets[1:])
+    spike_times = np.empty(spike_time_offsets[-1])
+    if ncells:
+        np.concatenate(spk_times, out=spike_times)
+    spks_dict['spike_times'] = spike_times
+    spks_dict['spike_time_offsets'] = spike_time_offsets
+
+    for field_name, key in zip(['waves_mn', 'waves_std'], ['mean_wav', 'std_wav']):
+        waves = [np.ravel(x) for x in _get_struct_field(spks_info, field_name)]
+        spks_dict[key] = np.array(waves, dtype=np.float64).reshape(ncells, 4, 32)  # units x channel x sample
     return spks_dict
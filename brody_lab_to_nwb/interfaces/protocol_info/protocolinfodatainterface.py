@@ -1,51 +1,75 @@
 """Authors: Cody Baker and Jess Breda."""
+from pathlib import Path
+from typing import Optional
+
 import numpy as np
 import pandas as pd
 
 from pynwb import NWBFile
 from nwb_conversion_tools.basedatainterface import BaseDataInterface
-from nwb_conversion_tools.utils.json_schema import FilePathType, get_schema_from_method_signature
+from nwb_conversion_tools.utils.json_schema import FilePathType, FolderPathType, get_schema_from_method_signature
+
+from .protocol_info_utils import make_beh_df
+from ..cache import cached_parse, dataframe_to_arrays, arrays_to_dataframe
+from ..matreader import read_mat
+from ..utils import add_trials_from_columns
+
+COLUMN_MAPPING_FILE_PATH = Path(__file__).parents[2] / "column_mapping.csv"
 
-from .protocol_info_utils import load_nested_mat, make_beh_df
+
+def parse_protocol_info(file_path: FilePathType):
+    """Parse the behavior of a protocol_info.mat file into a dictionary of column arrays."""
+    with read_mat(file_path) as mat:
+        return dataframe_to_arrays(make_beh_df(mat["behS"]))
 
 
 class ProtocolInfoInterface(BaseDataInterface):
     """Conversion class for behavioral info contained in a protocol_info.mat file."""
 
+    # Files other than the source data that determine what is written, for the fingerprints of incremental conversions
+    input_file_paths = (COLUMN_MAPPING_FILE_PATH,)
+
     @classmethod
     def get_source_schema(cls):
         source_schema = super().get_source_schema()
         source_schema["properties"]["file_path"].update(description="Path to .mat file containing processed data.")
+        source_schema["properties"]["cache_folder"].update(
+            description="Optional folder in which to cache the parsed behavior between conversions."
+        )
         return source_schema
 
-    def __init__(self, file_path: FilePathType):
-        self.source_data = dict(file_path=file_path)
-        behavior_info = load_nested_mat(self.source_data["file_path"])["behS"]
-        self.behavior_df = make_beh_df(behavior_info)
+    def __init__(self, file_path: FilePathType, cache_folder: Optional[FolderPathType] = None):
+        self.source_data = dict(file_path=file_path, cache_folder=cache_folder)
+        behavior_arrays = cached_parse(
+            file_path=file_path,
+            parser_name="protocol_info_behavior",
+            parser_version=1,
+            compute=lambda: parse_protocol_info(file_path=file_path),
+            cache_folder=cache_folder
+        )
+        self.behavior_df = arrays_to_dataframe(behavior_arrays)
 
     def run_conversion(self, nwbfile: NWBFile, metadata: dict):
         """
         Convert the values in the behavioral dataframe object to the NWBFile Trials table.
 
-        Maps the column names and descriptions via the column_mapping.csv located in the same folder as this interface.
+        Maps the column names and descriptions via the column_mapping.csv located in the brody_lab_to_nwb folder.
         To add new columns to extract from protocol_info.mat, be sure to add the naming details to the .csv file.
         """
-        column_mapping = pd.read_csv("column_mapping.csv", keep_default_na=False)
+        column_mapping = pd.read_csv(COLUMN_MAPPING_FILE_PATH, keep_default_na=False)
 
         # The .csv may contain more fields than were contained in this particular .mat file
         valid_column_mapping = column_mapping[[x in self.behavior_df for x in column_mapping["mat_name"]]]
 
-        for _, row in valid_column_mapping.iterrows():
-            nwbfile.add_trial_column(name=row["nwb_name"], description=row["nwb_description"])
-
-        n_trials = self.behavior_df.shape[0]
-        for k in range(n_trials):
-            trial_kwargs = dict()
-            for _, row in valid_column_mapping.iterrows():
-                trial_kwargs.update({row["nwb_name"]: self.behavior_df[row["mat_name"]][k]})
-            # From conversations with Jess, hard-coding start and stop times relative to shifts of particular columns
-            trial_kwargs.update(
-                start_time=trial_kwargs["c_poke_time"] - 0.5,
-                stop_time=trial_kwargs["end_state_time"] + 1
-            )
-            nwbfile.add_trial(**trial_kwargs)
+        columns = {
+            row["nwb_name"]: self.behavior_df[row["mat_name"]].to_numpy() for _, row in valid_column_mapping.iterrows()
+        }
+        column_descriptions = dict(zip(valid_column_mapping["nwb_name"], valid_column_mapping["nwb_description"]))
+        # From conversations with Jess, hard-coding start and stop times relative to shifts of particular columns
+        add_trials_from_columns(
+            nwbfile=nwbfile,
+            start_time=columns["c_poke_time"] - 0.5,
+            stop_time=columns["end_state_time"] + 1,
+            columns=columns,
+            column_descriptions=column_descriptions
+        )
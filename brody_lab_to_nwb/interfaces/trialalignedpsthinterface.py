@@ -0,0 +1,149 @@
+"""Authors: Cody Baker."""
+import numpy as np
+from hdmf.common import DynamicTable
+from hdmf.data_utils import DataIO
+from pynwb import NWBFile
+from nwb_conversion_tools.basedatainterface import BaseDataInterface
+from nwb_conversion_tools.utils.conversion_tools import get_module
+from nwb_conversion_tools.utils.json_schema import get_schema_from_method_signature
+
+from .customsortingextractor import CustomSortingExtractor
+from .utils import make_column_data
+
+ECEPHYS_MODULE_DESCRIPTION = "Intermediate data from extracellular electrophysiology recordings, e.g., LFP."
+
+
+def _read_column(column):
+    """The values of a table column, whether it was just added to the nwbfile or read back from a file."""
+    data = column.data.data if isinstance(column.data, DataIO) else column.data
+    return np.asarray(data[:])
+
+
+def get_trial_aligned_spike_counts(
+    sorting: CustomSortingExtractor, event_times, window_start: float, window_stop: float, bin_size: float
+):
+    """
+    Count the spikes of every unit in every time bin around an event of every trial.
+
+    The spikes of all units and trials are found at once by get_spike_trains_in_windows, relative to the event of
+    each trial, then binned by a single np.bincount over all of them.
+
+    Parameters
+    ----------
+    sorting : CustomSortingExtractor
+    event_times : ArrayType
+        Time of the event in each trial, in the units of the spike times; trials where it is NaN have no spikes.
+    window_start : float
+        Start of the first bin relative to the event.
+    window_stop : float
+        End of the last bin relative to the event; the window must span a whole number of bins.
+    bin_size : float
+
+    Returns
+    -------
+    spike_counts : np.ndarray
+        Array of shape (n_units, n_trials, n_bins), of the smallest unsigned integer type that holds the counts.
+    """
+    n_bins = int(round((window_stop - window_start) / bin_size))
+    if n_bins < 1 or not np.isclose(n_bins * bin_size, window_stop - window_start):
+        raise ValueError(
+            f"The window from {window_start} to {window_stop} must span a whole number of bins of size {bin_size}!"
+        )
+    event_times = np.asarray(event_times, dtype=np.float64).ravel()
+    n_units = len(sorting.get_unit_ids())
+    n_windows = n_units * len(event_times)
+    spike_times, offsets = sorting.get_spike_trains_in_windows(
+        window_starts=event_times + window_start,
+        window_ends=event_times + window_start + n_bins * bin_size,
+        reference_times=event_times
+    )
+    bin_indices = np.clip(np.floor((spike_times - window_start) / bin_size).astype(np.int64), 0, n_bins - 1)
+    window_indices = np.repeat(np.arange(n_windows), np.diff(offsets))
+    spike_counts = np.bincount(window_indices * n_bins + bin_indices, minlength=n_windows * n_bins)
+    spike_counts = spike_counts.astype(np.min_scalar_type(spike_counts.max(initial=0)))
+    return spike_counts.reshape(n_units, len(event_times), n_bins)
+
+
+class TrialAlignedPSTHInterface(BaseDataInterface):
+    """
+    Data interface class for the spike counts of each unit in time bins around events of each trial.
+
+    The counts are computed from the units and trials tables already added to the nwbfile by the sorting and behavior
+    interfaces, so this interface must come after them in the converter. A table per event is written to the ecephys
+    processing module, with a row per unit and a spike_counts column of shape (n_units, n_trials, n_bins) as a single
+    chunked and compressed dataset, so that the rasters of any unit can be read directly from the file.
+    """
+
+    @classmethod
+    def get_source_schema(cls):
+        source_schema = get_schema_from_method_signature(class_method=cls.__init__)
+        source_schema["properties"]["event_names"].update(
+            items=dict(type="string"), description="Names of the columns of the trials table to align the spikes to."
+        )
+        return source_schema
+
+    def __init__(self, event_names: list, window_start: float = -0.5, window_stop: float = 1., bin_size: float = 0.01):
+        """
+        Parameters
+        ----------
+        event_names : list of str
+            Names of the columns of the trials table to align the spikes to, e.g., 'cpoke_in_time'.
+        window_start : float, default: -0.5
+            Start of the first bin relative to each event, in seconds.
+        window_stop : float, default: 1.
+            End of the last bin relative to each event, in seconds.
+        bin_size : float, default: 0.01
+            Width of each bin, in seconds.
+        """
+        self.source_data = dict(
+            event_names=list(event_names), window_start=window_start, window_stop=window_stop, bin_size=bin_size
+        )
+
+    def run_conversion(self, nwbfile: NWBFile, metadata: dict):
+        """Add a PSTH_<event name> table to the ecephys processing module for each of the event_names."""
+        if nwbfile.units is None or nwbfile.trials is None:
+            raise ValueError("The trial aligned PSTH requires the nwbfile to contain both units and trials!")
+        missing_event_names = [x for x in self.source_data["event_names"] if x not in nwbfile.trials.colnames]
+        if missing_event_names:
+            raise ValueError(f"The trials table has no columns {missing_event_names}!")
+
+        spike_times_index = nwbfile.units["spike_times"]
+        offsets = np.concatenate(([0], _read_column(column=spike_times_index)))
+        sorting = CustomSortingExtractor()
+        sorting.set_sampling_frequency(sampling_frequency=1.)
+        sorting.add_units(
+            unit_ids=list(range(len(offsets) - 1)),
+            spike_times=_read_column(column=spike_times_index.target),
+            offsets=offsets
+        )
+        ecephys_module = get_module(nwbfile=nwbfile, name="ecephys", description=ECEPHYS_MODULE_DESCRIPTION)
+        window_start, window_stop, bin_size = [self.source_data[x] for x in ["window_start", "window_stop", "bin_size"]]
+        for event_name in self.source_data["event_names"]:
+            spike_counts = get_trial_aligned_spike_counts(
+                sorting=sorting,
+                event_times=_read_column(column=nwbfile.trials[event_name]),
+                window_start=window_start,
+                window_stop=window_stop,
+                bin_size=bin_size
+            )
+            psth_table = DynamicTable(
+                name=f"PSTH_{event_name}",
+                description=(
+                    f"Spike counts of each unit in each trial, in the order of the trials table, and each {bin_size} s "
+                    f"bin from {window_start} s to {window_stop} s around the {event_name} of the trial. Trials "
+                    f"without a {event_name} have no spikes."
+                ),
+                id=np.arange(len(spike_counts))
+            )
+            psth_table.add_column(
+                name="unit",
+                description="The unit of each row.",
+                data=np.arange(len(spike_counts)),
+                table=nwbfile.units
+            )
+            psth_table.add_column(
+                name="spike_counts",
+                description="Spike counts of the unit, of shape (n_trials, n_bins).",
+                data=make_column_data(data=spike_counts, compression="gzip", compression_opts=4, chunk_mb=1.)
+            )
+            ecephys_module.add(psth_table)
@@ -0,0 +1,158 @@
+"""Authors: Cody Baker."""
+import warnings
+from typing import Optional
+
+import numpy as np
+import spikeextractors as se
+from hdmf.common import ElementIdentifiers, VectorData, VectorIndex
+from pynwb import NWBFile
+from pynwb.misc import Units
+from nwb_conversion_tools.utils.spike_interface import add_devices, add_electrode_groups, add_electrodes
+
+from .customsortingextractor import CustomSortingExtractor
+from .utils import as_column_data, make_column_data
+
+DEFAULT_UNITS_DESCRIPTION = "Autogenerated by nwb_conversion_tools."
+
+
+def write_units_table(
+    nwbfile: NWBFile,
+    spike_times: np.ndarray,
+    offsets: np.ndarray,
+    unit_ids: Optional[list] = None,
+    unit_properties: Optional[dict] = None,
+    property_descriptions: Optional[dict] = None,
+    units_description: str = DEFAULT_UNITS_DESCRIPTION,
+    compression: Optional[str] = "gzip",
+    compression_level: int = 4,
+    chunk_mb: float = 1.
+):
+    """
+    Write the units table of an NWBFile in bulk, from the concatenated spike times of all units.
+
+    Rather than adding one row at a time, every column is built from a single array and written as one chunked and
+    compressed dataset, so the cost of the write does not grow with the number of units.
+
+    Parameters
+    ----------
+    nwbfile : NWBFile
+    spike_times : np.ndarray
+        The spike times in seconds of all units, concatenated in order.
+    offsets : np.ndarray
+        Array of length n_units + 1 such that the spike times of unit j are spike_times[offsets[j]:offsets[j + 1]].
+    unit_ids : list, optional
+        Integer ids of the units. Defaults to range(n_units).
+    unit_properties : dict, optional
+        Maps the name of each extra column to an array whose first axis runs over the units. waveform_mean and
+        waveform_sd are stacked arrays of shape (n_units, n_samples, n_channels).
+    property_descriptions : dict, optional
+        Maps the name of each extra column to its description.
+    units_description : str, optional
+    compression : str, optional
+        Compression filter for the numeric columns. Pass None to write them uncompressed. The default is 'gzip'.
+    compression_level : int, optional
+        Level of gzip compression. The default is 4.
+    chunk_mb : float, optional
+        Size in MB of the chunks of each numeric column. The default is 1.
+
+    Returns
+    -------
+    Units
+        The written units table, or None if the nwbfile already had one.
+    """
+    if nwbfile.units is not None:
+        warnings.warn("The nwbfile already contains units. These units will not be over-written.")
+        return
+    n_units = len(offsets) - 1
+    unit_ids = list(range(n_units)) if unit_ids is None else unit_ids
+    unit_properties = dict() if unit_properties is None else unit_properties
+    property_descriptions = dict() if property_descriptions is None else property_descriptions
+    column_options = dict(compression=compression, compression_opts=compression_level, chunk_mb=chunk_mb)
+
+    spike_times_column = VectorData(
+        name="spike_times",
+        description="the spike times for each unit",
+        data=make_column_data(data=np.asarray(spike_times, dtype=np.float64), **column_options)
+    )
+    columns = [
+        spike_times_column,
+        VectorIndex(
+            name="spike_times_index",
+            data=make_column_data(data=np.asarray(offsets[1:], dtype=np.int64), **column_options),
+            target=spike_times_column
+        )
+    ]
+    for property_name, values in unit_properties.items():
+        values = np.asarray(values)
+        if values.ndim == 1:
+            values = as_column_data(values)  # strings, e.g. spk_qual, are written as a list of str like trials columns
+        if len(values) != n_units:
+            raise ValueError(f"Got {len(values)} values for unit property '{property_name}', but {n_units} units!")
+        if property_name not in property_descriptions:
+            warnings.warn(
+                f"Description for property {property_name} not found in property_descriptions. "
+                "Setting description to 'no description'"
+            )
+        columns.append(
+            VectorData(
+                name=property_name,
+                description=property_descriptions.get(property_name, "No description."),
+                data=make_column_data(data=values, **column_options)
+            )
+        )
+    nwbfile.units = Units(
+        name="units",
+        description=units_description,
+        id=ElementIdentifiers(name="id", data=np.asarray(unit_ids, dtype=np.int64)),
+        columns=columns
+    )
+    return nwbfile.units
+
+
+def write_sorting_units(
+    sorting_extractor: CustomSortingExtractor,
+    nwbfile: NWBFile,
+    metadata: dict,
+    stub_test: bool = False,
+    write_ecephys_metadata: bool = False
+):
+    """
+    Write a CustomSortingExtractor to the units table in bulk, as BaseSortingExtractorInterface.run_conversion would.
+
+    Every unit property shared by all the units becomes a column, described by metadata["Ecephys"]["UnitProperties"].
+    If stub_test is True, the spike trains are truncated just after the latest first spike of any unit.
+    """
+    if write_ecephys_metadata and "Ecephys" in metadata:
+        n_channels = max([len(x["data"]) for x in metadata["Ecephys"]["Electrodes"]])
+        recording = se.NumpyRecordingExtractor(
+            timeseries=np.array(range(n_channels)),
+            sampling_frequency=sorting_extractor.get_sampling_frequency(),
+        )
+        add_devices(recording=recording, nwbfile=nwbfile, metadata=metadata)
+        add_electrode_groups(recording=recording, nwbfile=nwbfile, metadata=metadata)
+        add_electrodes(recording=recording, nwbfile=nwbfile, metadata=metadata)
+
+    spike_times, offsets = sorting_extractor.get_spike_trains()
+    if stub_test and len(spike_times) > 0:
+        spike_counts = np.diff(offsets)
+        end_frame = 1.1 * np.max(spike_times[offsets[:-1][spike_counts > 0]])
+        unit_indices = np.repeat(np.arange(len(spike_counts)), spike_counts)
+        keep = (spike_times >= 0) & (spike_times < end_frame)
+        spike_times = spike_times[keep]
+        offsets = np.zeros_like(offsets)
+        np.cumsum(np.bincount(unit_indices[keep], minlength=len(spike_counts)), out=offsets[1:])
+
+    property_descriptions = {
+        x["name"]: x["description"] for x in metadata.get("Ecephys", dict()).get("UnitProperties", [])
+    }
+    write_units_table(
+        nwbfile=nwbfile,
+        spike_times=sorting_extractor.frame_to_time(spike_times),
+        offsets=offsets,
+        unit_ids=[int(x) for x in sorting_extractor.get_unit_ids()],
+        unit_properties={
+            x: sorting_extractor.get_units_property(property_name=x)
+            for x in sorting_extractor.get_shared_unit_property_names()
+        },
+        property_descriptions=property_descriptions
+    )
@@ -1,28 +1,534 @@
 """Authors: Cody Baker."""
-from typing import Union
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Optional
 from pathlib import Path
 from natsort import natsorted
 
-from spikeextractors import NeuralynxRecordingExtractor, MultiRecordingChannelExtractor
+import numpy as np
+from pynwb import NWBFile
+from pynwb.epoch import TimeIntervals
+from hdmf.backends.hdf5.h5_utils import H5DataIO
+from hdmf.common import VectorData
+from scipy import signal
+from spikeextractors import NeuralynxRecordingExtractor, MultiRecordingChannelExtractor, RecordingExtractor
+from spikeextractors.extraction_tools import check_get_traces_args
 
 
 PathType = Union[str, Path]
+ArrayType = Union[list, np.ndarray]
 
+NCS_HEADER_SIZE = 16 * 1024
+NCS_SAMPLES_PER_RECORD = 512
+NCS_RECORD_DTYPE = np.dtype(
+    [
+        ("timestamp", "<u8"),
+        ("channel_id", "<u4"),
+        ("sample_rate", "<u4"),
+        ("num_valid_samples", "<u4"),
+        ("samples", "<i2", (NCS_SAMPLES_PER_RECORD,))
+    ]
+)
+NCS_HEADER_INDEX_FILE_NAME = "nlx_header_index.json"
+NCS_HEADER_INDEX_VERSION = 2
+NCS_TIMESTAMP_TOLERANCE_US = 1  # the record timestamps are whole microseconds
 
-def make_nlx_extractor(folder_path: PathType):
+CHUNK_POLICIES = ("time", "channel", "auto")
+DEFAULT_WRITE_OPTIONS = dict(
+    buffer_mb=1000.,
+    chunk_policy="time",
+    chunk_mb=1.,
+    compression="gzip",
+    compression_level=4,
+    max_memory_mb=None
+)
+
+
+class NcsRecordingExtractor(RecordingExtractor):
+    """
+    Memory-mapped reader for the first segment of a single Neuralynx .ncs file.
+
+    Unlike the neo-based NeuralynxRecordingExtractor, this does not parse the file on construction; the sampling rate,
+    number of frames and channel information are passed in from a previous parse, as cached by make_nlx_extractor.
+    The samples of the records are read back to back, so this is only valid for a file that _is_contiguous_ncs_file.
+    """
+
+    extractor_name = "NcsRecording"
+    has_default_locations = False
+    has_unscaled = True
+    installed = True
+    is_writable = False
+    mode = "file"
+
+    def __init__(self, file_path: PathType, sampling_frequency: float, num_frames: int, channel_id: int = 0,
+                 channel_name: str = ""):
+        RecordingExtractor.__init__(self)
+        num_records = (Path(file_path).stat().st_size - NCS_HEADER_SIZE) // NCS_RECORD_DTYPE.itemsize
+        records = np.memmap(file_path, dtype=NCS_RECORD_DTYPE, mode="r", offset=NCS_HEADER_SIZE, shape=(num_records,))
+        self._samples = records["samples"]
+        self._sampling_frequency = sampling_frequency
+        self._num_frames = num_frames
+        self._channel_ids = [channel_id]
+        self.set_channel_property(channel_id=channel_id, property_name="name", value=channel_name)
+        self._kwargs = dict(
+            file_path=str(Path(file_path).absolute()),
+            sampling_frequency=sampling_frequency,
+            num_frames=num_frames,
+            channel_id=channel_id,
+            channel_name=channel_name
+        )
+
+    def get_channel_ids(self):
+        return list(self._channel_ids)
+
+    def get_num_frames(self):
+        return self._num_frames
+
+    def get_sampling_frequency(self):
+        return self._sampling_frequency
+
+    @check_get_traces_args
+    def get_traces(self, channel_ids=None, start_frame=None, end_frame=None, return_scaled=True):
+        samples_per_record = self._samples.shape[1]
+        first_record = start_frame // samples_per_record
+        last_record = -(-end_frame // samples_per_record)
+        traces = self._samples[first_record:last_record].reshape(-1)
+        start = start_frame - first_record * samples_per_record
+        return traces[start:start + end_frame - start_frame][np.newaxis]
+
+
+class DecimatedRecordingExtractor(RecordingExtractor):
+    """
+    Every decimation_factor-th frame of a recording, spanning its full length at a fraction of its sampling rate.
+
+    The frames are subsampled without anti-aliasing. They are read through the parent recording in spans of bounded
+    size and strided, so for memory mapped recordings only the pages holding the kept frames are read from disk.
+    """
+
+    extractor_name = "DecimatedRecording"
+    installed = True
+    is_writable = False
+
+    def __init__(self, recording: RecordingExtractor, decimation_factor: int, read_mb: float = 64.):
+        RecordingExtractor.__init__(self)
+        if decimation_factor < 1:
+            raise ValueError(f"The decimation_factor must be a positive integer, but got {decimation_factor}!")
+        self._recording = recording
+        self._decimation_factor = int(decimation_factor)
+        self._read_frames = max(1, int(read_mb * 1e6 // (8 * recording.get_num_channels())))
+        self.has_unscaled = recording.has_unscaled
+        self.copy_channel_properties(recording=recording)
+        self._kwargs = dict(recording=recording.make_serialized_dict(), decimation_factor=decimation_factor)
+
+    def get_channel_ids(self):
+        return self._recording.get_channel_ids()
+
+    def get_num_frames(self):
+        return -(-self._recording.get_num_frames() // self._decimation_factor)
+
+    def get_sampling_frequency(self):
+        return self._recording.get_sampling_frequency() / self._decimation_factor
+
+    @check_get_traces_args
+    def get_traces(self, channel_ids=None, start_frame=None, end_frame=None, return_scaled=True):
+        kept_frames_per_read = max(1, self._read_frames // self._decimation_factor)
+        traces = []
+        for first_frame in range(start_frame, end_frame, kept_frames_per_read):
+            last_frame = min(first_frame + kept_frames_per_read, end_frame)
+            parent_traces = self._recording.get_traces(
+                channel_ids=channel_ids,
+                start_frame=first_frame * self._decimation_factor,
+                end_frame=(last_frame - 1) * self._decimation_factor + 1,
+                return_scaled=not self.has_unscaled  # gains are applied once, by check_get_traces_args
+            )
+            traces.append(np.array(parent_traces[:, ::self._decimation_factor]))
+        return np.concatenate(traces, axis=1)
+
+    def frame_to_time(self, frames):
+        return self._recording.frame_to_time(np.asarray(frames) * self._decimation_factor)
+
+
+class LowpassDecimatedRecordingExtractor(RecordingExtractor):
+    """
+    A recording low-pass filtered against aliasing and decimated, such as the LFP band of a wideband recording.
+
+    As in scipy.signal.decimate, each channel is filtered by a zero-phase Butterworth filter with its cutoff at
+    cutoff_ratio times the decimated Nyquist frequency, then every decimation_factor-th frame is kept. The parent
+    recording is read in spans of bounded size, padded on each side by padding decimated frames of their neighbours so
+    that the filter is continuous over them, and the channels of each span are filtered by a pool of worker threads;
+    the filter releases the GIL, so the threads run in parallel. The memory used is set by read_mb and max_workers,
+    independently of the length of the recording. If the parent has unscaled traces, the output is rounded back to
+    their dtype, so that it is written with the same gains.
+    """
+
+    extractor_name = "LowpassDecimatedRecording"
+    installed = True
+    is_writable = False
+
+    def __init__(
+        self,
+        recording: RecordingExtractor,
+        decimation_factor: int,
+        cutoff_ratio: float = 0.8,
+        filter_order: int = 8,
+        padding: int = 100,
+        max_workers: Optional[int] = None,
+        read_mb: float = 64.
+    ):
+        RecordingExtractor.__init__(self)
+        if decimation_factor < 1:
+            raise ValueError(f"The decimation_factor must be a positive integer, but got {decimation_factor}!")
+        if not 0 < cutoff_ratio < 1:
+            raise ValueError(f"The cutoff_ratio must be in (0, 1), but got {cutoff_ratio}!")
+        self._recording = recording
+        self._decimation_factor = int(decimation_factor)
+        self._sos = signal.butter(filter_order, cutoff_ratio / self._decimation_factor, btype="lowpass", output="sos")
+        self._padding = int(padding) * self._decimation_factor
+        self._max_workers = max_workers
+        self._read_frames = max(1, int(read_mb * 1e6 // (8 * recording.get_num_channels())))
+        self.has_unscaled = recording.has_unscaled
+        self.copy_channel_properties(recording=recording)
+        self._kwargs = dict(
+            recording=recording.make_serialized_dict(),
+            decimation_factor=decimation_factor,
+            cutoff_ratio=cutoff_ratio,
+            filter_order=filter_order,
+            padding=padding,
+            max_workers=max_workers,
+            read_mb=read_mb
+        )
+
+    def get_channel_ids(self):
+        return self._recording.get_channel_ids()
+
+    def get_num_frames(self):
+        return -(-self._recording.get_num_frames() // self._decimation_factor)
+
+    def get_sampling_frequency(self):
+        return self._recording.get_sampling_frequency() / self._decimation_factor
+
+    def _filter_channel(self, channel_id, first_frame: int, last_frame: int):
+        """Filter the span of kept frames [first_frame, last_frame) of one channel and decimate it."""
+        num_frames = self._recording.get_num_frames()
+        start_frame = first_frame * self._decimation_factor
+        end_frame = min(num_frames, (last_frame - 1) * self._decimation_factor + 1)
+        padded_start_frame = max(0, start_frame - self._padding)
+        padded_end_frame = min(num_frames, end_frame + self._padding)
+        traces = self._recording.get_traces(
+            channel_ids=[channel_id],
+            start_frame=padded_start_frame,
+            end_frame=padded_end_frame,
+            return_scaled=not self.has_unscaled  # gains are applied once, by check_get_traces_args
+        )[0]
+        filtered_traces = signal.sosfiltfilt(self._sos, traces.astype("float64"))
+        return filtered_traces[start_frame - padded_start_frame:end_frame - padded_start_frame:self._decimation_factor]
+
+    @check_get_traces_args
+    def get_traces(self, channel_ids=None, start_frame=None, end_frame=None, return_scaled=True):
+        dtype = self._recording.get_dtype(return_scaled=not self.has_unscaled)
+        traces = np.empty((len(channel_ids), end_frame - start_frame), dtype=dtype if self.has_unscaled else "float32")
+        kept_frames_per_read = max(1, self._read_frames // self._decimation_factor)
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            for first_frame in range(start_frame, end_frame, kept_frames_per_read):
+                last_frame = min(first_frame + kept_frames_per_read, end_frame)
+                filtered_traces = executor.map(
+                    lambda channel_id: self._filter_channel(channel_id, first_frame, last_frame), channel_ids
+                )
+                for channel_index, channel_traces in enumerate(filtered_traces):
+                    if self.has_unscaled:
+                        channel_traces = np.clip(np.rint(channel_traces), np.iinfo(dtype).min, np.iinfo(dtype).max)
+                    traces[channel_index, first_frame - start_frame:last_frame - start_frame] = channel_traces
+        return traces
+
+    def frame_to_time(self, frames):
+        return self._recording.frame_to_time(np.asarray(frames) * self._decimation_factor)
+
+
+def _read_header_index(index_path: Path):
+    if not index_path.is_file():
+        return dict()
+    try:
+        with open(index_path, mode="r") as f:
+            header_index = json.load(f)
+    except (OSError, ValueError):
+        return dict()
+    if header_index.get("version") != NCS_HEADER_INDEX_VERSION:
+        return dict()
+    return header_index.get("files", dict())
+
+
+def _write_header_index(index_path: Path, files: dict):
+    """Replace the index in one step through a uniquely named temporary file, so readers only see a complete one."""
+    try:
+        temporary_file = tempfile.NamedTemporaryFile(
+            mode="w", dir=index_path.parent, prefix=f"{index_path.stem}-", suffix=".tmp", delete=False
+        )
+    except OSError:  # e.g., a read-only cache folder; the index is only an optimization
+        return
+    try:
+        with temporary_file:
+            json.dump(dict(version=NCS_HEADER_INDEX_VERSION, files=files), temporary_file, indent=2)
+        os.replace(temporary_file.name, index_path)
+    except OSError:
+        pass
+    finally:
+        if os.path.exists(temporary_file.name):
+            os.unlink(temporary_file.name)
+
+
+def _is_contiguous_ncs_file(file_path: Path, sampling_frequency: float, num_frames: int):
+    """
+    Whether the records of an .ncs file can be memory mapped as one continuous series of samples.
+
+    That is, every record holds NCS_SAMPLES_PER_RECORD valid samples, each record starts where the previous one ended
+    according to its timestamp, and the records span exactly the num_frames of the first segment parsed by neo.
+    """
+    num_records = (file_path.stat().st_size - NCS_HEADER_SIZE) // NCS_RECORD_DTYPE.itemsize
+    if num_records * NCS_SAMPLES_PER_RECORD != num_frames:
+        return False
+    records = np.memmap(file_path, dtype=NCS_RECORD_DTYPE, mode="r", offset=NCS_HEADER_SIZE, shape=(num_records,))
+    if np.any(records["num_valid_samples"] != NCS_SAMPLES_PER_RECORD):
+        return False
+    record_duration_us = NCS_SAMPLES_PER_RECORD * 1e6 / sampling_frequency
+    timestamp_steps = np.diff(records["timestamp"].astype(np.int64))
+    return bool(np.all(np.abs(timestamp_steps - record_duration_us) <= NCS_TIMESTAMP_TOLERANCE_US))
+
+
+def _open_ncs_file(file_path: Path, cached_entry: Optional[dict] = None, check_contiguous: bool = False):
+    """
+    Open one .ncs file and return its extractor and header entry.
+
+    The file is memory mapped from its cached header if that is still valid and the file was found to be contiguous
+    when first parsed; otherwise it is parsed by neo, which handles partial records and gaps in the recording, and,
+    if check_contiguous is True, its records are checked for a later load from the header.
+    """
+    file_stat = file_path.stat()
+    file_key = dict(size=file_stat.st_size, mtime_ns=file_stat.st_mtime_ns)
+    if (
+        cached_entry is not None
+        and all(cached_entry.get(key) == value for key, value in file_key.items())
+        and cached_entry["header"]["is_contiguous"]
+    ):
+        header = cached_entry["header"]
+        extractor = NcsRecordingExtractor(
+            file_path=file_path,
+            sampling_frequency=header["sampling_frequency"],
+            num_frames=header["num_frames"],
+            channel_id=header["channel_id"],
+            channel_name=header["channel_name"]
+        )
+        return extractor, cached_entry
+    extractor = NeuralynxRecordingExtractor(filename=str(file_path), seg_index=0)
+    channel_id = extractor.get_channel_ids()[0]
+    header = dict(
+        gain=float(extractor.get_channel_gains()[0]),
+        sampling_frequency=float(extractor.get_sampling_frequency()),
+        num_frames=int(extractor.get_num_frames()),
+        num_records=int(-(-extractor.get_num_frames() // NCS_SAMPLES_PER_RECORD)),
+        t_start=float(extractor.neo_reader.get_signal_t_start(extractor.block_index, extractor.seg_index)),
+        channel_id=int(channel_id),
+        channel_name=str(extractor.get_channel_property(channel_id=channel_id, property_name="name"))
+    )
+    header.update(
+        is_contiguous=check_contiguous and _is_contiguous_ncs_file(
+            file_path=file_path, sampling_frequency=header["sampling_frequency"], num_frames=header["num_frames"]
+        )
+    )
+    extractor.clear_channel_gains()
+    return extractor, dict(file_key, header=header)
+
+
+def make_nlx_extractor(
+    folder_path: PathType, max_workers: Optional[int] = None, cache_folder: Optional[PathType] = None
+):
     """
     Auxiliary function for robust loading of Neuralynx .ncs files from common folder_path.
 
+    The files are opened concurrently. If a cache_folder is passed, the parsed header of each file (gain, sampling
+    rate, record count, start time, and whether its records are contiguous) is stored in an index there, keyed by the
+    absolute path, size and modification time of the file, so that later loads of the same contiguous files can
+    memory-map them directly without parsing them again. Nothing is ever written to the folder of the raw data.
+
     Parameters
     ----------
     folder_path : PathType
         Path to the folder containing the .ncs files to be loaded.
+    max_workers : int, optional
+        Number of threads used to open the files. Defaults to the ThreadPoolExecutor default.
+    cache_folder : PathType, optional
+        Folder in which to keep the header index between loads. The default is to parse every file with neo.
     """
-    neuralynx_files = natsorted([str(x) for x in Path(folder_path).iterdir() if ".ncs" in x.suffixes])
-    extractors = [NeuralynxRecordingExtractor(filename=filename, seg_index=0) for filename in neuralynx_files]
-    gains = [extractor.get_channel_gains()[0] for extractor in extractors]
-    for extractor in extractors:
-        extractor.clear_channel_gains()
+    neuralynx_files = natsorted([x for x in Path(folder_path).absolute().iterdir() if ".ncs" in x.suffixes], key=str)
+    if cache_folder is not None:
+        Path(cache_folder).mkdir(parents=True, exist_ok=True)
+        index_path = Path(cache_folder) / NCS_HEADER_INDEX_FILE_NAME
+        header_index = _read_header_index(index_path=index_path)
+    else:
+        header_index = dict()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        opened_files = list(
+            executor.map(
+                lambda file_path: _open_ncs_file(
+                    file_path=file_path,
+                    cached_entry=header_index.get(str(file_path)),
+                    check_contiguous=cache_folder is not None
+                ),
+                neuralynx_files
+            )
+        )
+    extractors = [extractor for extractor, _ in opened_files]
+    gains = [entry["header"]["gain"] for _, entry in opened_files]
+    if cache_folder is not None:
+        new_entries = {str(file_path): entry for file_path, (_, entry) in zip(neuralynx_files, opened_files)}
+        if any(header_index.get(key) != value for key, value in new_entries.items()):
+            _write_header_index(index_path=index_path, files=dict(header_index, **new_entries))
     recording_extractor = MultiRecordingChannelExtractor(extractors)
     recording_extractor.set_channel_gains(gains=gains)
     return recording_extractor
+
+
+def make_recording_conversion_options(
+    recording: RecordingExtractor,
+    buffer_mb: float = DEFAULT_WRITE_OPTIONS["buffer_mb"],
+    chunk_policy: str = DEFAULT_WRITE_OPTIONS["chunk_policy"],
+    chunk_mb: float = DEFAULT_WRITE_OPTIONS["chunk_mb"],
+    compression: Optional[str] = DEFAULT_WRITE_OPTIONS["compression"],
+    compression_level: Optional[int] = DEFAULT_WRITE_OPTIONS["compression_level"],
+    max_memory_mb: Optional[float] = DEFAULT_WRITE_OPTIONS["max_memory_mb"]
+):
+    """
+    Translate the streaming write options of a raw recording into the conversion options of its recording interface.
+
+    The traces are streamed into the NWBFile by a RecordingExtractorDataChunkIterator, which never holds more than a
+    buffer of them in memory, so the memory used by the write does not grow with the length of the recording.
+
+    Parameters
+    ----------
+    recording : RecordingExtractor
+        The recording to be written, after any stub or channel subsetting.
+    buffer_mb : float, default: 1000.
+        Size of the buffer of traces the iterator holds at once.
+    chunk_policy : str, default: "time"
+        Shape of the HDF5 chunks of the written traces:
+            "time": chunks span every channel, favoring reads of all channels over a window of time.
+            "channel": chunks span a single channel, favoring reads of a few channels over the whole recording.
+            "auto": chunks keep the aspect ratio of the traces, as chosen by the iterator.
+    chunk_mb : float, default: 1.
+        Size of each HDF5 chunk; HDF5 recommends staying around 1 MB.
+    compression : str, optional
+        Compression codec, "gzip" or "lzf", or None to disable compression.
+    compression_level : int, default: 4
+        Level of "gzip" compression, from 0 to 9. Ignored for other codecs.
+    max_memory_mb : float, optional
+        Hard cap on the memory used by the buffer; buffer_mb is lowered to it if larger.
+    """
+    if chunk_policy not in CHUNK_POLICIES:
+        raise ValueError(f"Unknown chunk_policy '{chunk_policy}'! Choose one of {CHUNK_POLICIES}.")
+    if max_memory_mb is not None:
+        if chunk_mb > max_memory_mb:
+            raise ValueError(f"chunk_mb ({chunk_mb}) exceeds the memory cap of max_memory_mb ({max_memory_mb})!")
+        buffer_mb = min(buffer_mb, max_memory_mb)
+    buffer_mb = max(buffer_mb, chunk_mb)
+
+    num_frames = recording.get_num_frames()
+    num_channels = recording.get_num_channels()
+    itemsize = np.dtype(recording.get_dtype(return_scaled=False)).itemsize
+    if chunk_policy == "auto":
+        iterator_opts = dict(chunk_mb=chunk_mb, buffer_gb=buffer_mb / 1e3)
+    else:
+        chunk_channels = num_channels if chunk_policy == "time" else 1
+        chunk_frames = min(num_frames, max(1, int(chunk_mb * 1e6 // (chunk_channels * itemsize))))
+        buffer_frames = chunk_frames * max(1, int(buffer_mb * 1e6 // (chunk_frames * num_channels * itemsize)))
+        iterator_opts = dict(
+            chunk_shape=(chunk_frames, chunk_channels), buffer_shape=(min(num_frames, buffer_frames), num_channels)
+        )
+    return dict(
+        compression=compression,
+        compression_opts=compression_level if compression == "gzip" else None,
+        iterator_type="v2",
+        iterator_opts=iterator_opts
+    )
+
+
+def make_column_data(data: ArrayType, compression: Optional[str], compression_opts, chunk_mb: float):
+    """Wrap a numeric column to be written as a single chunked and compressed dataset, chunked by rows."""
+    if not isinstance(data, np.ndarray) or data.dtype.kind not in "biuf" or data.size == 0:
+        return data
+    row_size = data.itemsize * int(np.prod(data.shape[1:]))
+    chunk_rows = int(np.clip(chunk_mb * 1e6 // row_size, 1, len(data)))
+    return H5DataIO(
+        data=data,
+        chunks=(chunk_rows,) + data.shape[1:],
+        compression=compression,
+        compression_opts=compression_opts if compression == "gzip" else None
+    )
+
+
+def get_recording_size(recording: RecordingExtractor):
+    """Size in bytes of the unscaled traces of a recording."""
+    itemsize = np.dtype(recording.get_dtype(return_scaled=False)).itemsize
+    return recording.get_num_frames() * recording.get_num_channels() * itemsize
+
+
+def as_column_data(values: ArrayType):
+    """Cast a column of trial or unit values to something HDF5 can write directly; strings become a list of str."""
+    values = np.asarray(values)
+    if values.ndim != 1:
+        values = values.ravel()
+    if values.dtype.kind in ("U", "S", "O"):
+        return values.astype(str).tolist()
+    return values
+
+
+def add_trials_from_columns(
+    nwbfile: NWBFile,
+    start_time: ArrayType,
+    stop_time: ArrayType,
+    columns: dict,
+    column_descriptions: Optional[dict] = None
+):
+    """
+    Fill the trials table of the NWBFile from whole columns of values in a single pass.
+
+    Equivalent to calling nwbfile.add_trial_column once per column followed by nwbfile.add_trial once per trial,
+    but each column is handed to the table as one array instead of being appended to row by row.
+
+    Parameters
+    ----------
+    nwbfile : NWBFile
+        The NWBFile to add the trials table to. It must not already contain a trials table.
+    start_time : ArrayType
+        Start time of each trial, in seconds.
+    stop_time : ArrayType
+        Stop time of each trial, in seconds.
+    columns : dict
+        Maps the name of each custom trials column to the array of its values, one per trial.
+    column_descriptions : dict, optional
+        Maps the name of each custom trials column to its description. Missing descriptions default to "".
+    """
+    if nwbfile.trials is not None:
+        raise ValueError("The NWBFile already contains a trials table!")
+    if column_descriptions is None:
+        column_descriptions = dict()
+
+    n_trials = len(start_time)
+    trial_columns = [
+        VectorData(
+            name="start_time",
+            description="Start time of epoch, in seconds",
+            data=np.asarray(start_time, dtype=float)
+        ),
+        VectorData(
+            name="stop_time",
+            description="Stop time of epoch, in seconds",
+            data=np.asarray(stop_time, dtype=float)
+        )
+    ]
+    for name, values in columns.items():
+        data = as_column_data(values)
+        if len(data) != n_trials:
+            raise ValueError(f"Column '{name}' has {len(data)} values, but there are {n_trials} trials!")
+        trial_columns.append(VectorData(name=name, description=column_descriptions.get(name, ""), data=data))
+    nwbfile.trials = TimeIntervals(name="trials", description="experimental trials", columns=trial_columns)
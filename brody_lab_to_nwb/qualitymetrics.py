@@ -0,0 +1,210 @@
+"""Authors: Cody Baker."""
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+import spikeextractors as se
+
+QUALITY_METRIC_NAMES = ["num_spikes", "firing_rate", "isi_violation", "snr"]
+THRESHOLD_SIGNS = dict(
+    less=np.less, less_or_equal=np.less_equal, greater=np.greater, greater_or_equal=np.greater_equal
+)
+
+
+def get_spike_trains(sorting: se.SortingExtractor):
+    """
+    Read the spike trains of every unit of a sorting once, concatenated in the order of its unit ids.
+
+    Returns
+    -------
+    spike_frames : np.ndarray
+        The spike frames of all units, sorted within each unit.
+    offsets : np.ndarray
+        Array of length n_units + 1 such that the spikes of unit j are spike_frames[offsets[j]:offsets[j + 1]].
+    """
+    spike_trains = [np.sort(sorting.get_unit_spike_train(unit_id=x)) for x in sorting.get_unit_ids()]
+    offsets = np.zeros(len(spike_trains) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in spike_trains], out=offsets[1:])
+    return np.concatenate([np.empty(0, dtype=np.int64)] + spike_trains), offsets
+
+
+def compute_isi_violations(
+    spike_times: np.ndarray, offsets: np.ndarray, duration: float, isi_threshold: float, min_isi: float
+):
+    """
+    Rate of refractory period violations of every unit, relative to its firing rate, as in spikemetrics.
+
+    Spikes within min_isi of the previous spike of the same unit are dropped as duplicates first; a violation is then
+    an interspike interval shorter than isi_threshold.
+    """
+    n_units = len(offsets) - 1
+    unit_indices = np.repeat(np.arange(n_units), np.diff(offsets))
+    if min_isi > 0:
+        is_duplicate = np.zeros(len(spike_times), dtype=bool)
+        is_duplicate[1:] = (unit_indices[1:] == unit_indices[:-1]) & (np.diff(spike_times) <= min_isi)
+        spike_times = spike_times[~is_duplicate]
+        unit_indices = unit_indices[~is_duplicate]
+    n_spikes = np.bincount(unit_indices, minlength=n_units)
+    is_violation = (unit_indices[1:] == unit_indices[:-1]) & (np.diff(spike_times) < isi_threshold)
+    n_violations = np.bincount(unit_indices[1:][is_violation], minlength=n_units)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        violation_rate = n_violations / (2 * n_spikes * (isi_threshold - min_isi))
+        return violation_rate / (n_spikes / duration)
+
+
+def compute_channel_noise_levels(
+    recording: se.RecordingExtractor, noise_duration: float = 10., mode: str = "mad", seed: int = 0
+):
+    """Noise level of each channel, over a single window of noise_duration seconds drawn as spiketoolkit does."""
+    n_frames = int(noise_duration * recording.get_sampling_frequency())
+    if n_frames >= recording.get_num_frames():
+        start_frame = 0
+        end_frame = recording.get_num_frames()
+    else:
+        start_frame = np.random.RandomState(seed=seed).randint(0, recording.get_num_frames() - n_frames)
+        end_frame = start_frame + n_frames
+    traces = recording.get_traces(start_frame=start_frame, end_frame=end_frame)
+    if mode == "std":
+        return np.std(traces, axis=1)
+    elif mode == "mad":
+        return np.median(np.abs(traces - np.median(traces, axis=1, keepdims=True)) / 0.6745, axis=1)
+    raise ValueError(f"Noise mode '{mode}' is not 'std' or 'mad'!")
+
+
+def compute_snrs(templates: np.ndarray, noise_levels: np.ndarray):
+    """Peak absolute amplitude of each template on its largest channel, over the noise level of that channel."""
+    amplitudes = np.max(np.abs(templates), axis=2)
+    max_channels = np.argmax(amplitudes, axis=1)
+    return amplitudes[np.arange(len(templates)), max_channels] / noise_levels[max_channels]
+
+
+def compute_quality_metrics(
+    sorting: se.SortingExtractor,
+    recording: se.RecordingExtractor,
+    metric_names: Optional[Iterable[str]] = None,
+    isi_threshold: float = 0.0015,
+    min_isi: Optional[float] = None,
+    snr_mode: str = "mad",
+    snr_noise_duration: float = 10.,
+    max_spikes_per_unit_for_snr: int = 1000,
+    apply_filter: bool = True,
+    freq_min: float = 300.,
+    freq_max: float = 6000.,
+    seed: int = 0
+):
+    """
+    Compute the quality metrics of every unit of a sorting in a single pass, as a table for curate_sorting.
+
+    The spike trains are read once and every spike train metric is computed from them at once; the SNR needs a single
+    read of a noise window of the recording, and the unit templates, which are taken from the 'template' property
+    stored by st.postprocessing.get_unit_templates rather than extracted from the recording again. The definitions and
+    defaults are those of st.validation.compute_quality_metrics.
+
+    Parameters
+    ----------
+    sorting : se.SortingExtractor
+    recording : se.RecordingExtractor
+        The recording the sorting was run on; its number of frames sets the duration for the firing rates.
+    metric_names : iterable of str, optional
+        Any of QUALITY_METRIC_NAMES. Defaults to all of them.
+    isi_threshold : float, optional
+        Refractory period in seconds for the ISI violations. The default is 0.0015.
+    min_isi : float, optional
+        Minimum interspike interval in seconds; spikes closer than this to the previous one are dropped as duplicates
+        for the ISI violations. Defaults to half a sample.
+    snr_mode : str, optional
+        Noise level of the SNR, either 'mad' or 'std'. The default is 'mad'.
+    snr_noise_duration : float, optional
+        Duration in seconds of the noise window of the SNR. The default is 10.
+    max_spikes_per_unit_for_snr : int, optional
+        Number of spikes per unit for the templates, if they have to be computed. The default is 1000.
+    apply_filter : bool, optional
+        Whether to bandpass filter the noise window of an unfiltered recording. The default is True.
+    freq_min : float, optional
+        Lower cutoff frequency in Hz of that filter. The default is 300.
+    freq_max : float, optional
+        Upper cutoff frequency in Hz of that filter. The default is 6000.
+    seed : int, optional
+        Seed of the start of the noise window. The default is 0.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per unit, indexed by unit id, with a column per metric.
+    """
+    metric_names = QUALITY_METRIC_NAMES if metric_names is None else list(metric_names)
+    unknown_metric_names = [x for x in metric_names if x not in QUALITY_METRIC_NAMES]
+    if unknown_metric_names:
+        raise ValueError(f"Quality metrics {unknown_metric_names} are not any of {QUALITY_METRIC_NAMES}!")
+    sampling_frequency = recording.get_sampling_frequency()
+    duration = recording.get_num_frames() / sampling_frequency
+    min_isi = 0.5 / sampling_frequency if min_isi is None else min_isi
+
+    spike_frames, offsets = get_spike_trains(sorting=sorting)
+    n_spikes = np.diff(offsets)
+    metrics = dict()
+    if "num_spikes" in metric_names:
+        metrics.update(num_spikes=n_spikes)
+    if "firing_rate" in metric_names:
+        metrics.update(firing_rate=n_spikes / duration)
+    if "isi_violation" in metric_names:
+        metrics.update(
+            isi_violation=compute_isi_violations(
+                spike_times=spike_frames / sampling_frequency,
+                offsets=offsets,
+                duration=duration,
+                isi_threshold=isi_threshold,
+                min_isi=min_isi
+            )
+        )
+    if "snr" in metric_names:
+        import spiketoolkit as st
+
+        if apply_filter and not recording.is_filtered:
+            recording = st.preprocessing.bandpass_filter(recording, freq_min=freq_min, freq_max=freq_max)
+        templates = np.array(
+            st.postprocessing.get_unit_templates(
+                recording, sorting, max_spikes_per_unit=max_spikes_per_unit_for_snr, seed=seed
+            )
+        )
+        noise_levels = compute_channel_noise_levels(
+            recording=recording, noise_duration=snr_noise_duration, mode=snr_mode, seed=seed
+        )
+        metrics.update(snr=compute_snrs(templates=templates, noise_levels=noise_levels))
+    return pd.DataFrame(metrics, index=pd.Index(sorting.get_unit_ids(), name="unit_id"))[
+        [x for x in metric_names if x in metrics]
+    ]
+
+
+def curate_sorting(sorting: se.SortingExtractor, quality_metrics: pd.DataFrame, thresholds: dict):
+    """
+    Exclude the units of a sorting whose quality metrics cross any of the thresholds.
+
+    Parameters
+    ----------
+    sorting : se.SortingExtractor
+    quality_metrics : pd.DataFrame
+        Table of compute_quality_metrics, indexed by the unit ids of the sorting.
+    thresholds : dict
+        Maps the name of each metric to threshold to (threshold, threshold_sign); as in the st.curation functions,
+        a threshold_sign of 'less' excludes the units whose metric is less than the threshold, and similarly for
+        'less_or_equal', 'greater' and 'greater_or_equal'. A threshold of None skips the metric.
+
+    Returns
+    -------
+    se.SubSortingExtractor
+        The sorting restricted to the units that pass every threshold, with their properties and features.
+    """
+    quality_metrics = quality_metrics.reindex(sorting.get_unit_ids())
+    is_excluded = np.zeros(len(quality_metrics), dtype=bool)
+    for metric_name, (threshold, threshold_sign) in thresholds.items():
+        if threshold is None:
+            continue
+        if threshold_sign not in THRESHOLD_SIGNS:
+            raise ValueError(f"Threshold sign '{threshold_sign}' is not any of {list(THRESHOLD_SIGNS)}!")
+        if metric_name not in quality_metrics:
+            raise ValueError(f"Quality metric '{metric_name}' has not been computed!")
+        is_excluded |= THRESHOLD_SIGNS[threshold_sign](quality_metrics[metric_name].to_numpy(), threshold)
+    return se.SubSortingExtractor(
+        sorting, unit_ids=[x for x, y in zip(sorting.get_unit_ids(), is_excluded) if not y]
+    )
@@ -0,0 +1,390 @@
+"""Authors: Cody Baker."""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+import spikeextractors as se
+
+from .interfaces.utils import PathType
+
+CHECKPOINT_FILE_NAME = "checkpoint.json"
+SORTER_JOB_FILE_NAME = "sorter_job.json"
+SORTER_BUDGET_PARAM_NAMES = dict(n_jobs=["n_jobs_bin", "n_jobs", "num_workers"], chunk_mb=["chunk_mb"])
+FEATURES_FOLDER_NAME = "features"
+FEATURES_INDEX_FILE_NAME = "features.json"
+THREAD_LIMIT_VARIABLES = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+
+def get_file_fingerprint(file_path: PathType):
+    """Identify a raw data file by its path, size and modification time, without reading through its contents."""
+    file_path = Path(file_path)
+    file_stat = file_path.stat()
+    return dict(file_path=str(file_path.absolute()), size=file_stat.st_size, mtime_ns=file_stat.st_mtime_ns)
+
+
+class PipelineCheckpoints:
+    """
+    Checkpoints of the stages of a sorting pipeline, so that a rerun only recomputes the stages whose inputs changed.
+
+    Each stage writes its outputs to its own subfolder of the checkpoint folder, along with a checkpoint.json holding
+    the key of the stage: a hash of its parameters and of the keys of the stages it depends on. When the key of a
+    stage is unchanged on a rerun, its outputs are loaded from the subfolder instead of being computed again; when it
+    changes, the subfolder is cleared and the stage recomputed, which in turn changes the keys of every later stage.
+    """
+
+    def __init__(self, checkpoint_folder: PathType):
+        self.checkpoint_folder = Path(checkpoint_folder)
+        self.checkpoint_folder.mkdir(parents=True, exist_ok=True)
+        self.keys = dict()
+
+    def get_key(self, stage: str, params: dict, depends_on: Iterable[str] = ()):
+        """Hash of the parameters of a stage and the keys of the stages it depends on."""
+        missing_stages = [x for x in depends_on if x not in self.keys]
+        if missing_stages:
+            raise ValueError(f"Stage '{stage}' depends on {missing_stages}, which have not been run yet!")
+        key_data = dict(stage=stage, params=params, depends_on={x: self.keys[x] for x in depends_on})
+        return hashlib.blake2b(
+            json.dumps(key_data, sort_keys=True, default=str).encode(), digest_size=16
+        ).hexdigest()
+
+    def is_complete(self, stage: str, key: str):
+        checkpoint_path = self.checkpoint_folder / stage / CHECKPOINT_FILE_NAME
+        return checkpoint_path.is_file() and json.loads(checkpoint_path.read_text())["key"] == key
+
+    def prepare_stage(self, stage: str, params: dict, depends_on: Iterable[str] = ()):
+        """
+        Key a stage and check whether it is up to date, clearing its folder if it is not.
+
+        Returns
+        -------
+        key : str
+        stage_folder : Path
+        is_complete : bool
+        """
+        key = self.get_key(stage=stage, params=params, depends_on=depends_on)
+        self.keys[stage] = key
+        stage_folder = self.checkpoint_folder / stage
+        if self.is_complete(stage=stage, key=key):
+            return key, stage_folder, True
+        if stage_folder.exists():
+            shutil.rmtree(stage_folder)
+        stage_folder.mkdir(parents=True)
+        return key, stage_folder, False
+
+    def complete_stage(self, stage: str, key: str, params: dict, depends_on: Iterable[str] = (), **info):
+        """Write the checkpoint of a stage whose outputs have been written to its folder, with any extra info."""
+        checkpoint = dict(
+            key=key,
+            params=params,
+            depends_on=list(depends_on),
+            completed=datetime.now().isoformat(timespec="seconds"),
+            **info
+        )
+        stage_folder = self.checkpoint_folder / stage
+        temporary_path = stage_folder / f"{CHECKPOINT_FILE_NAME}.tmp"
+        temporary_path.write_text(json.dumps(checkpoint, indent=2, default=str))
+        os.replace(temporary_path, stage_folder / CHECKPOINT_FILE_NAME)
+
+    def get_checkpoint(self, stage: str):
+        """The checkpoint written for a stage."""
+        return json.loads((self.checkpoint_folder / stage / CHECKPOINT_FILE_NAME).read_text())
+
+    def run_stage(
+        self, stage: str, params: dict, compute: Callable, load: Callable, depends_on: Iterable[str] = ()
+    ):
+        """
+        Run a stage of the pipeline, or load its outputs if it has already been run with the same inputs.
+
+        Parameters
+        ----------
+        stage : str
+            Name of the stage, also the name of its subfolder.
+        params : dict
+            Every parameter that affects the outputs of the stage; must be JSON serializable, or convertible by str.
+        compute : callable
+            Called with the folder of the stage, writing its outputs there and returning them.
+        load : callable
+            Called with the folder of a completed stage, returning its outputs.
+        depends_on : iterable of str, optional
+            Names of the stages whose outputs this stage uses.
+        """
+        key, stage_folder, is_complete = self.prepare_stage(stage=stage, params=params, depends_on=depends_on)
+        if is_complete:
+            print(f"Stage '{stage}' is up to date; loading its checkpoint.")
+            return load(stage_folder)
+        start_time = time.perf_counter()
+        outputs = compute(stage_folder)
+        self.complete_stage(
+            stage=stage, key=key, params=params, depends_on=depends_on, wall_time_s=time.perf_counter() - start_time
+        )
+        return outputs
+
+
+def save_recording(recording: se.RecordingExtractor, folder: PathType, n_jobs: int = 1, chunk_mb: float = 500):
+    """
+    Materialize a (preprocessed) recording into a binary file in the folder, returning it memory mapped.
+
+    The traces are written in their unscaled dtype, with the channel gains and all other channel properties kept
+    alongside, so every later read is a plain memory mapped read rather than a recomputation of the preprocessing.
+    """
+    folder = Path(folder)
+    cached_recording = se.CacheRecordingExtractor(
+        recording, return_scaled=False, save_path=folder / "recording.dat", chunk_mb=chunk_mb, n_jobs=n_jobs
+    )
+    cached_recording.dump_to_pickle(folder / "recording.pkl")
+    return load_recording(folder=folder)
+
+
+def load_recording(folder: PathType):
+    """Load the memory mapped recording saved by save_recording."""
+    return se.load_extractor_from_pickle(Path(folder) / "recording.pkl")
+
+
+def save_sorting(sorting: se.SortingExtractor, folder: PathType):
+    """
+    Save a sorting to the folder, along with its unit properties and spike features such as waveforms.
+
+    The spike features are saved as one .npy file per unit and feature in the features subfolder rather than in the
+    pickle, and are loaded back memory mapped, so that neither saving nor loading holds all the waveforms in memory.
+    """
+    folder = Path(folder)
+    features_folder = folder / FEATURES_FOLDER_NAME
+    features_folder.mkdir(parents=True, exist_ok=True)
+    feature_files = []
+    for unit_id, unit_features in sorting._features.items():
+        for feature_name, value in unit_features.items():
+            file_name = f"{unit_id}_{feature_name}.npy"
+            np.save(features_folder / file_name, np.asarray(value))
+            feature_files.append(dict(unit_id=int(unit_id), feature_name=feature_name, file_name=file_name))
+    (features_folder / FEATURES_INDEX_FILE_NAME).write_text(json.dumps(feature_files, indent=2))
+    # the cached sorting would otherwise deep copy every feature into memory, only for the pickle to leave them out
+    features = sorting._features
+    sorting._features = dict()
+    try:
+        cached_sorting = se.CacheSortingExtractor(sorting, save_path=folder / "sorting.npz")
+    finally:
+        sorting._features = features
+    cached_sorting.dump_to_pickle(folder / "sorting.pkl", include_properties=True, include_features=False)
+    return load_sorting(folder=folder)
+
+
+def load_sorting(folder: PathType):
+    """Load the sorting saved by save_sorting, with its spike features memory mapped from their .npy files."""
+    folder = Path(folder)
+    sorting = se.load_extractor_from_pickle(folder / "sorting.pkl")
+    features_folder = folder / FEATURES_FOLDER_NAME
+    index_path = features_folder / FEATURES_INDEX_FILE_NAME
+    if index_path.is_file():
+        for feature_file in json.loads(index_path.read_text()):
+            sorting._features.setdefault(feature_file["unit_id"], dict())[feature_file["feature_name"]] = np.load(
+                features_folder / feature_file["file_name"], mmap_mode="r"
+            )
+    return sorting
+
+
+def save_dataframe(df: pd.DataFrame, folder: PathType, name: str):
+    """Save a table of per-unit values, such as quality metrics, to the folder."""
+    df.to_csv(Path(folder) / f"{name}.csv")
+    return df
+
+
+def load_dataframe(folder: PathType, name: str):
+    """Load the table saved by save_dataframe."""
+    return pd.read_csv(Path(folder) / f"{name}.csv", index_col=0)
+
+
+def get_sorter_budget_params(sorter_name: str, n_jobs: int, chunk_mb: float):
+    """The parameters of a sorter that set its number of jobs and chunk memory, for those the sorter has."""
+    import spikesorters as ss
+
+    default_params = ss.get_default_params(sorter_name)
+    budget_params = dict()
+    for budget_name, value in dict(n_jobs=n_jobs, chunk_mb=chunk_mb).items():
+        budget_params.update({x: value for x in SORTER_BUDGET_PARAM_NAMES[budget_name] if x in default_params})
+    return budget_params
+
+
+def run_sorters_concurrently(
+    checkpoints: PipelineCheckpoints,
+    sorter_params: dict,
+    recording_stage: str = "preprocessing",
+    n_jobs: int = 1,
+    chunk_mb: float = 500
+):
+    """
+    Run several sorters at once, each in its own process, on the recording saved by a previous stage.
+
+    Each sorter is checkpointed as its own stage named sorting_<sorter_name>, so only the sorters that are not up to
+    date are run. The CPU and memory budgets are split evenly between the sorters that run: each gets n_jobs / N jobs
+    and chunk_mb / N MB through whichever of its parameters set them, and its numerical libraries are limited to as
+    many threads. Sorter installation paths set with the set_<sorter>_path methods are passed on to the processes.
+
+    Parameters
+    ----------
+    checkpoints : PipelineCheckpoints
+    sorter_params : dict
+        Maps the name of each sorter to run to a dictionary of its parameters.
+    recording_stage : str, optional
+        Name of the stage that saved the recording with save_recording. The default is 'preprocessing'.
+    n_jobs : int, optional
+        Total number of jobs to split between the sorters. The default is 1.
+    chunk_mb : float, optional
+        Total chunk memory in MB to split between the sorters. The default is 500.
+
+    Returns
+    -------
+    sortings : dict
+        Maps the name of each sorter that succeeded to its sorting.
+    """
+    jobs = dict()
+    sortings = dict()
+    for sorter_name, params in sorter_params.items():
+        stage = f"sorting_{sorter_name}"
+        stage_params = dict(sorter=sorter_name, sorter_params=params)
+        key, stage_folder, is_complete = checkpoints.prepare_stage(
+            stage=stage, params=stage_params, depends_on=[recording_stage]
+        )
+        if is_complete:
+            print(f"Stage '{stage}' is up to date; loading its checkpoint.")
+            sortings[sorter_name] = load_sorting(folder=stage_folder)
+        else:
+            jobs[sorter_name] = dict(stage=stage, key=key, stage_folder=stage_folder, params=stage_params)
+
+    n_jobs_per_sorter = max(1, n_jobs // max(1, len(jobs)))
+    chunk_mb_per_sorter = chunk_mb / max(1, len(jobs))
+    environment = dict(os.environ, **{x: str(n_jobs_per_sorter) for x in THREAD_LIMIT_VARIABLES})
+    for sorter_name, job in jobs.items():
+        job_path = job["stage_folder"] / SORTER_JOB_FILE_NAME
+        job_path.write_text(
+            json.dumps(
+                dict(
+                    sorter_name=sorter_name,
+                    recording_folder=str(checkpoints.checkpoint_folder / recording_stage),
+                    stage_folder=str(job["stage_folder"]),
+                    sorter_params=dict(
+                        get_sorter_budget_params(
+                            sorter_name=sorter_name, n_jobs=n_jobs_per_sorter, chunk_mb=chunk_mb_per_sorter
+                        ),
+                        **sorter_params[sorter_name]
+                    )
+                ),
+                indent=2
+            )
+        )
+        print(f"Running {sorter_name} with {n_jobs_per_sorter} jobs and {chunk_mb_per_sorter:.0f} MB of chunks.")
+        job.update(start_time=time.perf_counter())
+        # The process writes to its own copy of the log file handle, so this one is closed once it has started
+        with open(job["stage_folder"] / "sorter.log", mode="w") as log_file:
+            job.update(
+                process=subprocess.Popen(
+                    [sys.executable, "-m", "brody_lab_to_nwb.sortingpipeline", str(job_path)],
+                    stdout=log_file,
+                    stderr=subprocess.STDOUT,
+                    env=environment
+                )
+            )
+
+    for sorter_name, job in jobs.items():
+        return_code = job["process"].wait()
+        wall_time = time.perf_counter() - job["start_time"]
+        if return_code != 0 or not (job["stage_folder"] / "sorting.pkl").is_file():
+            print(f"{sorter_name} failed after {wall_time:.1f} s; see {job['stage_folder'] / 'sorter.log'}.")
+            continue
+        checkpoints.complete_stage(
+            stage=job["stage"],
+            key=job["key"],
+            params=job["params"],
+            depends_on=[recording_stage],
+            wall_time_s=wall_time
+        )
+        print(f"{sorter_name} finished in {wall_time:.1f} s.")
+        sortings[sorter_name] = load_sorting(folder=job["stage_folder"])
+    return sortings
+
+
+def run_sorter_job(job_path: PathType):
+    """Run the sorter described by a job file of run_sorters_concurrently, saving its sorting to the stage folder."""
+    import spikesorters as ss
+
+    job = json.loads(Path(job_path).read_text())
+    recording = load_recording(folder=job["recording_folder"])
+    sorting = ss.run_sorter(
+        job["sorter_name"],
+        recording,
+        output_folder=Path(job["stage_folder"]) / "output",
+        verbose=True,
+        **job["sorter_params"]
+    )
+    save_sorting(sorting, folder=job["stage_folder"])
+
+
+def compare_sorters(
+    sortings: dict, checkpoints: Optional[PipelineCheckpoints] = None, delta_time: float = 0.4, match_score: float = 0.5
+):
+    """
+    Summarize the agreement between the outputs of several sorters on the same recording.
+
+    Parameters
+    ----------
+    sortings : dict
+        Maps the name of each sorter to its sorting.
+    checkpoints : PipelineCheckpoints, optional
+        If passed, the wall time of each sorter is read from its sorting_<sorter_name> checkpoint.
+    delta_time : float, optional
+        Tolerance in ms for two spikes to match. The default is 0.4.
+    match_score : float, optional
+        Minimum agreement score for two units to match. The default is 0.5.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per sorter, with its number of units, its wall time, the number of its units matched by each other
+        sorter along with their mean agreement score, and the number of its units matched by at least one other.
+    """
+    import spikecomparison as sc
+
+    summary = {sorter_name: dict(n_units=len(sorting.get_unit_ids())) for sorter_name, sorting in sortings.items()}
+    matched_units = {sorter_name: set() for sorter_name in sortings}
+    sorter_names = list(sortings)
+    for j, sorter_name_1 in enumerate(sorter_names):
+        for sorter_name_2 in sorter_names[j + 1:]:
+            comparison = sc.compare_two_sorters(
+                sortings[sorter_name_1],
+                sortings[sorter_name_2],
+                sorting1_name=sorter_name_1,
+                sorting2_name=sorter_name_2,
+                delta_time=delta_time,
+                match_score=match_score
+            )
+            matches = comparison.hungarian_match_12[comparison.hungarian_match_12 != -1]
+            scores = [comparison.agreement_scores.at[x, y] for x, y in matches.items()]
+            mean_score = float(np.mean(scores)) if scores else np.nan
+            for sorter_name, other_name, units in [
+                (sorter_name_1, sorter_name_2, matches.index), (sorter_name_2, sorter_name_1, matches.values)
+            ]:
+                summary[sorter_name].update(
+                    {f"matched_{other_name}": len(matches), f"agreement_{other_name}": mean_score}
+                )
+                matched_units[sorter_name].update(units)
+    for sorter_name in sorter_names:
+        summary[sorter_name].update(n_units_matched_by_any=len(matched_units[sorter_name]))
+        if checkpoints is not None:
+            summary[sorter_name].update(
+                wall_time_s=checkpoints.get_checkpoint(stage=f"sorting_{sorter_name}").get("wall_time_s")
+            )
+    summary = pd.DataFrame.from_dict(summary, orient="index").rename_axis("sorter")
+    leading_columns = [x for x in ["n_units", "wall_time_s", "n_units_matched_by_any"] if x in summary]
+    return summary[leading_columns + sorted(set(summary.columns) - set(leading_columns))]
+
+
+if __name__ == "__main__":
+    run_sorter_job(job_path=sys.argv[1])
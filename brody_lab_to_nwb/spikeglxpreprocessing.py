@@ -0,0 +1,131 @@
+"""Authors: Cody Baker."""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import spikeextractors as se
+from scipy import signal
+
+from .interfaces.utils import PathType
+from .sortingpipeline import load_recording
+
+FILTER_PADDING = 3000  # samples on each side of a chunk, as in spiketoolkit.preprocessing.highpass_filter
+
+
+def _get_raw_memmap(recording: se.SpikeGLXRecordingExtractor, file_path: Path):
+    """Memory map a SpikeGLX binary in its native (frames x saved channels) layout, sync channel included."""
+    n_frames = recording.get_num_frames()
+    n_saved_channels = file_path.stat().st_size // (np.dtype("int16").itemsize * n_frames)
+    return np.memmap(file_path, dtype="int16", mode="r", shape=(n_frames, n_saved_channels))
+
+
+def _read_padded(raw: np.memmap, n_channels: int, start_frame: int, end_frame: int, padding: int, n_frames: int):
+    """
+    Read frames start_frame - padding to end_frame + padding of the first n_channels, zero filled off the ends.
+
+    The chunk is returned as (channels x frames), so that filters run along contiguous memory.
+    """
+    padded_chunk = np.zeros((n_channels, end_frame - start_frame + 2 * padding), dtype="float64")
+    first_frame = max(0, start_frame - padding)
+    last_frame = min(n_frames, end_frame + padding)
+    offset = first_frame - (start_frame - padding)
+    padded_chunk[:, offset:offset + last_frame - first_frame] = raw[first_frame:last_frame, :n_channels].T
+    return padded_chunk
+
+
+def stream_common_median_reference(
+    file_path: PathType,
+    folder: PathType,
+    end_frame: Optional[int] = None,
+    freq_min: Optional[float] = None,
+    filter_order: int = 1,
+    n_jobs: int = 1,
+    chunk_mb: float = 100
+):
+    """
+    Common median reference a SpikeGLX AP binary chunk by chunk, writing the result to a binary file in the folder.
+
+    The int16 traces are memory mapped and each chunk of frames is read, optionally high-pass filtered, referenced to
+    its median across channels and written into a memory mapped int16 output file by a pool of worker threads; the
+    filtering and median computations release the GIL, so the threads run in parallel. The result is the output of
+    st.preprocessing.common_reference (preceded by st.preprocessing.highpass_filter with filter_type='butter' if
+    freq_min is set) rounded and clipped to int16, and is saved in the layout of save_recording so that
+    load_recording reads it.
+
+    Parameters
+    ----------
+    file_path : PathType
+        Path to the .ap.bin file; its .meta file must be next to it.
+    folder : PathType
+        Folder to write recording.dat and recording.pkl to.
+    end_frame : int, optional
+        Treat this frame as the end of the recording, e.g., for a stub test. Defaults to the end of the file.
+    freq_min : float, optional
+        Cutoff frequency in Hz of a zero-phase Butterworth high-pass filter applied before the reference.
+        Chunks are padded with FILTER_PADDING frames of their neighbours so that the filter is continuous over them.
+        The default is to not filter.
+    filter_order : int, optional
+        Order of the high-pass filter. The default is 1.
+    n_jobs : int, optional
+        Number of worker threads. The default is 1.
+    chunk_mb : float, optional
+        Size in MB of the int16 chunk of frames given to each thread at a time. The default is 100.
+
+    Returns
+    -------
+    se.BinDatRecordingExtractor
+        The memory mapped referenced recording, with the channel gains and locations of the SpikeGLX recording.
+    """
+    file_path = Path(file_path)
+    folder = Path(folder)
+    recording = se.SpikeGLXRecordingExtractor(file_path=file_path)
+    raw = _get_raw_memmap(recording=recording, file_path=file_path)
+    n_channels = len(recording.get_channel_ids())
+    n_frames = recording.get_num_frames() if end_frame is None else min(end_frame, recording.get_num_frames())
+    chunk_size = max(1, int(chunk_mb * 1e6 // (np.dtype("int16").itemsize * n_channels)))
+    if freq_min is not None:
+        b, a = signal.butter(filter_order, freq_min / (recording.get_sampling_frequency() / 2.), btype="highpass")
+        padding = FILTER_PADDING
+    else:
+        padding = 0
+
+    folder.mkdir(parents=True, exist_ok=True)
+    dat_path = folder / "recording.dat"
+    output = np.memmap(dat_path, dtype="int16", mode="w+", shape=(n_frames, n_channels))
+
+    def process_chunk(start_frame: int):
+        chunk_end_frame = min(start_frame + chunk_size, n_frames)
+        if freq_min is None:
+            chunk = np.asarray(raw[start_frame:chunk_end_frame, :n_channels])
+        else:
+            padded_chunk = _read_padded(
+                raw=raw,
+                n_channels=n_channels,
+                start_frame=start_frame,
+                end_frame=chunk_end_frame,
+                padding=padding,
+                n_frames=n_frames
+            )
+            chunk = signal.filtfilt(b, a, padded_chunk, axis=1)[:, padding:padding + chunk_end_frame - start_frame]
+            chunk = np.ascontiguousarray(chunk.T)
+        referenced_chunk = np.rint(chunk - np.median(chunk, axis=1, keepdims=True))
+        output[start_frame:chunk_end_frame] = np.clip(referenced_chunk, np.iinfo("int16").min, np.iinfo("int16").max)
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        list(executor.map(process_chunk, range(0, n_frames, chunk_size)))
+    output.flush()
+    del output
+
+    referenced_recording = se.BinDatRecordingExtractor(
+        file_path=dat_path,
+        sampling_frequency=recording.get_sampling_frequency(),
+        numchan=n_channels,
+        dtype="int16",
+        time_axis=0,
+        recording_channels=recording.get_channel_ids(),
+        is_filtered=freq_min is not None
+    )
+    referenced_recording.copy_channel_properties(recording=recording)
+    referenced_recording.dump_to_pickle(folder / "recording.pkl")
+    return load_recording(folder=folder)
@@ -7,24 +7,43 @@ import spikeextractors as se
 import spiketoolkit as st
 import spikesorters as ss
 
+from brody_lab_to_nwb import PoissonClicksNWBConverter
+from brody_lab_to_nwb.sortingpipeline import (
+    PipelineCheckpoints,
+    compare_sorters,
+    get_file_fingerprint,
+    run_sorters_concurrently,
+    save_recording,
+    load_recording,
+    save_sorting,
+    load_sorting,
+    save_dataframe,
+    load_dataframe,
+)
+from brody_lab_to_nwb.spikeglxpreprocessing import stream_common_median_reference
+from brody_lab_to_nwb.qualitymetrics import compute_quality_metrics, curate_sorting
+
 
 n_jobs = 4
 chunk_mb = 2000
 export_raw_to_phy = False
 export_curated_to_phy = True
 
-# Define sorter and params
+# Define sorters and params
 
+# Listing several sorters runs them all at once on the preprocessed recording, splitting n_jobs and chunk_mb between
+# them, and writes a table comparing their outputs; postprocessing and curation then continue with the chosen sorter
+sorter_params = dict(
+    ironclust=dict(),
+    # kilosort2=dict(car=False),
+)
 sorter = "ironclust"
-sorter_params = {}
 
 
 # on the cluster it's better to point to the sorter inside the script
 ss.IronClustSorter.set_ironclust_path("/Users/abuccino/Documents/Codes/spike_sorting/sorters/ironclust")
 # ss.Kilosort2Sorter.set_kilosort2_path("$HOME/Documents/Codes/spike_sorting/sorters/kilsort2")
 
-# sorter_params = dict(car=False, n_jobs_bin=n_jobs, chunk_mb=chunk_mb)
-
 # Auto curation params
 
 # (Use None to skip one of the curation steps)
@@ -32,6 +51,13 @@ isi_violation_threshold = 0.5
 snr_threshold = 5
 firing_rate_threshold = 0.1
 
+# Maps each metric to (threshold, threshold_sign); units whose metric is on the threshold_sign side are excluded
+curation_thresholds = dict(
+    firing_rate=(firing_rate_threshold, "less"),
+    isi_violation=(isi_violation_threshold, "greater"),
+    snr=(snr_threshold, "less"),
+)
+
 # 1a) Load AP recordings, LF recordings and TTL signals
 
 base_path = Path("/Users/abuccino/Documents/Data/catalyst/brody")
@@ -49,32 +75,55 @@ recording_folder = raw_data_path / session_name
 spikeinterface_folder = recording_folder / "spikeinterface"
 spikeinterface_folder.mkdir(parents=True, exist_ok=True)
 
+# Each stage below is checkpointed in this folder, keyed by its inputs and parameters; rerunning the script only
+# recomputes the stages whose inputs changed, e.g. changing only the curation thresholds skips sorting and waveforms
+checkpoints = PipelineCheckpoints(checkpoint_folder=spikeinterface_folder / "checkpoints")
+
 # (optional) stub recording for fast testing; set to False for running processing pipeline on entire data
 
 stub_test = True
 nsec_stub = 5
 
-recording_ap = se.SpikeGLXRecordingExtractor(ap_bin_path)
 recording_lf = se.SpikeGLXRecordingExtractor(lf_bin_path)
-
 if stub_test:
     print("Stub test! Clipping recordings!")
-    recording_ap = se.SubRecordingExtractor(recording_ap,
-                                            end_frame=int(nsec_stub * recording_ap.get_sampling_frequency()))
     recording_lf = se.SubRecordingExtractor(recording_lf,
                                             end_frame=int(nsec_stub * recording_lf.get_sampling_frequency()))
-
-print(f"Sampling frequency AP: {recording_ap.get_sampling_frequency()}")
 print(f"Sampling frequency LF: {recording_lf.get_sampling_frequency()}")
 
 # 2) Pre-processing
 
 apply_cmr = True
-
-if apply_cmr:
-    recording_processed = st.preprocessing.common_reference(recording_ap)
-else:
-    recording_processed = recording_ap
+highpass_freq_min = None  # (e.g. 300.) to high-pass filter before the reference
+cmr_chunk_mb = 100  # memory per thread of the streamed reference
+
+
+def preprocess(stage_folder):
+    end_frame = None
+    if stub_test:
+        print("Stub test! Clipping recordings!")
+        end_frame = int(nsec_stub * se.SpikeGLXRecordingExtractor(ap_bin_path).get_sampling_frequency())
+    if apply_cmr:
+        # Stream the median reference straight from the memory mapped .bin into the int16 binary of the stage
+        return stream_common_median_reference(ap_bin_path, folder=stage_folder, end_frame=end_frame,
+                                              freq_min=highpass_freq_min, n_jobs=n_jobs, chunk_mb=cmr_chunk_mb)
+    recording_ap = se.SpikeGLXRecordingExtractor(ap_bin_path)
+    if end_frame is not None:
+        recording_ap = se.SubRecordingExtractor(recording_ap, end_frame=end_frame)
+    if highpass_freq_min is not None:
+        recording_ap = st.preprocessing.highpass_filter(recording_ap, freq_min=highpass_freq_min)
+    # Materialize the preprocessed traces once; every later stage reads this memory mapped binary
+    return save_recording(recording_ap, folder=stage_folder, n_jobs=n_jobs, chunk_mb=chunk_mb)
+
+
+recording_processed = checkpoints.run_stage(
+    stage="preprocessing",
+    params=dict(ap_bin=get_file_fingerprint(ap_bin_path), stub_test=stub_test, nsec_stub=nsec_stub,
+                apply_cmr=apply_cmr, highpass_freq_min=highpass_freq_min, output_dtype="int16"),
+    compute=preprocess,
+    load=load_recording
+)
+print(f"Sampling frequency AP: {recording_processed.get_sampling_frequency()}")
 
 num_frames = recording_processed.get_num_frames()
 
@@ -95,10 +144,21 @@ num_frames = recording_processed.get_num_frames()
 # sw.plot_activity_map(recording_processed, activity="amplitude", colorbar=True, ax=axs[1])
 
 
-# 3) Run spike sorter
-print(f"Running {sorter}")
-sorting = ss.run_sorter(sorter, recording_processed, output_folder=spikeinterface_folder / sorter / "output",
-                        verbose=True, **sorter_params)
+# 3) Run spike sorters
+sortings = run_sorters_concurrently(checkpoints=checkpoints, sorter_params=sorter_params, n_jobs=n_jobs,
+                                    chunk_mb=chunk_mb)
+
+if len(sortings) > 1:
+    sorter_comparison = compare_sorters(sortings=sortings, checkpoints=checkpoints)
+    sorter_comparison.to_csv(spikeinterface_folder / "sorter_comparison.csv")
+    print(sorter_comparison)
+
+if sorter not in sortings:
+    raise ValueError(
+        f"The chosen sorter '{sorter}' did not produce a sorting; "
+        f"see {checkpoints.checkpoint_folder / f'sorting_{sorter}' / 'sorter.log'}."
+    )
+sorting = sortings[sorter]
 
 # 4) Post-processing: extract waveforms, templates, quality metrics, extracellular features
 
@@ -114,6 +174,10 @@ postprocessing_params['n_jobs'] = n_jobs  # n jobs
 postprocessing_params['chunk_mb'] = chunk_mb  # max RAM usage in Mb
 postprocessing_params['verbose'] = True  # max RAM usage in Mb
 
+# The parameters that only affect speed and memory use do not invalidate the postprocessing checkpoints
+postprocessing_key_params = {key: value for key, value in postprocessing_params.items()
+                             if key not in ["n_jobs", "chunk_mb", "chunk_size", "verbose", "joblib_backend"]}
+
 # Set quality metric list
 
 # Quality metrics
@@ -141,95 +205,134 @@ tmp_folder.mkdir(parents=True, exist_ok=True)
 # set local tmp folder
 sorting.set_tmp_folder(tmp_folder)
 
-# compute waveforms
-waveforms = st.postprocessing.get_unit_waveforms(recording_processed, sorting, **postprocessing_params)
 
-# compute templates
+# compute waveforms and templates; both are saved with the sorting, and reused by every later stage
+def extract_waveforms(stage_folder):
+    st.postprocessing.get_unit_waveforms(recording_processed, sorting, **postprocessing_params)
+    st.postprocessing.get_unit_templates(recording_processed, sorting, **postprocessing_params)
+    return save_sorting(sorting, folder=stage_folder)
+
+
+sorting = checkpoints.run_stage(
+    stage="waveforms",
+    params=postprocessing_key_params,
+    compute=extract_waveforms,
+    load=load_sorting,
+    depends_on=[f"sorting_{sorter}"]
+)
+sorting.set_tmp_folder(tmp_folder)
+waveforms = st.postprocessing.get_unit_waveforms(recording_processed, sorting, **postprocessing_params)
 templates = st.postprocessing.get_unit_templates(recording_processed, sorting, **postprocessing_params)
 
 # comput EC features
-ec = st.postprocessing.compute_unit_template_features(
-    recording_processed,
-    sorting,
-    feature_names=ec_list,
-    as_dataframe=True
+ec = checkpoints.run_stage(
+    stage="template_features",
+    params=dict(ec_list=ec_list),
+    compute=lambda stage_folder: save_dataframe(
+        st.postprocessing.compute_unit_template_features(
+            recording_processed,
+            sorting,
+            feature_names=ec_list,
+            as_dataframe=True
+        ),
+        folder=stage_folder,
+        name="template_features"
+    ),
+    load=lambda stage_folder: load_dataframe(folder=stage_folder, name="template_features"),
+    depends_on=["waveforms"]
 )
 
-# compute QCs
-qc = st.validation.compute_quality_metrics(
-    sorting,
-    recording=recording_processed,
-    metric_names=qc_list,
-    as_dataframe=True
+# compute QCs; every metric is computed in one pass and kept as a table, which the curation then thresholds
+qc_list = qc_list + [x for x in curation_thresholds if x not in qc_list]
+qc = checkpoints.run_stage(
+    stage="quality_metrics",
+    params=dict(qc_list=qc_list),
+    compute=lambda stage_folder: save_dataframe(
+        compute_quality_metrics(
+            sorting,
+            recording=recording_processed,
+            metric_names=qc_list
+        ),
+        folder=stage_folder,
+        name="quality_metrics"
+    ),
+    load=lambda stage_folder: load_dataframe(folder=stage_folder, name="quality_metrics"),
+    depends_on=["waveforms"]
 )
 
 # export raw to phy
 if export_raw_to_phy:
-    phy_folder = spikeinterface_folder / sorter / "phy_raw"
-    phy_folder.mkdir(parents=True, exist_ok=True)
-    st.postprocessing.export_to_phy(recording_processed, sorting, phy_folder,
-                                    recompute_info=True)
-  
+    checkpoints.run_stage(
+        stage="phy_raw",
+        params=dict(),
+        compute=lambda stage_folder: st.postprocessing.export_to_phy(recording_processed, sorting,
+                                                                     stage_folder / "phy", recompute_info=True),
+        load=lambda stage_folder: None,
+        depends_on=["waveforms"]
+    )
+
+
 # 5) Automatic curation
 
-# firing rate threshold
-if firing_rate_threshold is not None:
-    sorting_curated = st.curation.threshold_firing_rates(
-        sorting,
-        duration_in_frames=num_frames,
-        threshold=firing_rate_threshold,
-        threshold_sign='less'
-    )
-else:
-    sorting_curated = sorting
-
-# isi violation threshold
-if isi_violation_threshold is not None:
-    sorting_curated = st.curation.threshold_isi_violations(
-        sorting_curated,
-        duration_in_frames=num_frames,
-        threshold=isi_violation_threshold,
-        threshold_sign='greater'
-    )
-    
-
-# SNR threshold
-if snr_threshold is not None:
-    sorting_curated = st.curation.threshold_snrs(
-        sorting_curated,
-        recording=recording_processed,
-        threshold=snr_threshold,
-        threshold_sign='less'
-    )
+# thresholds the quality metrics table, without another pass over the recording or the spike trains
+sorting_curated = checkpoints.run_stage(
+    stage="curation",
+    params=dict(curation_thresholds=curation_thresholds),
+    compute=lambda stage_folder: save_sorting(
+        curate_sorting(sorting, quality_metrics=qc, thresholds=curation_thresholds),
+        folder=stage_folder
+    ),
+    load=load_sorting,
+    depends_on=["waveforms", "quality_metrics"]
+)
 
 print(f"{sorter} found {len(sorting_curated.get_unit_ids())} units after auto curation")
 
 
 # export curated to phy
-if export_cutated_to_phy:
-    phy_folder = spikeinterface_folder / sorter / "phy_curated"
-    phy_folder.mkdir(parents=True, exist_ok=True)
-    
+if export_curated_to_phy:
     # avoid recomputing waveforms twice
     if export_raw_to_phy:
         recompute_info = False
     else:
         recompute_info = True
-        
-    st.postprocessing.export_to_phy(recording_processed, sorting_curated, phy_folder, 
-                                    recompute_info=recompute_info)
+
+    checkpoints.run_stage(
+        stage="phy_curated",
+        params=dict(),
+        compute=lambda stage_folder: st.postprocessing.export_to_phy(recording_processed, sorting_curated,
+                                                                     stage_folder / "phy",
+                                                                     recompute_info=recompute_info),
+        load=lambda stage_folder: None,
+        depends_on=["curation"]
+    )
 
 
-# 7) Save to NWB; writes only the spikes
+# 7) Save to NWB; writes the raw data, LFP, behavior, units, templates and quality metrics in one pass
 
 # The name of the NWBFile containing behavioral or full recording data
 nwbfile_path = raw_data_path / session_name / f"{session_name}.nwb"
+processed_file_path = raw_data_path / session_name / "Processed" / f"{session_name}_Cells.mat"
 
 # Choose the sorting extractor from the notebook environment you would like to write to NWB
 chosen_sorting_extractor = sorting_curated
 
-se.NwbSortingExtractor.write_sorting(
-    sorting=chosen_sorting_extractor,
-    save_path=nwbfile_path,
-    overwrite=False  # this appends the file. True would write a new file
+source_data = dict(
+    SpikeGLXRecording=dict(file_path=str(ap_bin_path)),
+    SpikeGLXLFP=dict(file_path=str(lf_bin_path)),
+    CuratedSorting=dict(sorting=chosen_sorting_extractor, quality_metrics=qc)
+)
+if processed_file_path.is_file():
+    source_data.update(ProcessedBehavior=dict(file_path=str(processed_file_path)))
+conversion_options = dict(SpikeGLXRecording=dict(stub_test=stub_test), SpikeGLXLFP=dict(stub_test=stub_test))
+# Set incremental to True to only rewrite the units, and anything else whose inputs changed, when rerunning on a new
+# sorting, leaving the raw data of the NWB file in place
+incremental = False
+converter = PoissonClicksNWBConverter(source_data=source_data)
+converter.run_conversion(
+    nwbfile_path=str(nwbfile_path),
+    metadata=converter.get_metadata(),
+    conversion_options=conversion_options,
+    overwrite=True,
+    incremental=incremental
 )
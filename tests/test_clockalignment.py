@@ -0,0 +1,33 @@
+"""Authors: Cody Baker."""
+import numpy as np
+import pytest
+
+from brody_lab_to_nwb.interfaces.clockalignment import fit_clock_mapping
+
+
+def test_fit_clock_mapping_splits_at_a_pause():
+    rng = np.random.default_rng(seed=0)
+    # One sync pulse per second of the source clock; the recording is paused for 30 s of the target clock after 100
+    source_times = np.arange(200.)
+    pauses = np.where(np.arange(200) < 100, 0., 30.)
+    target_times = 12. + 1.0001 * source_times + pauses + rng.uniform(low=-1e-4, high=1e-4, size=200)
+
+    clock_mapping = fit_clock_mapping(source_times=source_times, target_times=target_times)
+    assert len(clock_mapping) == 2
+    np.testing.assert_array_equal(clock_mapping.segment_starts, source_times[[0, 100]])
+    np.testing.assert_allclose(clock_mapping.slopes, 1.0001, rtol=1e-6)
+    np.testing.assert_allclose(clock_mapping(source_times), target_times, atol=2e-4)
+
+
+def test_fit_clock_mapping_without_a_pause_is_linear():
+    source_times = np.arange(50.)
+    clock_mapping = fit_clock_mapping(source_times=source_times, target_times=2. * source_times + 3.)
+    assert len(clock_mapping) == 1
+    np.testing.assert_allclose([clock_mapping.slopes[0], clock_mapping.intercepts[0]], [2., 3.])
+
+
+def test_fit_clock_mapping_needs_increasing_pairs_of_pulses():
+    with pytest.raises(ValueError):
+        fit_clock_mapping(source_times=[0., 1.], target_times=[0., 1., 2.])
+    with pytest.raises(ValueError):
+        fit_clock_mapping(source_times=[0., 2., 1.], target_times=[0., 1., 2.])
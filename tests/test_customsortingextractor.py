@@ -0,0 +1,100 @@
+"""Authors: Cody Baker."""
+import numpy as np
+import pytest
+
+from brody_lab_to_nwb.interfaces.customsortingextractor import CustomSortingExtractor
+from brody_lab_to_nwb.interfaces.trialalignedpsthinterface import get_trial_aligned_spike_counts
+
+
+def make_sorting():
+    """Units added one at a time, in bulk, and lazily, including units without spikes."""
+    sorting = CustomSortingExtractor()
+    sorting.set_sampling_frequency(sampling_frequency=1.)
+    sorting.add_unit(unit_id=1, times=[3., 1., 2.])
+    sorting.add_unit(unit_id=2, times=[])
+    sorting.add_units(unit_ids=[3, 4, 5], spike_times=[0.5, 9., 4., 5., 6.], offsets=[0, 3, 3, 5])
+    return sorting
+
+
+def test_add_and_query_units():
+    sorting = make_sorting()
+    assert sorting.get_unit_ids() == [1, 2, 3, 4, 5]
+    np.testing.assert_array_equal(sorting.get_unit_spike_train(unit_id=1), [1., 2., 3.])
+    np.testing.assert_array_equal(sorting.get_unit_spike_train(unit_id=3), [0.5, 4., 9.])
+    assert len(sorting.get_unit_spike_train(unit_id=2)) == 0
+    assert len(sorting.get_unit_spike_train(unit_id=4)) == 0
+    np.testing.assert_array_equal(sorting.get_unit_spike_train(unit_id=3, start_frame=1, end_frame=9), [4.])
+
+    spike_times, offsets = sorting.get_spike_trains()
+    np.testing.assert_array_equal(spike_times, [1., 2., 3., 0.5, 4., 9., 5., 6.])
+    np.testing.assert_array_equal(offsets, [0, 3, 3, 6, 6, 8])
+    assert not spike_times.flags.writeable
+
+
+def test_add_units_checks_offsets_and_ids():
+    sorting = make_sorting()
+    with pytest.raises(ValueError):
+        sorting.add_units(unit_ids=[6, 7], spike_times=[1., 2.], offsets=[0, 2])
+    with pytest.raises(ValueError):
+        sorting.add_unit(unit_id=1, times=[1.])
+
+
+def test_lazy_units_are_loaded_once_on_first_query():
+    spike_trains = [np.array([2., 1.]), np.array([]), np.array([5.])]
+    loaded = []
+
+    def load_unit(j):
+        loaded.append(j)
+        return spike_trains[j]
+
+    sorting = make_sorting()
+    sorting.add_lazy_units(unit_ids=[6, 7, 8], offsets=[0, 2, 2, 3], load_unit=load_unit)
+    assert loaded == []
+    np.testing.assert_array_equal(sorting.get_unit_spike_train(unit_id=6), [1., 2.])
+    np.testing.assert_array_equal(sorting.get_unit_spike_train(unit_id=6), [1., 2.])
+    assert loaded == [0]
+
+    spike_times, offsets = sorting.get_spike_trains()
+    assert sorted(loaded) == [0, 1, 2]
+    np.testing.assert_array_equal(spike_times[offsets[5]:], [1., 2., 5.])
+    np.testing.assert_array_equal(np.diff(offsets)[5:], [2, 0, 1])
+
+
+def test_spike_trains_in_windows_match_a_mask():
+    sorting = make_sorting()
+    window_starts = np.array([0., 1.5, 4., 8.])
+    window_ends = np.array([1.5, 4., 4., 10.])
+    spike_times, offsets = sorting.get_spike_trains_in_windows(
+        window_starts=window_starts, window_ends=window_ends, reference_times=window_starts
+    )
+    expected = [
+        times[(times >= start) & (times < end)] - start
+        for times in [sorting.get_unit_spike_train(unit_id=x) for x in sorting.get_unit_ids()]
+        for start, end in zip(window_starts, window_ends)
+    ]
+    np.testing.assert_array_equal(np.diff(offsets), [len(x) for x in expected])
+    np.testing.assert_array_equal(spike_times, np.concatenate(expected))
+
+
+def test_windows_around_nan_events_are_empty():
+    sorting = make_sorting()
+    event_times = np.array([1., np.nan, 4.])
+    spike_times, offsets = sorting.get_spike_trains_in_windows(
+        window_starts=event_times - 1., window_ends=event_times + 1., reference_times=event_times
+    )
+    spike_counts = np.diff(offsets).reshape(len(sorting.get_unit_ids()), len(event_times))
+    np.testing.assert_array_equal(spike_counts[:, 1], 0)
+    np.testing.assert_array_equal(spike_counts[0], [1, 0, 1])
+    assert not np.any(np.isnan(spike_times))
+
+    spike_counts = get_trial_aligned_spike_counts(
+        sorting=sorting, event_times=event_times, window_start=-1., window_stop=1., bin_size=0.5
+    )
+    assert spike_counts.shape == (5, 3, 4)
+    np.testing.assert_array_equal(spike_counts[:, 1], 0)
+    np.testing.assert_array_equal(spike_counts[0, 0], [0, 0, 1, 0])
+
+
+def test_windows_must_not_end_before_they_start():
+    with pytest.raises(ValueError):
+        make_sorting().get_spike_trains_in_windows(window_starts=[2.], window_ends=[1.])
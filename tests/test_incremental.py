@@ -0,0 +1,129 @@
+"""Authors: Cody Baker."""
+import sys
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pytest
+from pynwb import NWBHDF5IO
+
+from brody_lab_to_nwb import BrodyNeuralynxNWBConverter
+from brody_lab_to_nwb.incremental import get_interface_fingerprint, plan_incremental_update, remove_objects
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "benchmarks"))
+from fixtures import write_msorted, write_neuralynx  # noqa: E402
+
+object_paths = dict(
+    Recording=["/acquisition/raw"],
+    LFP=["/processing/ecephys", "/processing/ecephys/LFP"],
+    Sorting=["/units", "/units/spike_times"],
+    QualityMetrics=["/units/snr"],
+    PSTH=["/processing/ecephys/PSTH"],
+)
+
+
+@pytest.fixture
+def nwbfile_path(tmp_path):
+    """A small HDF5 file laid out like an NWB file, with a soft link, an object reference and a shared table."""
+    nwbfile_path = tmp_path / "test.nwb"
+    with h5py.File(nwbfile_path, mode="w") as file:
+        device = file.create_group("general/devices/probe")
+        file.create_dataset("acquisition/raw/data", data=np.zeros((10, 2)))
+        file["acquisition/raw/device"] = h5py.SoftLink(device.name)
+        file.create_dataset("processing/ecephys/LFP/data", data=np.zeros((10, 2)))
+        units = file.create_group("units")
+        units.attrs["colnames"] = ["spike_times", "snr"]
+        units.create_dataset("spike_times", data=np.arange(3.))
+        units.create_dataset("snr", data=np.ones(3))
+        psth = file.create_group("processing/ecephys/PSTH")
+        psth.create_dataset("unit", data=[units.ref], dtype=h5py.ref_dtype)
+    return nwbfile_path
+
+
+def test_only_the_changed_interface_is_removed(nwbfile_path):
+    rewritten_interface_names, removed_paths = plan_incremental_update(
+        nwbfile_path=nwbfile_path, object_paths=object_paths, changed_interface_names=["LFP"]
+    )
+    # The ecephys module also holds the PSTH, so only the LFP is removed from it
+    assert rewritten_interface_names == {"LFP"}
+    assert removed_paths == ["/processing/ecephys/LFP"]
+
+    remove_objects(nwbfile_path=nwbfile_path, paths=removed_paths)
+    with h5py.File(nwbfile_path, mode="r") as file:
+        assert "processing/ecephys/LFP" not in file
+        assert "processing/ecephys/PSTH" in file
+
+
+def test_dependent_interfaces_are_rewritten(nwbfile_path):
+    # The snr column is part of the units table, which is written as a whole, and the PSTH refers to that table
+    rewritten_interface_names, removed_paths = plan_incremental_update(
+        nwbfile_path=nwbfile_path, object_paths=object_paths, changed_interface_names=["QualityMetrics"]
+    )
+    assert rewritten_interface_names == {"QualityMetrics", "Sorting", "PSTH"}
+    assert removed_paths == ["/processing/ecephys/PSTH", "/units"]
+
+
+def test_objects_without_an_interface_force_a_full_rewrite(nwbfile_path):
+    with h5py.File(nwbfile_path, mode="r+") as file:
+        file["general/extracellular_ephys/group/device"] = h5py.SoftLink("/acquisition/raw")
+    rewritten_interface_names, removed_paths = plan_incremental_update(
+        nwbfile_path=nwbfile_path, object_paths=object_paths, changed_interface_names=["Recording"]
+    )
+    assert rewritten_interface_names is None
+    assert removed_paths == []
+
+
+def test_incremental_conversion_rewrites_only_the_changed_interfaces(tmp_path):
+    raw_folder_path = tmp_path / "raw"
+    write_neuralynx(folder_path=raw_folder_path, n_channels=2, duration=2.)
+    msorted_file_path = tmp_path / "Msorted.mat"
+    write_msorted(file_path=msorted_file_path, n_trials=20, n_units=3, spikes_per_unit=100.)
+    nwbfile_path = str(tmp_path / "test.nwb")
+    source_data = dict(
+        NeuralynxRecording=dict(folder_path=str(raw_folder_path)),
+        NeuralynxLFP=dict(folder_path=str(raw_folder_path)),
+        ProcessedBehavior=dict(file_path=str(msorted_file_path)),
+        MSorted=dict(file_path=str(msorted_file_path)),
+    )
+
+    def run_conversion():
+        converter = BrodyNeuralynxNWBConverter(source_data=source_data)
+        metadata = converter.get_metadata()
+        metadata["NWBFile"].update(session_start_time="2020-01-01T00:00:00")
+        converter.run_conversion(nwbfile_path=nwbfile_path, metadata=metadata, incremental=True)
+        with h5py.File(nwbfile_path, mode="r") as file:
+            return {x: file[x].attrs["object_id"] for x in ["acquisition/ElectricalSeries_raw", "units"]}
+
+    object_ids = run_conversion()
+    assert run_conversion() == object_ids
+
+    write_msorted(file_path=msorted_file_path, n_trials=25, n_units=4, spikes_per_unit=100., seed=1)
+    updated_object_ids = run_conversion()
+    assert updated_object_ids["acquisition/ElectricalSeries_raw"] == object_ids["acquisition/ElectricalSeries_raw"]
+    assert updated_object_ids["units"] != object_ids["units"]
+    with NWBHDF5IO(nwbfile_path, mode="r") as io:
+        nwbfile = io.read()
+        assert len(nwbfile.units) == 4
+        assert len(nwbfile.trials) == 25
+        assert nwbfile.acquisition["ElectricalSeries_raw"].data.shape == (64000, 2)
+
+
+def test_fingerprint_covers_the_declared_input_files(tmp_path):
+    class Interface:
+        source_data = dict()
+        input_file_paths = (tmp_path / "column_mapping.csv",)
+
+        def get_metadata(self):
+            return dict()
+
+    def get_fingerprint():
+        return get_interface_fingerprint(
+            interface=Interface(), metadata=dict(), conversion_options=dict(), file_entries=dict()
+        )
+
+    column_mapping_file_path = Interface.input_file_paths[0]
+    column_mapping_file_path.write_text("mat_name,nwb_name,nwb_description\nhit,hit,Whether the trial was a hit.\n")
+    fingerprint = get_fingerprint()
+    assert get_fingerprint() == fingerprint
+    column_mapping_file_path.write_text("mat_name,nwb_name,nwb_description\nhit,hit,Whether the rat was right.\n")
+    assert get_fingerprint() != fingerprint
@@ -0,0 +1,48 @@
+"""Authors: Cody Baker."""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from brody_lab_to_nwb.interfaces.h5pool import H5FilePool
+from brody_lab_to_nwb.interfaces.msorted.msortedsortinginterface import MSortedSortingInterface
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "benchmarks"))
+from fixtures import write_msorted  # noqa: E402
+
+
+@pytest.fixture
+def file_path(tmp_path):
+    file_path = tmp_path / "Msorted_test.mat"
+    write_msorted(file_path=file_path, n_trials=5, n_units=3, spikes_per_unit=20.)
+    return str(file_path)
+
+
+def test_lazy_units_match_the_bulk_read(file_path):
+    sorting_interface = MSortedSortingInterface(file_path=file_path)
+    with MSortedSortingInterface(file_path=file_path, lazy=True) as lazy_sorting_interface:
+        for unit_id in sorting_interface.sorting_extractor.get_unit_ids():
+            np.testing.assert_array_equal(
+                lazy_sorting_interface.sorting_extractor.get_unit_spike_train(unit_id=unit_id),
+                sorting_interface.sorting_extractor.get_unit_spike_train(unit_id=unit_id)
+            )
+
+
+def test_lazy_units_fail_clearly_once_the_file_is_closed(file_path):
+    with MSortedSortingInterface(file_path=file_path, lazy=True) as sorting_interface:
+        sorting_interface.sorting_extractor.get_unit_spike_train(unit_id=0)
+    assert sorting_interface.h5_pool.closed and len(sorting_interface.h5_pool) == 0
+    with pytest.raises(ValueError, match="has been closed"):
+        sorting_interface.sorting_extractor.get_unit_spike_train(unit_id=1)
+    assert len(sorting_interface.h5_pool) == 0
+
+
+def test_a_shared_pool_is_closed_by_its_owner(file_path):
+    with H5FilePool().activate() as h5_pool:
+        sorting_interface = MSortedSortingInterface(file_path=file_path, lazy=True)
+    sorting_interface.close()
+    assert not h5_pool.closed and len(h5_pool) == 1
+    h5_pool.close()
+    with pytest.raises(ValueError, match="has been closed"):
+        sorting_interface.sorting_extractor.get_unit_spike_train(unit_id=0)
@@ -0,0 +1,71 @@
+"""Authors: Cody Baker."""
+import numpy as np
+import pytest
+import spikeextractors as se
+
+from brody_lab_to_nwb.qualitymetrics import compute_isi_violations, compute_quality_metrics, get_spike_trains
+
+sampling_frequency = 30000.
+
+
+def make_sorting(rng: np.random.Generator, n_frames: int, n_units: int = 5):
+    """Random spike trains, with a few violations and duplicates of the refractory period in each."""
+    sorting = se.NumpySortingExtractor()
+    sorting.set_sampling_frequency(sampling_frequency)
+    for unit_id in range(n_units):
+        spike_frames = rng.integers(low=0, high=n_frames - 100, size=rng.integers(low=20, high=200))
+        spike_frames = np.concatenate((spike_frames, spike_frames[:5] + 10, spike_frames[5:7]))
+        sorting.add_unit(unit_id, np.sort(spike_frames))
+    return sorting
+
+
+def test_isi_violations_match_spikemetrics():
+    spikemetrics = pytest.importorskip("spikemetrics.metrics")
+
+    rng = np.random.default_rng(seed=0)
+    sorting = make_sorting(rng=rng, n_frames=300000)
+    duration = 10.
+    spike_frames, offsets = get_spike_trains(sorting=sorting)
+    spike_times = spike_frames / sampling_frequency
+    min_isi = 0.5 / sampling_frequency
+    isi_violations = compute_isi_violations(
+        spike_times=spike_times, offsets=offsets, duration=duration, isi_threshold=0.0015, min_isi=min_isi
+    )
+    expected = [
+        spikemetrics.isi_violations(
+            spike_train=spike_times[offsets[j]:offsets[j + 1]],
+            duration=duration,
+            isi_threshold=0.0015,
+            min_isi=min_isi
+        )[0]
+        for j in range(len(offsets) - 1)
+    ]
+    assert np.all(isi_violations > 0)
+    np.testing.assert_allclose(isi_violations, expected)
+
+
+def test_quality_metrics_match_spiketoolkit():
+    st = pytest.importorskip("spiketoolkit")
+
+    rng = np.random.default_rng(seed=0)
+    n_frames = int(5 * sampling_frequency)
+    recording = se.NumpyRecordingExtractor(
+        timeseries=rng.normal(scale=10., size=(4, n_frames)).astype("float32"), sampling_frequency=sampling_frequency
+    )
+    sorting = make_sorting(rng=rng, n_frames=n_frames)
+    st.postprocessing.get_unit_templates(recording, sorting, max_spikes_per_unit=1000, seed=0)
+    metric_names = ["num_spikes", "firing_rate", "isi_violation", "snr"]
+
+    metrics = compute_quality_metrics(sorting, recording=recording, metric_names=metric_names)
+    expected = st.validation.compute_quality_metrics(
+        sorting, recording=recording, metric_names=metric_names, as_dataframe=True
+    )
+    assert list(metrics.index) == sorting.get_unit_ids()
+    for metric_name in metric_names:
+        np.testing.assert_allclose(metrics[metric_name].to_numpy(), expected[metric_name].to_numpy())
+
+
+def test_unknown_quality_metrics_are_rejected():
+    recording = se.NumpyRecordingExtractor(timeseries=np.zeros((1, 10)), sampling_frequency=sampling_frequency)
+    with pytest.raises(ValueError):
+        compute_quality_metrics(se.NumpySortingExtractor(), recording=recording, metric_names=["amplitude"])